@@ -1,4 +1,14 @@
-from dataclasses import dataclass
+import os
+from dataclasses import dataclass, field
+from typing import Dict, Optional, Tuple
+
+
+def _env_mapping(name: str) -> Dict[str, str]:
+    """
+    Словарь из переменной окружения вида "ключ=значение,ключ=значение"
+    """
+    items = (item.split("=", 1) for item in os.environ.get(name, "").split(",") if "=" in item)
+    return {key.strip(): value.strip() for key, value in items}
 
 @dataclass
 class EnvironmentConfig:
@@ -32,13 +42,31 @@ class QdrantConfig:
     Конфигурация Qdrant.
 
     Attributes:
-        host (str): Хост сервера Qdrant
-        port (int): Порт сервера Qdrant
+        host (str): Хост сервера Qdrant (переменная окружения QDRANT_HOST)
+        port (int): REST порт сервера Qdrant (QDRANT_PORT)
         collection_name (str): Название коллекции
+        grpc_port (int): gRPC порт сервера Qdrant (QDRANT_GRPC_PORT)
+        prefer_grpc (bool): Использовать gRPC вместо REST (QDRANT_PREFER_GRPC)
+        timeout (int): Таймаут запроса к Qdrant в секундах
+        pool_size (int): Размер пула REST соединений
+        keepalive_seconds (int): Интервал keepalive соединений в секундах
+        max_retries (int): Количество повторов при недоступности Qdrant
+        backoff_base (float): Начальная пауза между повторами в секундах
+        backoff_max (float): Максимальная пауза между повторами в секундах
     """
-    host: str = "localhost"
-    port: int = 6333
+    host: str = field(default_factory=lambda: os.environ.get("QDRANT_HOST", "localhost"))
+    port: int = field(default_factory=lambda: int(os.environ.get("QDRANT_PORT", 6333)))
     collection_name: str = "nornikel_prod"
+    grpc_port: int = field(default_factory=lambda: int(os.environ.get("QDRANT_GRPC_PORT", 6334)))
+    prefer_grpc: bool = field(
+        default_factory=lambda: os.environ.get("QDRANT_PREFER_GRPC", "true").lower() in ("1", "true", "yes")
+    )
+    timeout: int = 10  # секунд
+    pool_size: int = 32
+    keepalive_seconds: int = 30
+    max_retries: int = 5
+    backoff_base: float = 0.2  # секунд
+    backoff_max: float = 5.0  # секунд
 
 @dataclass
 class DatabaseConfig:
@@ -48,7 +76,7 @@ class DatabaseConfig:
     Attributes:
         qdrant (QdrantConfig): Конфигурация Qdrant
     """
-    qdrant: QdrantConfig = QdrantConfig()
+    qdrant: QdrantConfig = field(default_factory=QdrantConfig)
 
 @dataclass
 class ModelConfig:
@@ -66,6 +94,24 @@ class ModelConfig:
     device: str = "cuda:0"
     dtype: str = "bfloat16"
 
+@dataclass
+class ModelServerConfig:
+    """
+    Конфигурация отдельного процесса с моделями.
+
+    Attributes:
+        address (str): Путь Unix-сокета модельного сервера (MODEL_SERVER_ADDRESS);
+            если не задан, каждый процесс загружает модели сам
+        authkey (str): Ключ аутентификации подключений (MODEL_SERVER_AUTHKEY), общий
+            секрет сервера и воркеров; без него модельный сервер не запускается
+        encoder_model_name (str): Модель кодирования запросов
+        multimodal_model_name (str): Модель генерации ответов
+    """
+    address: Optional[str] = field(default_factory=lambda: os.environ.get("MODEL_SERVER_ADDRESS"))
+    authkey: Optional[str] = field(default_factory=lambda: os.environ.get("MODEL_SERVER_AUTHKEY"))
+    encoder_model_name: str = "vidore/colqwen2-v0.1"
+    multimodal_model_name: str = "openbmb/MiniCPM-V-2_6-int4"
+
 @dataclass
 class IndexingMetadata:
     """
@@ -83,12 +129,102 @@ class IndexingConfig:
 
     Attributes:
         data_directory (str): Директория с данными
-        batch_size (int): Размер батча для обработки
+        batch_size (int): Максимальный размер батча (фактический подбирается по бюджету токенов)
+        token_budget (int): Бюджет визуальных токенов на батч с учетом паддинга
+            (None - по свободной памяти GPU)
+        max_image_tokens (int): Бюджет визуальных токенов на страницу: по нему выбирается DPI
+            растеризации PDF и размер входа энкодера (кратный патчу 28 пикселей)
         metadata (IndexingMetadata): Метаданные индексации
+        keep_versions (int): Сколько версий коллекции хранить для отката при переиндексации
+        smoke_query (str): Пробный запрос для проверки новой версии перед переключением алиаса
+        checkpoint_path (str): Файл контрольной точки для возобновления индексации
+        max_in_flight_upserts (int): Максимальное число неподтвержденных upsert (wait=False)
+        duplicate_max_distance (int): Порог расстояния Хэмминга перцептивного хэша, до которого
+            страницы считаются копиями и не кодируются повторно (None - без поиска копий,
+            0 - только совпадающие хэши). Страницы с разным текстом могут отличаться на
+            несколько бит, такие страницы не попадут в индекс
+        encoder_workers (int): Процессов CPU для кодирования страниц при полной индексации
+            (0 - одна модель на GPU в процессе индексации)
+        threads_per_worker (int): Потоков torch и ядер на процесс (None - ядра делятся поровну)
     """
     data_directory: str = "data/prepared_data/"
-    batch_size: int = 3
-    metadata: IndexingMetadata = IndexingMetadata()
+    batch_size: int = 16
+    token_budget: Optional[int] = None
+    max_image_tokens: Optional[int] = 768
+    metadata: IndexingMetadata = field(default_factory=IndexingMetadata)
+    keep_versions: int = 2
+    smoke_query: str = "годовой отчет"
+    checkpoint_path: str = "data/index_checkpoint.json"
+    max_in_flight_upserts: int = 4
+    duplicate_max_distance: Optional[int] = None
+    encoder_workers: int = 0
+    threads_per_worker: Optional[int] = None
+
+@dataclass
+class IngestionConfig:
+    """
+    Конфигурация фоновой загрузки пользовательских документов.
+
+    Attributes:
+        upload_directory (str): Директория для загруженных PDF
+        pages_directory (str): Директория для изображений страниц
+        batch_size (int): Максимальный размер батча кодирования страниц
+        max_queued_jobs (int): Максимальное число задач в очереди
+        keep_finished_jobs (int): Сколько завершенных задач хранить для API статуса
+        page_format (str): Формат хранения страниц (WEBP, JPEG, PNG)
+        page_quality (int): Качество сжатия страниц
+        prefetch_batches (int): Сколько батчей растеризуется заранее, пока кодируется текущий
+        max_upload_mb (int): Максимальный размер PDF, принимаемого потоком в память
+    """
+    upload_directory: str = "data/user_loaded_files/raw_files"
+    pages_directory: str = "data/prepared_data/"
+    batch_size: int = 8
+    max_queued_jobs: int = 16
+    keep_finished_jobs: int = 100
+    page_format: str = "WEBP"
+    page_quality: int = 90
+    prefetch_batches: int = 2
+    max_upload_mb: int = 200
+
+@dataclass
+class TenantConfig:
+    """
+    Конфигурация разделения документов по арендаторам.
+
+    Attributes:
+        header (str): Заголовок запроса с подписанным токеном арендатора
+            (без заголовка запрос работает с общим архивом)
+        token_secret (str): Секрет подписи токенов арендаторов (TENANT_TOKEN_SECRET);
+            None - запросы с токеном отклоняются
+        max_pages (int): Квота страниц на арендатора
+        payload_m (int): Связность графов HNSW внутри раздела арендатора
+        admin_token (str): Токен администратора индекса (INDEX_ADMIN_TOKEN) для загрузки
+            в общий архив и управления задачами и разделами всех арендаторов
+            (None - такие запросы отклоняются)
+        admin_header (str): Заголовок с токеном администратора
+    """
+    header: str = "X-Tenant-Token"
+    token_secret: Optional[str] = field(default_factory=lambda: os.environ.get("TENANT_TOKEN_SECRET"))
+    max_pages: int = 2000
+    payload_m: int = 16
+    admin_token: Optional[str] = field(default_factory=lambda: os.environ.get("INDEX_ADMIN_TOKEN"))
+    admin_header: str = "X-Admin-Token"
+
+@dataclass
+class PageImagesConfig:
+    """
+    Конфигурация уменьшенных копий страниц для выдачи.
+
+    Attributes:
+        sizes (dict): Имя размера -> максимальная сторона в пикселях
+        image_format (str): Формат копий (WEBP, JPEG)
+        quality (int): Качество сжатия копий
+        max_age (int): Cache-Control max-age для адресов без версии, в секундах
+    """
+    sizes: Dict[str, int] = field(default_factory=lambda: {"thumb": 256, "preview": 1024})
+    image_format: str = "WEBP"
+    quality: int = 80
+    max_age: int = 3600  # секунд
 
 @dataclass
 class SearchConfig:
@@ -102,17 +238,143 @@ class SearchConfig:
     default_top_k: int = 5
     max_top_k: int = 20
 
+@dataclass
+class QueryPruningConfig:
+    """
+    Конфигурация прореживания токенов запроса перед MaxSim.
+
+    Стоимость MaxSim в Qdrant пропорциональна числу векторов запроса,
+    поэтому паддинг, служебный префикс и малозначимые токены можно
+    отбросить до запроса. Влияние на полноту измеряется бенчмарками
+    (--query-pruning).
+
+    Attributes:
+        enabled (bool): Флаг включения прореживания
+        drop_padding (bool): Отбрасывать паддинг (по attention_mask и нулевым векторам)
+        drop_augmentation (bool): Отбрасывать augmentation-токены ColQwen2 (токен паддинга
+            внутри маски внимания)
+        prefix_tokens (int): Сколько первых токенов служебного префикса отбрасывать
+        min_norm (float): Минимальная норма вектора токена (0 - без порога)
+        max_tokens (int): Максимум токенов запроса; лишние отбрасываются как наиболее
+            похожие на уже оставленные (None - без ограничения)
+    """
+    enabled: bool = False
+    drop_padding: bool = True
+    drop_augmentation: bool = True
+    prefix_tokens: int = 0
+    min_norm: float = 0.0
+    max_tokens: Optional[int] = None
+
+@dataclass
+class LatencySLOConfig:
+    """
+    Конфигурация регулятора точности поиска по целевой задержке.
+
+    Регулятор меняет уровень усилия поиска (0 - самый быстрый, levels - 1 -
+    самый точный) по p95 задержки запроса к Qdrant за последние запросы.
+    Параметры уровня интерполируются между границами.
+
+    Attributes:
+        enabled (bool): Флаг включения регулятора (по умолчанию выключен: поиск
+            использует параметры коллекции)
+        target_p95_ms (float): Целевой p95 задержки запроса к Qdrant, мс
+        headroom (float): Доля цели, ниже которой усилие снова повышается
+        window (int): Число последних запросов для оценки p95
+        min_samples (int): Минимум запросов после смены уровня до следующего решения
+        levels (int): Число уровней усилия
+        hnsw_ef (tuple): Границы hnsw_ef (на самом быстром и самом точном уровне)
+        oversampling (tuple): Границы oversampling квантизации
+        prefetch_factor (tuple): Границы числа кандидатов предвыборки на один результат
+    """
+    enabled: bool = False
+    target_p95_ms: float = 150.0
+    headroom: float = 0.7
+    window: int = 200
+    min_samples: int = 30
+    levels: int = 5
+    hnsw_ef: Tuple[int, int] = (32, 128)
+    oversampling: Tuple[float, float] = (1.0, 2.0)
+    prefetch_factor: Tuple[int, int] = (4, 10)
+
+@dataclass
+class HighlightConfig:
+    """
+    Конфигурация подсветки совпадений на найденных страницах.
+
+    Подсветка считается по мультивектору страницы из Qdrant и эмбеддингу
+    запроса, без повторного кодирования страницы.
+
+    Attributes:
+        threshold (float): Порог нормированного сходства патча для областей (0..1)
+        max_boxes (int): Максимум областей на страницу
+        heatmap (bool): Возвращать тепловую карту по сетке патчей
+        image_token_offset (int): Позиция первого визуального токена страницы, если
+            ее нельзя определить по процессору (модели в отдельном процессе)
+    """
+    threshold: float = 0.6
+    max_boxes: int = 3
+    heatmap: bool = True
+    image_token_offset: int = 4
+
+@dataclass
+class UIConfig:
+    """
+    Конфигурация демонстрационного интерфейса Gradio.
+
+    Attributes:
+        api_url (str): Адрес FastAPI сервиса (NORNIKEL_API_URL); если задан, интерфейс
+            работает как клиент HTTP API и не загружает модели и страницы
+        api_key (str): API-ключ интерфейса (NORNIKEL_API_KEY) из SecurityConfig.api_keys сервиса;
+            без него все сессии делят бюджет запросов IP-адреса интерфейса
+        timeout (float): Таймаут запросов к API в секундах (генерация ответа идет дольше)
+        max_connections (int): Размер общего пула соединений с API
+        image_size (str): Размер изображений найденных страниц (thumb, preview, original)
+        top_k (int): Количество страниц в выдаче
+    """
+    api_url: Optional[str] = field(default_factory=lambda: os.environ.get("NORNIKEL_API_URL"))
+    api_key: Optional[str] = field(default_factory=lambda: os.environ.get("NORNIKEL_API_KEY"))
+    timeout: float = 120.0
+    max_connections: int = 32
+    image_size: str = "preview"
+    top_k: int = 2
+
 @dataclass
 class SecurityConfig:
     """
     Конфигурация безопасности.
 
     Attributes:
-        rate_limit (int): Ограничение количества запросов в минуту
+        rate_limit (int): Ограничение количества запросов поиска в минуту на клиента
         timeout (int): Таймаут запроса в секундах
+        generation_rate_limit (int): Ограничение запросов генерации в минуту на клиента
+        burst_seconds (int): Допустимый всплеск, в секундах бюджета
+        max_in_flight_search (int): Предел одновременных запросов поиска
+        max_in_flight_generation (int): Предел одновременных запросов генерации
+        batch_share (float): Доля предела, после которой отбрасываются batch-запросы
+        shed_retry_after (int): Значение Retry-After при сбросе нагрузки, в секундах
+        upload_rate_limit (int): Ограничение загрузок документов в минуту на клиента
+        max_in_flight_upload (int): Предел одновременных загрузок документов
+        client_key_header (str): Заголовок с API-ключом клиента
+        api_keys (dict): API-ключ -> имя клиента (API_KEYS="ключ=клиент,..."); запросы
+            без известного ключа учитываются по IP-адресу
+        client_priorities (dict): Имя клиента -> класс приоритета (interactive, batch)
+            (API_CLIENT_PRIORITIES="клиент=batch,...")
+        default_priority (str): Приоритет клиентов без записи в client_priorities и по IP
     """
     rate_limit: int = 100  # запросов в минуту
     timeout: int = 30  # секунд
+    generation_rate_limit: int = 20  # запросов в минуту
+    burst_seconds: int = 10
+    max_in_flight_search: int = 32
+    max_in_flight_generation: int = 4
+    batch_share: float = 0.5
+    shed_retry_after: int = 5  # секунд
+    upload_rate_limit: int = 10  # запросов в минуту
+    max_in_flight_upload: int = 4
+    client_key_header: str = "X-API-Key"
+    api_keys: Dict[str, str] = field(default_factory=lambda: _env_mapping("API_KEYS"))
+    client_priorities: Dict[str, str] = field(default_factory=lambda: _env_mapping("API_CLIENT_PRIORITIES"))
+    default_priority: str = "interactive"
 
 @dataclass
 class PrometheusConfig:
@@ -121,8 +383,10 @@ class PrometheusConfig:
 
     Attributes:
         port (int): Порт для метрик Prometheus
+        path (str): Путь эндпоинта метрик
     """
     port: int = 8000
+    path: str = "/metrics"
 
 @dataclass
 class MonitoringConfig:
@@ -134,7 +398,23 @@ class MonitoringConfig:
         prometheus (PrometheusConfig): Конфигурация Prometheus
     """
     enabled: bool = True
-    prometheus: PrometheusConfig = PrometheusConfig()
+    prometheus: PrometheusConfig = field(default_factory=PrometheusConfig)
+
+@dataclass
+class ProfilingConfig:
+    """
+    Конфигурация трассировки и профилирования запросов.
+
+    Attributes:
+        tracing_enabled (bool): Возвращать длительности этапов в Server-Timing
+        admin_token (str): Токен для профилирования по заголовку X-Profile (None - отключено)
+        output_directory (str): Директория для сохранения профилей
+        sample_interval_ms (float): Интервал сэмплирования стеков в миллисекундах
+    """
+    tracing_enabled: bool = True
+    admin_token: Optional[str] = field(default_factory=lambda: os.environ.get("PROFILING_ADMIN_TOKEN"))
+    output_directory: str = "logs/profiles"
+    sample_interval_ms: float = 5.0
 
 @dataclass
 class CacheConfig:
@@ -154,6 +434,20 @@ class CacheConfig:
     port: int = 6379
     ttl: int = 3600  # секунд
 
+@dataclass
+class VisionCacheConfig:
+    """
+    Конфигурация кэша выходов визуального энкодера MiniCPM-V.
+
+    Attributes:
+        enabled (bool): Флаг включения кэша
+        max_entries (int): Максимальное количество страниц в памяти (LRU)
+        disk_directory (str): Директория дискового уровня кэша (None - отключен)
+    """
+    enabled: bool = True
+    max_entries: int = 64
+    disk_directory: Optional[str] = None
+
 @dataclass
 class ServiceConfig:
     """
@@ -164,18 +458,38 @@ class ServiceConfig:
         logging (LoggingConfig): Конфигурация логирования
         database (DatabaseConfig): Конфигурация базы данных
         model (ModelConfig): Конфигурация модели
+        model_server (ModelServerConfig): Конфигурация процесса с моделями
         indexing (IndexingConfig): Конфигурация индексации
+        ingestion (IngestionConfig): Конфигурация фоновой загрузки документов
+        tenants (TenantConfig): Конфигурация разделения документов по арендаторам
+        page_images (PageImagesConfig): Конфигурация уменьшенных копий страниц
         search (SearchConfig): Конфигурация поиска
+        query_pruning (QueryPruningConfig): Конфигурация прореживания токенов запроса
+        latency_slo (LatencySLOConfig): Конфигурация регулятора точности поиска по задержке
+        highlights (HighlightConfig): Конфигурация подсветки совпадений на страницах
+        ui (UIConfig): Конфигурация демонстрационного интерфейса
         security (SecurityConfig): Конфигурация безопасности
         monitoring (MonitoringConfig): Конфигурация мониторинга
+        profiling (ProfilingConfig): Конфигурация трассировки и профилирования
         cache (CacheConfig): Конфигурация кэширования
+        vision_cache (VisionCacheConfig): Конфигурация кэша визуального энкодера
     """
-    environment: EnvironmentConfig = EnvironmentConfig()
-    logging: LoggingConfig = LoggingConfig()
-    database: DatabaseConfig = DatabaseConfig()
-    model: ModelConfig = ModelConfig()
-    indexing: IndexingConfig = IndexingConfig()
-    search: SearchConfig = SearchConfig()
-    security: SecurityConfig = SecurityConfig()
-    monitoring: MonitoringConfig = MonitoringConfig()
-    cache: CacheConfig = CacheConfig()
+    environment: EnvironmentConfig = field(default_factory=EnvironmentConfig)
+    logging: LoggingConfig = field(default_factory=LoggingConfig)
+    database: DatabaseConfig = field(default_factory=DatabaseConfig)
+    model: ModelConfig = field(default_factory=ModelConfig)
+    model_server: ModelServerConfig = field(default_factory=ModelServerConfig)
+    indexing: IndexingConfig = field(default_factory=IndexingConfig)
+    ingestion: IngestionConfig = field(default_factory=IngestionConfig)
+    tenants: TenantConfig = field(default_factory=TenantConfig)
+    page_images: PageImagesConfig = field(default_factory=PageImagesConfig)
+    search: SearchConfig = field(default_factory=SearchConfig)
+    query_pruning: QueryPruningConfig = field(default_factory=QueryPruningConfig)
+    latency_slo: LatencySLOConfig = field(default_factory=LatencySLOConfig)
+    highlights: HighlightConfig = field(default_factory=HighlightConfig)
+    ui: UIConfig = field(default_factory=UIConfig)
+    security: SecurityConfig = field(default_factory=SecurityConfig)
+    monitoring: MonitoringConfig = field(default_factory=MonitoringConfig)
+    profiling: ProfilingConfig = field(default_factory=ProfilingConfig)
+    cache: CacheConfig = field(default_factory=CacheConfig)
+    vision_cache: VisionCacheConfig = field(default_factory=VisionCacheConfig)
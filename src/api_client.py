@@ -0,0 +1,165 @@
+"""
+Клиент HTTP API сервиса для демонстрационного интерфейса.
+
+Интерфейс Gradio в режиме клиента не загружает ColQwen2, MiniCPM-V и
+страницы набора данных: поиск, генерация ответа, изображения страниц и
+загрузка PDF выполняются запросами к FastAPI сервису. Все запросы идут
+через один httpx.Client с пулом соединений (keep-alive), поэтому сессии
+интерфейса не открывают новое соединение на каждый запрос. Изображения
+найденных страниц скачиваются по адресам из выдачи параллельно.
+
+Арендатор сессии передается заголовком TenantConfig.header, как в API:
+интерфейсу доверен секрет TenantConfig.token_secret, и он подписывает
+токен для каждой сессии. Интерфейс отправляет свой API-ключ
+(UIConfig.api_key), и сервис учитывает запросы всех сессий в бюджете
+этого клиента.
+"""
+
+import io
+import json
+from concurrent.futures import ThreadPoolExecutor
+from typing import Iterator, List, Optional, Tuple
+
+import httpx
+from PIL import Image
+
+from configs.service_config import SecurityConfig, TenantConfig, UIConfig
+from src.tenants import GLOBAL_TENANT, sign_tenant
+
+
+class ServiceAPIClient:
+    """
+    Синхронный клиент эндпоинтов /search, /pages и /index
+    """
+
+    def __init__(
+        self,
+        config: UIConfig,
+        tenant_config: Optional[TenantConfig] = None,
+        security_config: Optional[SecurityConfig] = None
+    ):
+        """
+        Args:
+            config (UIConfig): Адрес API, таймаут, пул соединений и размер изображений
+            tenant_config (TenantConfig, optional): Заголовок и секрет токенов арендаторов
+            security_config (SecurityConfig, optional): Заголовок API-ключа
+        """
+        self.config = config
+        self.tenant_config = tenant_config or TenantConfig()
+        client_key_header = (security_config or SecurityConfig()).client_key_header
+        headers = {client_key_header: config.api_key} if config.api_key else {}
+        limits = httpx.Limits(
+            max_connections=config.max_connections,
+            max_keepalive_connections=config.max_connections
+        )
+        self._client = httpx.Client(
+            base_url=config.api_url, timeout=config.timeout, limits=limits, headers=headers
+        )
+        # Изображения страниц выдачи загружаются одновременно
+        self._image_loader = ThreadPoolExecutor(max_workers=4)
+
+    def _headers(self, tenant: str) -> dict:
+        if not tenant or tenant == GLOBAL_TENANT:
+            return {}
+        if not self.tenant_config.token_secret:
+            raise RuntimeError("Для документов сессий нужен секрет токенов арендаторов (TENANT_TOKEN_SECRET)")
+        return {self.tenant_config.header: sign_tenant(tenant, self.tenant_config.token_secret)}
+
+    def page_image(self, url: str, tenant: str = GLOBAL_TENANT) -> Image.Image:
+        """
+        Изображение страницы по адресу из выдачи
+
+        Args:
+            url (str): Адрес вида /pages/<id>/image?size=...&v=...
+            tenant (str): Арендатор (страницы арендатора отдаются только ему)
+
+        Returns:
+            Image.Image: Изображение страницы
+        """
+        response = self._client.get(url, headers=self._headers(tenant))
+        response.raise_for_status()
+        image = Image.open(io.BytesIO(response.content))
+        image.load()
+        return image
+
+    def _document_image(self, document: dict, tenant: str) -> Optional[Image.Image]:
+        urls = document.get("images") or {}
+        url = urls.get(self.config.image_size) or urls.get("original")
+        return self.page_image(url, tenant) if url else None
+
+    def search_documents(
+        self,
+        query: str,
+        top_k: int,
+        tenant: str = GLOBAL_TENANT
+    ) -> Tuple[dict, List[Image.Image]]:
+        """
+        Поиск документов и загрузка изображений найденных страниц
+
+        Args:
+            query (str): Текстовый запрос
+            top_k (int): Количество возвращаемых документов
+            tenant (str): Арендатор сессии
+
+        Returns:
+            tuple: Выдача поиска (как DocumentSearchService.search_documents) и изображения страниц
+        """
+        response = self._client.post(
+            "/search/documents",
+            json={"query": query, "top_k": top_k},
+            headers=self._headers(tenant)
+        )
+        response.raise_for_status()
+        result = response.json()
+        images = list(self._image_loader.map(
+            lambda document: self._document_image(document, tenant), result["documents"]
+        ))
+        return result, [image for image in images if image is not None]
+
+    def ask_stream(self, query: str, top_k: int, tenant: str = GLOBAL_TENANT) -> Iterator[dict]:
+        """
+        Потоковый поиск и генерация ответа (/search/ask с stream=true)
+
+        Yields:
+            dict: События "documents", "token" и "done", как DocumentSearchService.ask_stream
+        """
+        with self._client.stream(
+            "POST",
+            "/search/ask",
+            json={"query": query, "top_k": top_k, "stream": True},
+            headers=self._headers(tenant)
+        ) as response:
+            response.raise_for_status()
+            for line in response.iter_lines():
+                if line:
+                    yield json.loads(line)
+
+    def submit(self, path: str, filename: str, tenant: str = GLOBAL_TENANT) -> dict:
+        """
+        Постановка PDF в очередь индексации (/index/jobs)
+
+        Returns:
+            dict: Состояние задачи
+        """
+        with open(path, "rb") as file:
+            response = self._client.post(
+                "/index/jobs",
+                files={"file": (filename, file, "application/pdf")},
+                headers=self._headers(tenant)
+            )
+        response.raise_for_status()
+        return response.json()
+
+    def job(self, job_id: str, tenant: str = GLOBAL_TENANT) -> Optional[dict]:
+        """
+        Состояние задачи индексации (None - задача не найдена)
+        """
+        response = self._client.get(f"/index/jobs/{job_id}", headers=self._headers(tenant))
+        if response.status_code == 404:
+            return None
+        response.raise_for_status()
+        return response.json()
+
+    def close(self):
+        self._image_loader.shutdown(wait=False)
+        self._client.close()
@@ -0,0 +1,183 @@
+"""
+Адаптивное формирование батчей для визуального энкодера ColQwen2.
+
+Батч дополняется до самой длинной страницы, поэтому страницы группируются
+по ожидаемому числу визуальных токенов (размеру после ресайза процессора),
+а размер батча выбирается так, чтобы число токенов с учетом паддинга
+укладывалось в бюджет памяти. При нехватке памяти батч делится пополам
+и повторяется, а бюджет для следующих батчей уменьшается.
+"""
+
+from collections import Counter
+from typing import Iterable, Iterator, List, Optional, Tuple
+
+import torch
+from PIL import Image
+
+from src.metrics import ENCODER_OOM, INDEXING_BATCH_SIZE
+from src.utils import fit_to_token_budget, token_grid
+
+# Предел визуальных токенов на страницу у процессора ColQwen2 по умолчанию
+DEFAULT_MAX_IMAGE_TOKENS = 768
+
+
+def expected_image_tokens(width: int, height: int, max_tokens: int = DEFAULT_MAX_IMAGE_TOKENS) -> int:
+    """
+    Число визуальных токенов страницы после ресайза процессором
+
+    Args:
+        width (int): Ширина изображения
+        height (int): Высота изображения
+        max_tokens (int): Предел токенов на страницу
+
+    Returns:
+        int: Ожидаемое число токенов
+    """
+    grid_w, grid_h = token_grid(width, height, max_tokens)
+    return grid_w * grid_h
+
+
+def is_out_of_memory(error: Exception) -> bool:
+    if isinstance(error, getattr(torch.cuda, "OutOfMemoryError", ())):
+        return True
+    return isinstance(error, RuntimeError) and "out of memory" in str(error).lower()
+
+
+class AdaptiveBatcher:
+    """
+    Формирование батчей по бюджету токенов и кодирование с отступлением при OOM.
+
+    Attributes:
+        token_budget (int): Максимум токенов в батче с учетом паддинга
+        max_batch_size (int): Максимум страниц в батче
+        batch_sizes (Counter): Фактически использованные размеры батчей
+        oom_retries (int): Количество батчей, разделенных из-за нехватки памяти
+    """
+
+    # Во сколько раз уменьшается бюджет после OOM
+    BACKOFF = 0.5
+
+    def __init__(
+        self,
+        model,
+        processor,
+        max_batch_size: int = 16,
+        token_budget: Optional[int] = None,
+        memory_fraction: float = 0.7,
+        mb_per_token: float = 0.25,
+        max_image_tokens: Optional[int] = None
+    ):
+        """
+        Args:
+            model: Модель ColQwen2 (или заглушка)
+            processor: Процессор ColQwen2 (или заглушка)
+            max_batch_size (int): Максимум страниц в батче
+            token_budget (int, optional): Бюджет токенов; по умолчанию из свободной памяти GPU
+            memory_fraction (float): Доля свободной памяти GPU под активации энкодера
+            mb_per_token (float): Оценка памяти активаций на один визуальный токен, МБ
+            max_image_tokens (int, optional): Бюджет визуальных токенов на страницу; страницы
+                крупнее уменьшаются до него перед процессором (None - предел процессора)
+        """
+        self.model = model
+        self.processor = processor
+        self.max_batch_size = max(1, max_batch_size)
+        self.resize_to_budget = max_image_tokens is not None
+        self.max_image_tokens = max_image_tokens or getattr(
+            processor, "max_image_tokens", DEFAULT_MAX_IMAGE_TOKENS
+        )
+        self.token_budget = token_budget or self._memory_token_budget(memory_fraction, mb_per_token)
+        self.batch_sizes: Counter = Counter()
+        self.oom_retries = 0
+
+    def _memory_token_budget(self, memory_fraction: float, mb_per_token: float) -> int:
+        device = getattr(self.model, "device", torch.device("cpu"))
+        if torch.device(device).type != "cuda" or not torch.cuda.is_available():
+            # На CPU память не ограничивает: размер батча задает max_batch_size
+            return self.max_batch_size * self.max_image_tokens
+        free_bytes, _ = torch.cuda.mem_get_info(device)
+        budget = int(free_bytes * memory_fraction / (mb_per_token * 1024 * 1024))
+        return max(self.max_image_tokens, budget)
+
+    def image_tokens(self, image: Image.Image) -> int:
+        return expected_image_tokens(image.width, image.height, self.max_image_tokens)
+
+    def batches(self, items: Iterable[Tuple[int, Image.Image]], sort: bool = True) -> Iterator[List[Tuple[int, Image.Image]]]:
+        """
+        Разбиение страниц на батчи в пределах бюджета токенов
+
+        Бюджет читается при формировании каждого батча, поэтому уменьшение
+        после OOM сразу сказывается на следующих батчах.
+
+        Args:
+            items (Iterable): Пары (идентификатор, изображение)
+            sort (bool): Группировать страницы близкого размера (требует всего списка);
+                без сортировки батчи набираются в порядке поступления
+
+        Yields:
+            list: Пары (идентификатор, изображение) одного батча
+        """
+        if sort:
+            # Размер берется из заголовка файла, пиксели не декодируются
+            items = sorted(items, key=lambda item: self.image_tokens(item[1]))
+
+        batch: List[Tuple[int, Image.Image]] = []
+        batch_tokens = 0
+        for item in items:
+            tokens = self.image_tokens(item[1])
+            padded = max(batch_tokens, tokens) * (len(batch) + 1)
+            if batch and (padded > self.token_budget or len(batch) >= self.max_batch_size):
+                yield batch
+                batch, batch_tokens = [], 0
+            batch.append(item)
+            batch_tokens = max(batch_tokens, tokens)
+        if batch:
+            yield batch
+
+    def encode(self, images: List[Image.Image]) -> List[torch.Tensor]:
+        """
+        Кодирование батча; при нехватке памяти батч делится пополам
+
+        Args:
+            images (list): Изображения страниц
+
+        Returns:
+            list: Мультивекторы страниц в том же порядке
+        """
+        inputs = images
+        if self.resize_to_budget:
+            inputs = [fit_to_token_budget(image, self.max_image_tokens) for image in images]
+
+        try:
+            with torch.no_grad():
+                batch_images = self.processor.process_images(inputs).to(self.model.device)
+                embeddings = self.model(**batch_images)
+        except Exception as e:
+            if not is_out_of_memory(e) or len(images) == 1:
+                raise
+            self.oom_retries += 1
+            ENCODER_OOM.inc()
+            if torch.cuda.is_available():
+                torch.cuda.empty_cache()
+            padded = max(self.image_tokens(image) for image in images) * len(images)
+            self.token_budget = max(self.max_image_tokens, min(self.token_budget, int(padded * self.BACKOFF)))
+            print(f"Нехватка памяти на батче из {len(images)} страниц, бюджет токенов {self.token_budget}")
+            middle = len(images) // 2
+            return self.encode(images[:middle]) + self.encode(images[middle:])
+
+        self.batch_sizes[len(images)] += 1
+        INDEXING_BATCH_SIZE.observe(len(images))
+        return list(embeddings)
+
+    def stats(self) -> dict:
+        """
+        Сводка по фактическим батчам для отчета
+        """
+        total = sum(self.batch_sizes.values())
+        pages = sum(size * count for size, count in self.batch_sizes.items())
+        return {
+            "batches": total,
+            "mean_batch_size": pages / total if total else 0.0,
+            "batch_sizes": dict(sorted(self.batch_sizes.items())),
+            "oom_retries": self.oom_retries,
+            "token_budget": self.token_budget,
+        }
@@ -0,0 +1,393 @@
+"""
+Нагрузочное тестирование HTTP API сервиса для планирования мощности.
+
+Асинхронный генератор нагрузки воспроизводит запросы из файла против
+запущенного сервиса ступенями и для каждой ступени считает пропускную
+способность, p50/p95/p99 успешных ответов, долю ошибок и долю отказов 429.
+Ступени задаются числом одновременных пользователей (замкнутая модель,
+--concurrency) или частотой поступления запросов (открытая модель, --rates):
+в открытой модели запросы приходят по пуассоновскому потоку независимо от
+ответов, а задержка отсчитывается от запланированного времени отправки,
+поэтому очередь перед сервисом не скрывается. Ступени идут до первой,
+на которой нарушен целевой p95 или допустимая доля ошибок: это точка
+насыщения, предыдущая ступень - выдерживаемая нагрузка.
+
+Без GPU сервис поднимается с CPU-заглушками моделей:
+    python -m src.benchmarks.load_test seed --pages 300 --queries-output bench_results/load_queries.txt
+    MODEL_SERVER_ADDRESS=/tmp/stub.sock python -m src.model_server --stub &
+    MODEL_SERVER_ADDRESS=/tmp/stub.sock uvicorn src.main:app --port 8000 &
+
+Примеры:
+    python -m src.benchmarks.load_test run --queries bench_results/load_queries.txt \\
+        --endpoint search --concurrency 1,2,4,8,16,32
+    python -m src.benchmarks.load_test run --queries bench_results/load_queries.txt \\
+        --endpoint generate --rates 0.5,1,2,4 --slo-p95-ms 5000
+"""
+
+import argparse
+import asyncio
+import base64
+import io
+import itertools
+import json
+import os
+import random
+import time
+from dataclasses import dataclass
+from typing import Dict, Iterator, List, Optional
+
+import httpx
+import numpy as np
+
+from configs.service_config import IndexingConfig, QdrantConfig, SecurityConfig
+from src.benchmarks.synthetic_data import generate_pages, generate_queries
+
+ENDPOINTS = {
+    "search": "/search/documents",
+    "generate": "/search/generate-response",
+    "ask": "/search/ask",
+}
+
+
+@dataclass
+class Sample:
+    """
+    Результат одного запроса.
+
+    Attributes:
+        latency (float): Время от запланированной отправки до ответа, с
+        status (int): HTTP статус (0 - ошибка соединения или таймаут)
+    """
+    latency: float
+    status: int
+
+
+def percentiles(values: List[float]) -> Dict[str, Optional[float]]:
+    """
+    Перцентили p50/p95/p99 и среднее в миллисекундах (None без успешных ответов)
+    """
+    if not values:
+        return {"p50_ms": None, "p95_ms": None, "p99_ms": None, "mean_ms": None}
+    data = np.asarray(values) * 1000
+    return {
+        "p50_ms": float(np.percentile(data, 50)),
+        "p95_ms": float(np.percentile(data, 95)),
+        "p99_ms": float(np.percentile(data, 99)),
+        "mean_ms": float(data.mean()),
+    }
+
+
+def read_queries(path: str) -> List[str]:
+    """
+    Запросы из файла: по одному в строке или JSONL с полем query
+    """
+    queries = []
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            queries.append(json.loads(line)["query"] if line.startswith("{") else line)
+    if not queries:
+        raise ValueError(f"В {path} нет запросов")
+    return queries
+
+
+def page_base64(path: Optional[str]) -> str:
+    """
+    Изображение страницы для generate-response (по умолчанию синтетическая страница)
+    """
+    if path:
+        with open(path, "rb") as f:
+            return base64.b64encode(f.read()).decode("utf-8")
+    buffered = io.BytesIO()
+    generate_pages(1)[0].save(buffered, format="PNG")
+    return base64.b64encode(buffered.getvalue()).decode("utf-8")
+
+
+def request_bodies(endpoint: str, queries: List[str], top_k: int, image_base64: Optional[str], seed: int) -> Iterator[dict]:
+    """
+    Бесконечный поток тел запросов в случайном порядке запросов
+    """
+    rng = random.Random(seed)
+    while True:
+        query = rng.choice(queries)
+        if endpoint == "generate":
+            yield {"query": query, "image_base64": image_base64}
+        else:
+            yield {"query": query, "top_k": top_k}
+
+
+def client_headers(headers: List[str], clients: int) -> Iterator[Dict[str, str]]:
+    """
+    Заголовки запросов; при clients > 1 запросы распределяются по ключам
+    load-test-<i>, чтобы ограничение частоты на клиента не подменяло предел сервиса
+    (ключи должны быть в SecurityConfig.api_keys сервиса, иначе учитывается IP-адрес)
+    """
+    base = dict(header.split(":", 1) for header in headers)
+    base = {name.strip(): value.strip() for name, value in base.items()}
+    if clients <= 1:
+        return itertools.repeat(base)
+    key_header = SecurityConfig().client_key_header
+    return itertools.cycle([{**base, key_header: f"load-test-{i}"} for i in range(clients)])
+
+
+async def send(client: httpx.AsyncClient, path: str, body: dict, headers: dict, scheduled: float) -> Sample:
+    try:
+        response = await client.post(path, json=body, headers=headers)
+        await response.aread()
+        status = response.status_code
+    except Exception:
+        status = 0
+    return Sample(latency=time.perf_counter() - scheduled, status=status)
+
+
+async def closed_loop_step(client, path, bodies, headers, concurrency: int, duration: float) -> List[Sample]:
+    """
+    concurrency пользователей, каждый отправляет следующий запрос после ответа
+    """
+    samples: List[Sample] = []
+    deadline = time.perf_counter() + duration
+
+    async def user():
+        while time.perf_counter() < deadline:
+            samples.append(await send(client, path, next(bodies), next(headers), time.perf_counter()))
+
+    await asyncio.gather(*(user() for _ in range(concurrency)))
+    return samples
+
+
+async def open_loop_step(
+    client, path, bodies, headers, rate: float, duration: float, max_outstanding: int, rng: random.Random
+) -> tuple:
+    """
+    Пуассоновский поток запросов с частотой rate в секунду
+
+    Returns:
+        tuple: Результаты и число запросов, не отправленных из-за предела
+            одновременных запросов генератора
+    """
+    samples: List[Sample] = []
+    pending = set()
+    dropped = 0
+
+    def done(task: asyncio.Task):
+        pending.discard(task)
+        samples.append(task.result())
+
+    start = time.perf_counter()
+    scheduled = start
+    while True:
+        scheduled += rng.expovariate(rate)
+        if scheduled - start >= duration:
+            break
+        delay = scheduled - time.perf_counter()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        if len(pending) >= max_outstanding:
+            dropped += 1
+            continue
+        task = asyncio.create_task(send(client, path, next(bodies), next(headers), scheduled))
+        pending.add(task)
+        task.add_done_callback(done)
+
+    if pending:
+        await asyncio.gather(*list(pending))
+    return samples, dropped
+
+
+def summarize(samples: List[Sample], elapsed: float, offered: float, dropped: int = 0) -> dict:
+    """
+    Показатели ступени
+    """
+    total = len(samples)
+    ok = [sample.latency for sample in samples if 200 <= sample.status < 300]
+    throttled = sum(1 for sample in samples if sample.status == 429)
+    errors = total - len(ok) - throttled
+    return {
+        "offered": offered,
+        "requests": total,
+        "throughput_rps": len(ok) / elapsed if elapsed > 0 else 0.0,
+        **percentiles(ok),
+        "error_rate": errors / total if total else 0.0,
+        "rate_429": throttled / total if total else 0.0,
+        "dropped": dropped,
+    }
+
+
+def violates(row: dict, slo_p95_ms: float, max_error_rate: float) -> bool:
+    """
+    Ступень за пределом: p95 выше цели, слишком много ошибок и отказов
+    или генератор не успел отправить запросы из-за неотвеченных
+    """
+    failed = row["error_rate"] + row["rate_429"]
+    return row["p95_ms"] is None or row["p95_ms"] > slo_p95_ms or failed > max_error_rate or row["dropped"] > 0
+
+
+async def run_steps(args) -> dict:
+    queries = read_queries(args.queries)
+    image_base64 = page_base64(args.image) if args.endpoint == "generate" else None
+    bodies = request_bodies(args.endpoint, queries, args.top_k, image_base64, args.seed)
+    headers = client_headers(args.header, args.clients)
+    path = ENDPOINTS[args.endpoint]
+    rng = random.Random(args.seed)
+
+    open_loop = args.rates is not None
+    steps = [float(value) for value in args.rates.split(",")] if open_loop \
+        else [int(value) for value in args.concurrency.split(",")]
+    max_connections = args.max_outstanding if open_loop else max(steps)
+
+    async def step(client, offered, duration):
+        start = time.perf_counter()
+        if open_loop:
+            samples, dropped = await open_loop_step(
+                client, path, bodies, headers, offered, duration, args.max_outstanding, rng
+            )
+        else:
+            samples, dropped = await closed_loop_step(client, path, bodies, headers, offered, duration), 0
+        return summarize(samples, time.perf_counter() - start, offered, dropped)
+
+    rows = []
+    sustainable = saturation = None
+    limits = httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_connections)
+    async with httpx.AsyncClient(base_url=args.url, timeout=args.timeout, limits=limits) as client:
+        if args.warmup_seconds > 0:
+            await step(client, steps[0], args.warmup_seconds)
+
+        for offered in steps:
+            row = await step(client, offered, args.step_seconds)
+            rows.append(row)
+            print_row(row, open_loop)
+            if violates(row, args.slo_p95_ms, args.max_error_rate):
+                saturation = offered
+                if not args.all_steps:
+                    break
+            elif saturation is None:
+                sustainable = offered
+
+    return {
+        "url": args.url,
+        "endpoint": args.endpoint,
+        "mode": "open" if open_loop else "closed",
+        "step_seconds": args.step_seconds,
+        "slo_p95_ms": args.slo_p95_ms,
+        "max_error_rate": args.max_error_rate,
+        "steps": rows,
+        "sustainable": sustainable,
+        "saturation": saturation,
+    }
+
+
+def print_row(row: dict, open_loop: bool):
+    def ms(value):
+        return "-" if value is None else f"{value:.1f}"
+
+    offered = f"{row['offered']:g} rps" if open_loop else f"{row['offered']} users"
+    print(
+        f"{offered:>12} | {row['throughput_rps']:7.2f} rps | "
+        f"p50 {ms(row['p50_ms'])} p95 {ms(row['p95_ms'])} p99 {ms(row['p99_ms'])} ms | "
+        f"errors {row['error_rate']:.1%} 429 {row['rate_429']:.1%} dropped {row['dropped']}"
+    )
+
+
+def seed_service(args):
+    """
+    Синтетические страницы в директории данных сервиса и их индекс с CPU-заглушкой
+
+    Порядок страниц фиксируется манифестом, поэтому идентификаторы точек
+    совпадают с позициями в наборе данных, который сервис прочитает при запуске.
+    """
+    from src.benchmarks.stub_encoder import StubColQwen2, StubColQwen2Processor
+    from src.indexer import DocumentIndexer
+    from src.page_store import PAGES_MANIFEST, PageStore
+    from src.qdrant_connection import create_qdrant_client
+
+    client = create_qdrant_client(QdrantConfig())
+    if client.collection_exists(args.collection) and not args.recreate:
+        raise SystemExit(f"Коллекция {args.collection} уже существует (--recreate для перезаписи)")
+
+    pages = generate_pages(args.pages, seed=args.seed)
+    queries = generate_queries(pages, args.queries, seed=args.seed)
+
+    store = PageStore(args.data_directory)
+    for page in pages:
+        document_name = page.filename.rsplit("_page_", 1)[0]
+        page.filename = store.page_filename(document_name, page.page_number)
+        store.save(page, page.filename)
+        store.save_renditions(page, page.filename)
+    with open(os.path.join(args.data_directory, PAGES_MANIFEST), "w", encoding="utf-8") as f:
+        json.dump({"pages": {str(i): page.filename for i, page in enumerate(pages)}}, f, ensure_ascii=False)
+
+    indexer = DocumentIndexer(
+        dataset=pages,
+        collection_name=args.collection,
+        model=StubColQwen2(),
+        processor=StubColQwen2Processor(),
+        qdrant_client=client
+    )
+    indexer.create_collection()
+    stats = indexer.index_documents(batch_size=args.batch_size)
+    print(f"Коллекция {args.collection}: {stats['points']} точек, страницы в {args.data_directory}")
+
+    if args.queries_output:
+        os.makedirs(os.path.dirname(args.queries_output) or ".", exist_ok=True)
+        with open(args.queries_output, "w", encoding="utf-8") as f:
+            f.writelines(f"{query}\n" for query, _ in queries)
+        print(f"Запросы сохранены в {args.queries_output}")
+
+
+def parse_args(argv=None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Нагрузочное тестирование HTTP API")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    seed = commands.add_parser("seed", help="Наполнить сервис синтетическими страницами (CPU-заглушка)")
+    seed.add_argument("--pages", type=int, default=300, help="Количество синтетических страниц")
+    seed.add_argument("--queries", type=int, default=200, help="Количество запросов в файле")
+    seed.add_argument("--queries-output", default="bench_results/load_queries.txt", help="Файл запросов")
+    seed.add_argument("--data-directory", default=IndexingConfig().data_directory)
+    seed.add_argument("--collection", default=QdrantConfig().collection_name)
+    seed.add_argument("--batch-size", type=int, default=8)
+    seed.add_argument("--recreate", action="store_true", help="Пересоздать существующую коллекцию")
+    seed.add_argument("--seed", type=int, default=0)
+
+    run = commands.add_parser("run", help="Ступенчатая нагрузка на запущенный сервис")
+    run.add_argument("--url", default="http://localhost:8000", help="Адрес сервиса")
+    run.add_argument("--queries", required=True, help="Файл запросов (строки или JSONL с полем query)")
+    run.add_argument("--endpoint", choices=sorted(ENDPOINTS), default="search")
+    run.add_argument("--concurrency", default="1,2,4,8,16,32",
+                     help="Ступени одновременных пользователей (замкнутая модель)")
+    run.add_argument("--rates", default=None,
+                     help="Ступени частоты запросов в секунду (открытая модель, вместо --concurrency)")
+    run.add_argument("--step-seconds", type=float, default=30.0, help="Длительность ступени")
+    run.add_argument("--warmup-seconds", type=float, default=5.0, help="Прогрев на первой ступени")
+    run.add_argument("--top-k", type=int, default=2)
+    run.add_argument("--image", default=None, help="Изображение страницы для generate (по умолчанию синтетическое)")
+    run.add_argument("--header", action="append", default=[], help="Заголовок запроса 'Имя: значение'")
+    run.add_argument("--clients", type=int, default=1, help="Число ключей клиентов для распределения запросов")
+    run.add_argument("--timeout", type=float, default=60.0, help="Таймаут запроса, с")
+    run.add_argument("--max-outstanding", type=int, default=512,
+                     help="Предел одновременных запросов генератора в открытой модели")
+    run.add_argument("--slo-p95-ms", type=float, default=1000.0, help="Целевой p95 успешных ответов")
+    run.add_argument("--max-error-rate", type=float, default=0.01, help="Допустимая доля ошибок и 429")
+    run.add_argument("--all-steps", action="store_true", help="Не останавливаться после насыщения")
+    run.add_argument("--seed", type=int, default=0)
+    run.add_argument("--output", default="bench_results/load_latest.json", help="Файл результатов")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    if args.command == "seed":
+        seed_service(args)
+        return
+
+    result = asyncio.run(run_steps(args))
+    os.makedirs(os.path.dirname(args.output) or ".", exist_ok=True)
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(result, f, indent=2, ensure_ascii=False)
+    print(f"Выдерживаемая нагрузка: {result['sustainable']}, насыщение: {result['saturation']}")
+    print(f"Результаты сохранены в {args.output}")
+
+
+if __name__ == "__main__":
+    main()
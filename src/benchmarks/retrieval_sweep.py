@@ -0,0 +1,325 @@
+"""
+Оценка качества и задержки поиска на сетке настроек DocumentIndexer.
+
+Для каждой комбинации квантизации и pooling строится отдельная коллекция,
+затем по размеченному набору запрос -> страницы перебираются параметры поиска
+(rescore, oversampling, hnsw_ef, top_k, prefetch) и правила прореживания
+токенов запроса (без переиндексации). Для каждой точки сетки
+считаются recall@k, nDCG@k и задержка search_documents, строится таблица
+Парето (качество против p95), чтобы выбрать самую дешевую настройку.
+
+Разметка - JSONL, по строке на запрос:
+    {"query": "текст запроса", "relevant": ["file.pdf_page_3.png"]}
+
+Примеры:
+    python -m src.benchmarks.retrieval_sweep --labels data/eval/labels.jsonl \\
+        --quantization none,int8,binary --hnsw-ef 32,128 --top-k 5,10
+    python -m src.benchmarks.retrieval_sweep --labels data/eval/labels.jsonl \\
+        --quantization int8 --query-pruning none,padding+augmentation,padding+augmentation+max12
+    python -m src.benchmarks.retrieval_sweep --synthetic 300 --qdrant-location :memory:
+"""
+
+import argparse
+import csv
+import itertools
+import json
+import math
+import os
+import time
+from typing import Dict, List, Optional, Set
+
+import numpy as np
+from qdrant_client import QdrantClient
+from qdrant_client.http import models
+
+from src.data_preparation.data_preparer import DocumentDataPreparer
+from src.indexer import DocumentIndexer
+from src.query_pruning import QueryTokenPruner, parse_pruning_spec
+
+
+def recall_at_k(retrieved: List[str], relevant: Set[str]) -> float:
+    """
+    Доля релевантных страниц, попавших в выдачу
+    """
+    if not relevant:
+        return 0.0
+    return len(relevant.intersection(retrieved)) / len(relevant)
+
+
+def ndcg_at_k(retrieved: List[str], relevant: Set[str]) -> float:
+    """
+    nDCG с бинарной релевантностью
+    """
+    dcg = sum(1 / math.log2(rank + 2) for rank, name in enumerate(retrieved) if name in relevant)
+    ideal = sum(1 / math.log2(rank + 2) for rank in range(min(len(relevant), len(retrieved))))
+    return dcg / ideal if ideal else 0.0
+
+
+def pareto_front(rows: List[dict], quality_key: str, latency_key: str) -> None:
+    """
+    Отметка строк, для которых нет настройки одновременно не хуже по качеству
+    и задержке и строго лучше хотя бы по одному из них
+    """
+    for row in rows:
+        row["pareto"] = not any(
+            other[quality_key] >= row[quality_key]
+            and other[latency_key] <= row[latency_key]
+            and (other[quality_key] > row[quality_key] or other[latency_key] < row[latency_key])
+            for other in rows
+        )
+
+
+def load_labels(path: str) -> List[dict]:
+    labels = []
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            if line.strip():
+                record = json.loads(line)
+                labels.append({"query": record["query"], "relevant": set(record["relevant"])})
+    return labels
+
+
+def parse_list(value: str, cast=str) -> list:
+    return [cast(item.strip()) for item in value.split(",") if item.strip()]
+
+
+def parse_bool(value: str) -> bool:
+    return value.lower() in ("1", "true", "yes")
+
+
+def parse_optional_int(value: str) -> Optional[int]:
+    return None if value.lower() in ("none", "default") else int(value)
+
+
+def build_search_params(
+    quantization: str,
+    rescore: bool,
+    oversampling: float,
+    hnsw_ef: Optional[int]
+) -> models.SearchParams:
+    quantization_params = None
+    if quantization != "none":
+        quantization_params = models.QuantizationSearchParams(
+            rescore=rescore,
+            oversampling=oversampling,
+        )
+    return models.SearchParams(hnsw_ef=hnsw_ef, quantization=quantization_params)
+
+
+def ensure_indexed(indexer: DocumentIndexer, batch_size: int, reuse: bool) -> float:
+    """
+    Индексация коллекции сетки; при reuse полная коллекция не пересоздается
+
+    Returns:
+        float: Время индексации в секундах (0, если коллекция переиспользована)
+    """
+    client = indexer.qdrant_client
+    if reuse and client.collection_exists(indexer.collection_name):
+        count = client.count(indexer.collection_name, exact=True).count
+        if count == len(indexer.dataset):
+            print(f"Коллекция {indexer.collection_name} переиспользована ({count} точек)")
+            return 0.0
+
+    start = time.perf_counter()
+    indexer.create_collection()
+    indexer.index_documents(batch_size=batch_size)
+    return time.perf_counter() - start
+
+
+def evaluate(
+    indexer: DocumentIndexer,
+    labels: List[dict],
+    top_k: int,
+    search_params: models.SearchParams,
+    prefetch_limit: Optional[int]
+) -> Dict[str, float]:
+    recalls, ndcgs, latencies = [], [], []
+    for record in labels:
+        start = time.perf_counter()
+        result = indexer.search_documents(
+            record["query"],
+            top_k,
+            search_params=search_params,
+            prefetch_limit=prefetch_limit
+        )
+        latencies.append(time.perf_counter() - start)
+
+        retrieved = [point.payload.get("filename") for point in result.points]
+        recalls.append(recall_at_k(retrieved, record["relevant"]))
+        ndcgs.append(ndcg_at_k(retrieved, record["relevant"]))
+
+    latencies_ms = np.asarray(latencies) * 1000
+    return {
+        "recall": float(np.mean(recalls)),
+        "ndcg": float(np.mean(ndcgs)),
+        "p50_ms": float(np.percentile(latencies_ms, 50)),
+        "p95_ms": float(np.percentile(latencies_ms, 95)),
+    }
+
+
+def load_dataset(args: argparse.Namespace):
+    """
+    Страницы, разметка и (для синтетики) заглушка энкодера
+
+    Returns:
+        tuple: Страницы, разметка, модель и процессор (None - загрузить ColQwen2)
+    """
+    if args.synthetic:
+        from src.benchmarks.stub_encoder import StubColQwen2, StubColQwen2Processor
+        from src.benchmarks.synthetic_data import generate_pages, generate_queries
+
+        pages = generate_pages(args.synthetic)
+        labels = [
+            {"query": query, "relevant": {pages[page_id].filename}}
+            for query, page_id in generate_queries(pages, args.queries)
+        ]
+        return pages, labels, StubColQwen2(), StubColQwen2Processor()
+
+    pages = DocumentDataPreparer(args.data_directory).prepare_documents()
+    return pages, load_labels(args.labels), None, None
+
+
+def run(args: argparse.Namespace) -> List[dict]:
+    pages, labels, model, processor = load_dataset(args)
+
+    if args.qdrant_location:
+        qdrant_client = QdrantClient(location=args.qdrant_location) \
+            if args.qdrant_location == ":memory:" else QdrantClient(path=args.qdrant_location)
+    else:
+        qdrant_client = QdrantClient(host=args.qdrant_host, port=args.qdrant_port)
+
+    rows = []
+    for quantization, pooling, max_image_tokens in itertools.product(
+        parse_list(args.quantization),
+        parse_list(args.pooling),
+        parse_list(args.max_image_tokens, parse_optional_int),
+    ):
+        pooling = None if pooling == "none" else pooling
+        indexer = DocumentIndexer(
+            dataset=pages,
+            model_name=args.model_name,
+            collection_name=f"{args.collection_prefix}_{quantization}_{pooling or 'none'}"
+                            f"_t{max_image_tokens or 'default'}",
+            model=model,
+            processor=processor,
+            qdrant_client=qdrant_client,
+            quantization=quantization,
+            pooling=pooling,
+            max_image_tokens=max_image_tokens,
+        )
+        # Модель загружается один раз и переиспользуется всеми коллекциями
+        model, processor = indexer.model, indexer.processor
+        indexing_seconds = ensure_indexed(indexer, args.batch_size, args.reuse_collections)
+
+        # rescore и oversampling имеют смысл только при квантизации, prefetch - только при pooling
+        rescores = parse_list(args.rescore, parse_bool) if quantization != "none" else [False]
+        oversamplings = parse_list(args.oversampling, float) if quantization != "none" else [1.0]
+        prefetch_limits = parse_list(args.prefetch_limit, parse_optional_int) if pooling else [None]
+
+        for rescore, oversampling, hnsw_ef, top_k, prefetch_limit, query_pruning in itertools.product(
+            rescores,
+            oversamplings,
+            parse_list(args.hnsw_ef, parse_optional_int),
+            parse_list(args.top_k, int),
+            prefetch_limits,
+            parse_list(args.query_pruning),
+        ):
+            pruning_config = parse_pruning_spec(query_pruning)
+            indexer.query_pruner = QueryTokenPruner(pruning_config) if pruning_config else None
+            search_params = build_search_params(quantization, rescore, oversampling, hnsw_ef)
+            metrics = evaluate(indexer, labels, top_k, search_params, prefetch_limit)
+            row = {
+                "quantization": quantization,
+                "pooling": pooling or "none",
+                "max_image_tokens": max_image_tokens,
+                "rescore": rescore,
+                "oversampling": oversampling,
+                "hnsw_ef": hnsw_ef,
+                "top_k": top_k,
+                "prefetch_limit": prefetch_limit,
+                "query_pruning": query_pruning,
+                "indexing_seconds": round(indexing_seconds, 2),
+                **metrics,
+            }
+            rows.append(row)
+            print(
+                f"{quantization:6s} pool={row['pooling']:5s} tokens={max_image_tokens!s:7s} rescore={rescore!s:5s} "
+                f"os={oversampling:<4} ef={hnsw_ef!s:5s} k={top_k:<3} prefetch={prefetch_limit!s:5s} prune={query_pruning} "
+                f"recall={metrics['recall']:.3f} ndcg={metrics['ndcg']:.3f} p95={metrics['p95_ms']:.1f}ms"
+            )
+
+    # Парето сравнивает настройки с одинаковым k: recall@5 и recall@10 несопоставимы
+    for _, group in itertools.groupby(sorted(rows, key=lambda r: r["top_k"]), key=lambda r: r["top_k"]):
+        pareto_front(list(group), args.quality_metric, "p95_ms")
+
+    return sorted(rows, key=lambda r: (r["top_k"], r["p95_ms"]))
+
+
+def print_table(rows: List[dict]):
+    header = ("quant", "pool", "tokens", "rescore", "os", "ef", "k", "prefetch", "pruning", "recall", "ndcg", "p50", "p95", "pareto")
+    print(" | ".join(f"{h:>8s}" for h in header))
+    for row in rows:
+        values = (
+            row["quantization"], row["pooling"], row["max_image_tokens"], row["rescore"], row["oversampling"],
+            row["hnsw_ef"], row["top_k"], row["prefetch_limit"], row["query_pruning"],
+            f"{row['recall']:.3f}", f"{row['ndcg']:.3f}",
+            f"{row['p50_ms']:.1f}", f"{row['p95_ms']:.1f}", "*" if row["pareto"] else "",
+        )
+        print(" | ".join(f"{str(v):>8s}" for v in values))
+
+
+def parse_args(argv=None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Сетка настроек поиска: качество против задержки")
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument("--labels", help="JSONL разметка запрос -> релевантные страницы")
+    source.add_argument("--synthetic", type=int, help="Синтетический корпус из N страниц с заглушкой энкодера")
+    parser.add_argument("--queries", type=int, default=100, help="Число запросов для синтетики")
+    parser.add_argument("--data-directory", default="data/prepared_data/")
+    parser.add_argument("--model-name", default="vidore/colqwen2-v0.1")
+    parser.add_argument("--qdrant-host", default=os.environ.get("QDRANT_HOST", "localhost"))
+    parser.add_argument("--qdrant-port", type=int, default=int(os.environ.get("QDRANT_PORT", 6333)))
+    parser.add_argument("--qdrant-location", default=None,
+                        help="':memory:' или путь для локального Qdrant (HNSW и квантизация в нем не действуют)")
+    parser.add_argument("--collection-prefix", default="sweep")
+    parser.add_argument("--reuse-collections", action="store_true",
+                        help="Не переиндексировать коллекции с полным числом точек")
+    parser.add_argument("--batch-size", type=int, default=4)
+
+    parser.add_argument("--quantization", default="none,int8,binary")
+    parser.add_argument("--pooling", default="none,mean")
+    parser.add_argument("--max-image-tokens", default="default",
+                        help="Бюджеты визуальных токенов на страницу, например default,384,768")
+    parser.add_argument("--rescore", default="true,false")
+    parser.add_argument("--oversampling", default="1.0,2.0,4.0")
+    parser.add_argument("--hnsw-ef", default="default,64,256")
+    parser.add_argument("--top-k", default="5,10")
+    parser.add_argument("--prefetch-limit", default="50,200")
+    parser.add_argument("--query-pruning", default="none",
+                        help="Правила прореживания токенов запроса через запятую, "
+                             "например none,padding+augmentation,padding+max12")
+    parser.add_argument("--quality-metric", choices=["recall", "ndcg"], default="recall")
+
+    parser.add_argument("--output", default="bench_results/retrieval_sweep.json")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    rows = run(args)
+    print_table(rows)
+
+    os.makedirs(os.path.dirname(args.output) or ".", exist_ok=True)
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump({"args": vars(args), "results": rows}, f, indent=2, ensure_ascii=False)
+
+    csv_path = os.path.splitext(args.output)[0] + ".csv"
+    with open(csv_path, "w", newline="", encoding="utf-8") as f:
+        writer = csv.DictWriter(f, fieldnames=list(rows[0].keys()))
+        writer.writeheader()
+        writer.writerows(rows)
+
+    print(f"Результаты сохранены в {args.output} и {csv_path}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,394 @@
+"""
+Офлайн-бенчмарк индексации и поиска без GPU и внешнего Qdrant.
+
+Индексирует синтетические страницы CPU-заглушкой ColQwen2 в локальный Qdrant,
+измеряет скорость индексации, перцентили задержки запросов, пиковый RSS
+и стоимость сериализации, сохраняет результат в JSON и сравнивает с базовым.
+
+Пример:
+    python -m src.benchmarks.run_benchmark --pages 200 --queries 100 \\
+        --output bench_results/current.json --baseline bench_results/baseline.json
+"""
+
+import argparse
+import json
+import os
+import platform
+import resource
+import subprocess
+import sys
+import time
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+import torch
+from qdrant_client import QdrantClient
+from qdrant_client.http import models
+
+from src.benchmarks.stub_encoder import StubColQwen2, StubColQwen2Processor, load_stub_encoder
+from src.benchmarks.synthetic_data import generate_pages, generate_queries
+from src.indexer import DocumentIndexer
+from src.query_pruning import QueryTokenPruner, parse_pruning_spec
+
+# Направление улучшения метрик для сравнения с базовым прогоном
+HIGHER_IS_BETTER = {
+    "indexing_pages_per_second",
+    "indexing_mean_batch_size",
+    "queries_per_second",
+    "recall_at_k",
+    "pruned_recall_at_k",
+    "pruned_recall_ratio",
+}
+# Метрики масштабирования по числу процессов кодирования (суффикс _<N>)
+HIGHER_IS_BETTER_PREFIXES = ("indexing_pages_per_second_workers_", "parallel_speedup_workers_")
+
+
+def percentiles(values: List[float]) -> Dict[str, float]:
+    """
+    Перцентили p50/p95/p99 и среднее в миллисекундах
+    """
+    data = np.asarray(values) * 1000
+    return {
+        "p50_ms": float(np.percentile(data, 50)),
+        "p95_ms": float(np.percentile(data, 95)),
+        "p99_ms": float(np.percentile(data, 99)),
+        "mean_ms": float(data.mean()),
+    }
+
+
+def peak_rss_mb() -> float:
+    """
+    Пиковый RSS процесса в мегабайтах
+    """
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # На macOS ru_maxrss в байтах, на Linux в килобайтах
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "--short", "HEAD"], stderr=subprocess.DEVNULL
+        ).decode().strip()
+    except Exception:
+        return "unknown"
+
+
+def build_indexer(
+    num_pages: int,
+    qdrant_location: str,
+    collection_name: str = "benchmark",
+    seed: int = 0
+) -> DocumentIndexer:
+    """
+    Индексатор со страницами-заглушками, CPU-энкодером и локальным Qdrant
+
+    Args:
+        num_pages (int): Количество синтетических страниц
+        qdrant_location (str): ":memory:" или путь к локальному хранилищу Qdrant
+        collection_name (str): Название коллекции
+        seed (int): Зерно генерации страниц
+
+    Returns:
+        DocumentIndexer: Индексатор, готовый к index_documents
+    """
+    if qdrant_location == ":memory:":
+        qdrant_client = QdrantClient(location=":memory:")
+    else:
+        qdrant_client = QdrantClient(path=qdrant_location)
+
+    return DocumentIndexer(
+        dataset=generate_pages(num_pages, seed=seed),
+        collection_name=collection_name,
+        model=StubColQwen2(),
+        processor=StubColQwen2Processor(),
+        # Воркеры параллельного кодирования загружают ту же заглушку
+        encoder_factory=load_stub_encoder,
+        qdrant_client=qdrant_client,
+    )
+
+
+def bench_indexing(
+    indexer: DocumentIndexer,
+    batch_size: int,
+    token_budget: Optional[int] = None
+) -> Tuple[Dict[str, float], dict]:
+    """
+    Замер индексации; вторым элементом - фактические размеры батчей
+    """
+    start = time.perf_counter()
+    batch_stats = indexer.index_documents(batch_size=batch_size, token_budget=token_budget)
+    elapsed = time.perf_counter() - start
+    return {
+        "indexing_seconds": elapsed,
+        "indexing_pages_per_second": len(indexer.dataset) / elapsed,
+        "indexing_mean_batch_size": batch_stats["mean_batch_size"],
+    }, batch_stats
+
+
+def bench_parallel_indexing(
+    indexer: DocumentIndexer,
+    batch_size: int,
+    workers: List[int]
+) -> Dict[str, float]:
+    """
+    Скорость индексации при кодировании в N процессах CPU и ускорение
+    относительно первого значения из списка
+
+    Запуск воркеров и загрузка моделей отчитываются отдельно
+    (encoder_startup_seconds_workers_<N>) и не входят в скорость индексации.
+    """
+    metrics = {}
+    base = None
+    for count in workers:
+        collection_name = f"{indexer.collection_name}_workers_{count}"
+        indexer.create_collection(collection_name=collection_name)
+        indexer.encoder_workers = count
+        try:
+            start = time.perf_counter()
+            stats = indexer.index_documents(batch_size=batch_size, collection_name=collection_name)
+            elapsed = time.perf_counter() - start
+        finally:
+            indexer.encoder_workers = 0
+            indexer.qdrant_client.delete_collection(collection_name)
+        startup = stats.get("encoder_startup_seconds", 0.0)
+        pages_per_second = len(indexer.dataset) / (elapsed - startup)
+        base = base or pages_per_second
+        metrics[f"encoder_startup_seconds_workers_{count}"] = startup
+        metrics[f"indexing_pages_per_second_workers_{count}"] = pages_per_second
+        metrics[f"parallel_speedup_workers_{count}"] = pages_per_second / base
+    return metrics
+
+
+def bench_queries(
+    indexer: DocumentIndexer,
+    queries: List[Tuple[str, int]],
+    top_k: int,
+    warmup: int = 5
+) -> Dict[str, float]:
+    for query, _ in queries[:warmup]:
+        indexer.search_documents(query, top_k)
+
+    latencies = []
+    hits = 0
+    for query, page_id in queries:
+        start = time.perf_counter()
+        result = indexer.search_documents(query, top_k)
+        latencies.append(time.perf_counter() - start)
+        hits += any(point.id == page_id for point in result.points)
+
+    return {
+        **{f"query_{key}": value for key, value in percentiles(latencies).items()},
+        "queries_per_second": len(latencies) / sum(latencies),
+        "recall_at_k": hits / len(queries),
+    }
+
+
+def bench_query_pruning(
+    indexer: DocumentIndexer,
+    queries: List[Tuple[str, int]],
+    top_k: int,
+    spec: str
+) -> Dict[str, float]:
+    """
+    Задержка и полнота поиска с прореживанием токенов запроса против полного запроса
+    """
+    def mean_tokens() -> float:
+        return float(np.mean([len(indexer.encode_query(query)) for query, _ in queries]))
+
+    indexer.query_pruner = None
+    full = bench_queries(indexer, queries, top_k)
+    full_tokens = mean_tokens()
+
+    indexer.query_pruner = QueryTokenPruner(parse_pruning_spec(spec))
+    try:
+        pruned = bench_queries(indexer, queries, top_k)
+        pruned_tokens = mean_tokens()
+    finally:
+        indexer.query_pruner = None
+
+    return {
+        "query_tokens_mean": full_tokens,
+        "pruned_query_tokens_mean": pruned_tokens,
+        "pruned_query_p50_ms": pruned["query_p50_ms"],
+        "pruned_query_p95_ms": pruned["query_p95_ms"],
+        "pruned_recall_at_k": pruned["recall_at_k"],
+        # Доля полноты, сохраненная при прореживании (1.0 - без потерь)
+        "pruned_recall_ratio": pruned["recall_at_k"] / full["recall_at_k"] if full["recall_at_k"] else 0.0,
+    }
+
+
+def bench_serialization(
+    indexer: DocumentIndexer,
+    queries: List[Tuple[str, int]],
+    top_k: int,
+    batch_size: int
+) -> Dict[str, float]:
+    """
+    Стоимость подготовки точек для Qdrant и сериализации ответа в JSON
+    """
+    batch = indexer.dataset[:batch_size]
+    with torch.no_grad():
+        embeddings = indexer.model(**indexer.processor.process_images(batch).to(indexer.model.device))
+
+    start = time.perf_counter()
+    points = [
+        models.PointStruct(id=i, vector=embedding.cpu().float().numpy().tolist(), payload={})
+        for i, embedding in enumerate(embeddings)
+    ]
+    to_points = (time.perf_counter() - start) / len(batch)
+
+    start = time.perf_counter()
+    payload_bytes = sum(len(point.model_dump_json()) for point in points)
+    to_json = (time.perf_counter() - start) / len(batch)
+
+    response_times = []
+    for query, _ in queries[:50]:
+        result = indexer.search_documents(query, top_k)
+        start = time.perf_counter()
+        json.dumps([
+            {"id": point.id, "score": point.score, "payload": point.payload}
+            for point in result.points
+        ])
+        response_times.append(time.perf_counter() - start)
+
+    return {
+        "vector_to_point_ms_per_page": to_points * 1000,
+        "point_to_json_ms_per_page": to_json * 1000,
+        "point_json_kb_per_page": payload_bytes / len(batch) / 1024,
+        "response_json_ms": float(np.mean(response_times) * 1000) if response_times else 0.0,
+    }
+
+
+def compare_results(
+    baseline: dict,
+    current: dict,
+    tolerance: float,
+    tolerances: Optional[Dict[str, Optional[float]]] = None
+) -> List[str]:
+    """
+    Сравнение метрик с базовым прогоном
+
+    Args:
+        baseline (dict): Результат базового прогона
+        current (dict): Результат текущего прогона
+        tolerance (float): Допустимое относительное ухудшение (0.1 = 10%)
+        tolerances (dict, optional): Допуски отдельных шумных метрик
+            (None - метрика выводится, но не проверяется)
+
+    Returns:
+        List[str]: Описания метрик, ухудшившихся сильнее допуска
+    """
+    regressions = []
+    for name, value in current["metrics"].items():
+        base = baseline.get("metrics", {}).get(name)
+        if not base:
+            continue
+        change = (value - base) / base
+        higher_is_better = name in HIGHER_IS_BETTER or name.startswith(HIGHER_IS_BETTER_PREFIXES)
+        worse = -change if higher_is_better else change
+        limit = (tolerances or {}).get(name, tolerance)
+        regressed = limit is not None and worse > limit
+        marker = "REGRESSION" if regressed else ""
+        print(f"{name:36s} {base:12.3f} -> {value:12.3f} ({change:+.1%}) {marker}")
+        if regressed:
+            regressions.append(f"{name}: {base:.3f} -> {value:.3f}")
+    return regressions
+
+
+def run(args: argparse.Namespace) -> dict:
+    torch.manual_seed(args.seed)
+    torch.set_num_threads(args.threads)
+
+    indexer = build_indexer(args.pages, args.qdrant_location, seed=args.seed)
+    queries = generate_queries(indexer.dataset, args.queries, seed=args.seed)
+
+    metrics = {}
+    indexing_metrics, batch_stats = bench_indexing(indexer, args.batch_size, args.token_budget)
+    metrics.update(indexing_metrics)
+    metrics.update(bench_queries(indexer, queries, args.top_k))
+    if parse_pruning_spec(args.query_pruning):
+        metrics.update(bench_query_pruning(indexer, queries, args.top_k, args.query_pruning))
+    metrics.update(bench_serialization(indexer, queries, args.top_k, args.batch_size))
+    if args.encoder_workers:
+        workers = [int(count) for count in args.encoder_workers.split(",")]
+        metrics.update(bench_parallel_indexing(indexer, args.batch_size, workers))
+    metrics["peak_rss_mb"] = peak_rss_mb()
+
+    return {
+        "timestamp": datetime.now().isoformat(timespec="seconds"),
+        "git_commit": git_commit(),
+        "environment": {
+            "python": platform.python_version(),
+            "torch": torch.__version__,
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+        },
+        "config": {
+            "pages": args.pages,
+            "queries": args.queries,
+            "batch_size": args.batch_size,
+            "token_budget": args.token_budget,
+            "top_k": args.top_k,
+            "query_pruning": args.query_pruning,
+            "encoder_workers": args.encoder_workers,
+            "threads": args.threads,
+            "qdrant_location": args.qdrant_location,
+            "seed": args.seed,
+        },
+        "metrics": metrics,
+        "indexing_batches": batch_stats,
+    }
+
+
+def parse_args(argv=None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Офлайн-бенчмарк индексации и поиска")
+    parser.add_argument("--pages", type=int, default=200, help="Количество синтетических страниц")
+    parser.add_argument("--queries", type=int, default=100, help="Количество запросов")
+    parser.add_argument("--batch-size", type=int, default=4, help="Максимальный размер батча индексации")
+    parser.add_argument("--token-budget", type=int, default=None,
+                        help="Бюджет визуальных токенов на батч (по умолчанию по памяти)")
+    parser.add_argument("--top-k", type=int, default=5, help="Количество результатов поиска")
+    parser.add_argument("--query-pruning", default="none",
+                        help="Правила прореживания токенов запроса, например padding+augmentation+max8")
+    parser.add_argument("--encoder-workers", default=None,
+                        help="Число процессов кодирования через запятую для замера масштабирования, например 1,2,4")
+    parser.add_argument("--threads", type=int, default=torch.get_num_threads(), help="Потоки torch")
+    parser.add_argument("--qdrant-location", default=":memory:",
+                        help="':memory:' или путь к локальному хранилищу Qdrant")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", default="bench_results/latest.json", help="Файл результатов")
+    parser.add_argument("--baseline", default=None, help="Файл базового прогона для сравнения")
+    parser.add_argument("--tolerance", type=float, default=0.1,
+                        help="Допустимое относительное ухудшение метрик")
+    parser.add_argument("--rss-tolerance", type=float, default=0.3,
+                        help="Допустимый рост peak_rss_mb (отрицательное значение - не проверять)")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    result = run(args)
+
+    os.makedirs(os.path.dirname(args.output) or ".", exist_ok=True)
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(result, f, indent=2, ensure_ascii=False)
+    print(json.dumps(result["metrics"], indent=2))
+    print(f"Результаты сохранены в {args.output}")
+
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            baseline = json.load(f)
+        # Пиковый RSS зависит от аллокатора и сборщика мусора и шумит сильнее времени
+        rss_tolerance = args.rss_tolerance if args.rss_tolerance >= 0 else None
+        regressions = compare_results(baseline, result, args.tolerance, {"peak_rss_mb": rss_tolerance})
+        if regressions:
+            print("Обнаружены регрессии:")
+            for regression in regressions:
+                print(f"  {regression}")
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
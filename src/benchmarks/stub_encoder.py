@@ -0,0 +1,146 @@
+"""
+Детерминированная CPU-заглушка ColQwen2 для бенчмарков.
+
+Повторяет интерфейс ColQwen2/ColQwen2Processor, который использует DocumentIndexer,
+и форму выхода модели: (batch, tokens, 128), L2-нормированные векторы,
+нулевые векторы на позициях паддинга. Число токенов страницы зависит от
+ее размера так же, как у ColQwen2: сетку патчей считает src.utils.token_grid.
+"""
+
+import zlib
+from types import SimpleNamespace
+from typing import List, Tuple
+
+import torch
+from PIL import Image
+
+from src.batching import DEFAULT_MAX_IMAGE_TOKENS
+from src.utils import token_grid
+
+EMBEDDING_DIM = 128
+MAX_IMAGE_TOKENS = DEFAULT_MAX_IMAGE_TOKENS
+IMAGE_PREFIX_TOKENS = 6
+QUERY_PREFIX_TOKENS = 3
+QUERY_MIN_TOKENS = 10
+# Токен паддинга, он же augmentation-токен запроса (как <|endoftext|> у ColQwen2)
+PAD_TOKEN_ID = 0
+
+
+def _seeded_vector(seed: int) -> torch.Tensor:
+    generator = torch.Generator().manual_seed(seed)
+    return torch.randn(EMBEDDING_DIM, generator=generator)
+
+
+def word_vector(word: str) -> torch.Tensor:
+    """
+    Детерминированный вектор слова (одинаковый для страницы и запроса)
+    """
+    return _seeded_vector(zlib.crc32(word.lower().encode("utf-8")))
+
+
+def word_token_id(word: str) -> int:
+    """
+    Детерминированный идентификатор токена слова (не пересекается с префиксом и паддингом)
+    """
+    return 100 + zlib.crc32(word.lower().encode("utf-8")) % 50_000
+
+
+class StubBatch(dict):
+    """
+    Аналог BatchFeature: словарь тензоров с методом to()
+    """
+
+    def to(self, device) -> "StubBatch":
+        return StubBatch({key: value.to(device) for key, value in self.items()})
+
+
+class StubColQwen2Processor:
+    """
+    Заглушка ColQwen2Processor: превращает страницы и запросы в признаки токенов
+    """
+
+    # Визуальные токены страницы идут сразу после префикса, до конца последовательности
+    image_token_offset = IMAGE_PREFIX_TOKENS
+
+    def __init__(self, max_image_tokens: int = MAX_IMAGE_TOKENS):
+        self.max_image_tokens = max_image_tokens
+        self._position_table = torch.stack(
+            [_seeded_vector(1_000_000 + i) for i in range(max_image_tokens)]
+        )
+        self._prefix_table = torch.stack(
+            [_seeded_vector(2_000_000 + i) for i in range(max(IMAGE_PREFIX_TOKENS, QUERY_PREFIX_TOKENS))]
+        )
+        self._pad_vector = _seeded_vector(3_000_000)
+        self.tokenizer = SimpleNamespace(pad_token_id=PAD_TOKEN_ID)
+
+    def _image_tokens(self, image: Image.Image) -> torch.Tensor:
+        # Та же сетка патчей, что у энкодера сервиса
+        grid_w, grid_h = token_grid(image.width, image.height, self.max_image_tokens)
+        # Яркость патчей модулирует позиционные векторы
+        thumbnail = image.convert("L").resize((grid_w, grid_h), Image.BILINEAR)
+        intensity = torch.tensor(list(thumbnail.getdata()), dtype=torch.float32) / 255.0
+        patches = self._position_table[: grid_w * grid_h] * (1.0 - intensity)[:, None]
+
+        # Слова страницы (если известны) занимают первые патчи, как текст в реальной модели
+        words = (getattr(image, "text", None) or "").split()[: len(patches)]
+        for i, word in enumerate(words):
+            patches[i] = word_vector(word)
+
+        return torch.cat([self._prefix_table[:IMAGE_PREFIX_TOKENS], patches])
+
+    def _query_tokens(self, query: str) -> Tuple[torch.Tensor, torch.Tensor]:
+        words = query.split()
+        tokens = [*self._prefix_table[:QUERY_PREFIX_TOKENS], *(word_vector(word) for word in words)]
+        ids = [*range(1, QUERY_PREFIX_TOKENS + 1), *(word_token_id(word) for word in words)]
+        # Дополнение до минимальной длины, как augmentation-токены ColQwen2
+        while len(tokens) < QUERY_MIN_TOKENS:
+            tokens.append(self._pad_vector)
+            ids.append(PAD_TOKEN_ID)
+        return torch.stack(tokens), torch.tensor(ids, dtype=torch.long)
+
+    @staticmethod
+    def _pad(sequences: List[torch.Tensor], ids: List[torch.Tensor] = None) -> StubBatch:
+        length = max(len(sequence) for sequence in sequences)
+        features = torch.zeros(len(sequences), length, EMBEDDING_DIM)
+        attention_mask = torch.zeros(len(sequences), length, dtype=torch.long)
+        for i, sequence in enumerate(sequences):
+            features[i, : len(sequence)] = sequence
+            attention_mask[i, : len(sequence)] = 1
+        batch = StubBatch(features=features, attention_mask=attention_mask)
+        if ids is not None:
+            input_ids = torch.full((len(sequences), length), PAD_TOKEN_ID, dtype=torch.long)
+            for i, sequence_ids in enumerate(ids):
+                input_ids[i, : len(sequence_ids)] = sequence_ids
+            batch["input_ids"] = input_ids
+        return batch
+
+    def process_images(self, images: List[Image.Image]) -> StubBatch:
+        return self._pad([self._image_tokens(image) for image in images])
+
+    def process_queries(self, queries: List[str]) -> StubBatch:
+        tokens, ids = zip(*(self._query_tokens(query) for query in queries))
+        return self._pad(list(tokens), list(ids))
+
+
+class StubColQwen2:
+    """
+    Заглушка модели ColQwen2: нормирует признаки и обнуляет паддинг
+    """
+
+    def __init__(self, device: str = "cpu"):
+        self.device = torch.device(device)
+
+    def eval(self) -> "StubColQwen2":
+        return self
+
+    def __call__(self, features: torch.Tensor, attention_mask: torch.Tensor, input_ids=None) -> torch.Tensor:
+        embeddings = torch.nn.functional.normalize(features, dim=-1)
+        return embeddings * attention_mask.unsqueeze(-1)
+
+
+def load_stub_encoder() -> Tuple[StubColQwen2, StubColQwen2Processor]:
+    """
+    Загрузчик заглушки для воркеров параллельного кодирования
+    (encoder_factory в ParallelPageEncoder и DocumentIndexer)
+    """
+    return StubColQwen2(), StubColQwen2Processor()
@@ -0,0 +1,53 @@
+"""
+CPU-заглушка MiniCPM-V для нагрузочного тестирования.
+
+Повторяет интерфейс MultimodalInference (generate_response и
+generate_response_stream) и занимает модель на время, сравнимое с
+генерацией: задержка до первого токена плюс задержка на каждый токен.
+Как и настоящая модель, генерирует по одному запросу за раз.
+"""
+
+import threading
+import time
+from typing import Iterator
+
+from PIL import Image
+
+from src.utils import stream_in_worker
+
+
+class StubMultimodalInference:
+    """
+    Заглушка генерации ответа с настраиваемой задержкой
+    """
+
+    def __init__(self, prefill_ms: float = 200.0, token_ms: float = 20.0, answer_tokens: int = 32):
+        """
+        Args:
+            prefill_ms (float): Задержка до первого токена, мс
+            token_ms (float): Задержка на каждый следующий токен, мс
+            answer_tokens (int): Число токенов ответа
+        """
+        self.prefill_ms = prefill_ms
+        self.token_ms = token_ms
+        self.answer_tokens = answer_tokens
+        self.model_revision = "stub"
+        self._lock = threading.Lock()
+
+    def _tokens(self, image: Image.Image, query: str) -> list:
+        words = f"Ответ заглушки на запрос '{query}' по странице {image.width}x{image.height}".split()
+        return [words[i % len(words)] for i in range(self.answer_tokens)]
+
+    def generate_response(self, image: Image.Image, query: str, max_length: int = 10000) -> str:
+        return "".join(self.generate_response_stream(image, query, max_length))
+
+    def _generate(self, image: Image.Image, query: str) -> Iterator[str]:
+        time.sleep(self.prefill_ms / 1000)
+        for i, token in enumerate(self._tokens(image, query)):
+            if i:
+                time.sleep(self.token_ms / 1000)
+            yield token if i == 0 else f" {token}"
+
+    def generate_response_stream(self, image: Image.Image, query: str, max_length: int = 10000) -> Iterator[str]:
+        # Как в MultimodalInference: блокировку держит поток-производитель
+        return stream_in_worker(lambda: self._generate(image, query), lambda: self._lock)
@@ -0,0 +1,96 @@
+"""
+Генерация синтетических страниц и размеченных запросов для бенчмарков.
+
+Страницы разных форматов (A4, слайды, сканы A3) с псевдословами на белом фоне.
+Набор слов страницы сохраняется в атрибуте text, поэтому для каждого запроса
+известна правильная страница.
+"""
+
+import random
+from typing import List, Tuple
+
+from PIL import Image, ImageDraw
+
+# Форматы страниц, встречающиеся в архиве: A4 при 150 dpi, слайд 16:9, скан A3, мелкий скан
+PAGE_SIZES = [
+    (1240, 1754),
+    (1280, 720),
+    (1754, 2480),
+    (620, 877),
+]
+
+# Латиница: шрифт PIL по умолчанию не гарантирует кириллицу
+_SYLLABLES = ["ni", "kel", "rud", "met", "al", "pro", "iz", "vod", "stvo", "plan", "otchet", "god"]
+
+
+def _make_vocabulary(rng: random.Random, size: int) -> List[str]:
+    vocabulary = set()
+    while len(vocabulary) < size:
+        vocabulary.add("".join(rng.choice(_SYLLABLES) for _ in range(rng.randint(2, 4))))
+    return sorted(vocabulary)
+
+
+def generate_pages(
+    num_pages: int,
+    words_per_page: int = 40,
+    seed: int = 0
+) -> List[Image.Image]:
+    """
+    Генерация синтетических страниц
+
+    Args:
+        num_pages (int): Количество страниц
+        words_per_page (int): Количество слов на странице
+        seed (int): Зерно генератора
+
+    Returns:
+        List[Image.Image]: Страницы с атрибутами filename, page_number и text
+    """
+    rng = random.Random(seed)
+    vocabulary = _make_vocabulary(rng, max(500, num_pages * 4))
+
+    pages = []
+    for i in range(num_pages):
+        width, height = PAGE_SIZES[i % len(PAGE_SIZES)]
+        image = Image.new("RGB", (width, height), "white")
+        draw = ImageDraw.Draw(image)
+
+        words = rng.sample(vocabulary, words_per_page)
+        for word in words:
+            position = (rng.randint(0, width - 100), rng.randint(0, height - 20))
+            draw.text(position, word, fill="black")
+
+        document_number, page_number = divmod(i, 10)
+        image.filename = f"synthetic_{document_number}.pdf_page_{page_number + 1}.png"
+        image.page_number = page_number + 1
+        image.text = " ".join(words)
+        pages.append(image)
+
+    return pages
+
+
+def generate_queries(
+    pages: List[Image.Image],
+    num_queries: int,
+    words_per_query: int = 3,
+    seed: int = 0
+) -> List[Tuple[str, int]]:
+    """
+    Генерация запросов с известной релевантной страницей
+
+    Args:
+        pages (List[Image.Image]): Страницы из generate_pages
+        num_queries (int): Количество запросов
+        words_per_query (int): Количество слов страницы в запросе
+        seed (int): Зерно генератора
+
+    Returns:
+        List[Tuple[str, int]]: Пары (запрос, индекс релевантной страницы)
+    """
+    rng = random.Random(seed + 1)
+    queries = []
+    for _ in range(num_queries):
+        page_id = rng.randrange(len(pages))
+        words = rng.sample(pages[page_id].text.split(), words_per_query)
+        queries.append((" ".join(words), page_id))
+    return queries
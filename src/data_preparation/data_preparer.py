@@ -1,7 +1,11 @@
+import json
 import os
 from typing import List, Dict, Optional
 from PIL import Image
 
+from src.page_store import PAGE_EXTENSIONS, PAGES_MANIFEST
+from src.utils import PATCH_SIZE, fit_to_token_budget
+
 
 class DocumentDataPreparer:
     """
@@ -43,9 +47,9 @@ class DocumentDataPreparer:
         # Список для хранения изображений
         png_images = []
 
-        # Перебор файлов в директории
+        # Перебор файлов в директории (PNG и сжатые страницы из PageStore)
         for filename in os.listdir(directory):
-            if filename.endswith('.png'):
+            if filename.lower().endswith(PAGE_EXTENSIONS):
                 image_path = os.path.join(directory, filename)
                 
                 # Открытие изображения
@@ -89,8 +93,55 @@ class DocumentDataPreparer:
 
                 png_images.append(img)
 
+        if not filter_conditions:
+            png_images = self._order_by_manifest(png_images, directory)
+
         return png_images
 
+    @staticmethod
+    def _order_by_manifest(images: List[Image.Image], directory: str) -> List[Image.Image]:
+        """
+        Порядок страниц по манифесту импортированного индекса
+
+        Идентификатор точки Qdrant - позиция страницы в наборе данных, поэтому
+        после импорта пакета индекса страницы ставятся на позиции из манифеста.
+        Позиции без точки (копии страниц) занимают остальные файлы, а если
+        файлов не хватает - пустые заглушки без имени файла.
+
+        Args:
+            images (List[Image.Image]): Прочитанные страницы
+            directory (str): Директория страниц
+
+        Returns:
+            List[Image.Image]: Страницы в порядке идентификаторов точек
+        """
+        path = os.path.join(directory, PAGES_MANIFEST)
+        if not os.path.exists(path):
+            return images
+
+        with open(path, encoding="utf-8") as f:
+            pages = {int(point_id): filename for point_id, filename in json.load(f)["pages"].items()}
+
+        by_name = {img.filename: img for img in images}
+        ordered = [None] * (max(pages, default=-1) + 1)
+        for point_id, filename in pages.items():
+            ordered[point_id] = by_name.pop(filename, None)
+            if ordered[point_id] is None:
+                print(f"Страница {filename} из манифеста не найдена")
+
+        rest = iter(sorted(by_name.values(), key=lambda img: img.filename))
+        result = []
+        for position, img in enumerate(ordered):
+            if img is None and position not in pages:
+                img = next(rest, None)
+            if img is None:
+                img = Image.new("RGB", (PATCH_SIZE, PATCH_SIZE), "white")
+                img.filename = None
+                img.page_number = None
+            result.append(img)
+        result.extend(rest)
+        return result
+
     def read_png_files_with_order(self, path_to_user_files) -> List[Image.Image]:
         # Список для хранения изображений
         png_images = []
@@ -127,6 +178,7 @@ class DocumentDataPreparer:
         images: List[Image.Image], 
         target_size: Optional[tuple] = None,
         convert_mode: Optional[str] = None,
+        max_image_tokens: Optional[int] = None,
     ) -> List[Image.Image]:
         """
         Предобработка изображений
@@ -135,6 +187,8 @@ class DocumentDataPreparer:
             images (List[Image.Image]): Список изображений
             target_size (tuple, optional): Целевой размер изображений
             convert_mode (str, optional): Режим конвертации цвета
+            max_image_tokens (int, optional): Бюджет визуальных токенов: изображения
+                уменьшаются с сохранением пропорций до сетки патчей 28x28 в пределах бюджета
 
         Returns:
             List[Image.Image]: Предобработанные изображения
@@ -148,13 +202,23 @@ class DocumentDataPreparer:
             if target_size:
                 images[i] = images[i].resize(target_size, Image.LANCZOS)
 
+            # Растровые страницы только уменьшаются: увеличение не добавит деталей
+            if max_image_tokens:
+                images[i] = fit_to_token_budget(images[i], max_image_tokens)
+
+            # Метаданные страницы теряются при convert/resize
+            for attribute in ("filename", "page_number"):
+                if hasattr(img, attribute) and not hasattr(images[i], attribute):
+                    setattr(images[i], attribute, getattr(img, attribute))
+
         return images
 
     def prepare_documents(
         self, 
         subdirectory: Optional[str] = None,
         filter_conditions: Optional[Dict[str, str]] = None,
-        target_size: Optional[tuple] = None
+        target_size: Optional[tuple] = None,
+        max_image_tokens: Optional[int] = None
     ) -> List[Image.Image]:
         """
         Полный цикл подготовки документов
@@ -163,6 +227,7 @@ class DocumentDataPreparer:
             subdirectory (str, optional): Поддиректория для поиска
             filter_conditions (dict, optional): Условия фильтрации
             target_size (tuple, optional): Целевой размер изображений
+            max_image_tokens (int, optional): Бюджет визуальных токенов на страницу
 
         Returns:
             List[Image.Image]: Подготовленные изображения
@@ -176,7 +241,8 @@ class DocumentDataPreparer:
         # Предобработка изображений
         processed_images = self.preprocess_images(
             images, 
-            target_size=target_size
+            target_size=target_size,
+            max_image_tokens=max_image_tokens
         )
 
         return processed_images
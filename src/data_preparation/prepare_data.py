@@ -3,36 +3,72 @@ import os  # Импорт os для работы с файлами
 
 import fitz  # PyMuPDF для работы с PDF
 from PIL import Image  # Импорт PIL для работы с изображениями
-import io  # Импорт io для работы с байтовыми потоками
 
 from docx2pdf import convert
+from src.utils import PATCH_SIZE, token_grid
 from tqdm.notebook import tqdm  # Импорт прогресс-бара для Jupyter
 
 
-def pdf_to_pil_images(pdf_path, output_directory, user_files=False):
-    # Открываем PDF файл
+def iter_pdf_pages(pdf_document, max_image_tokens=None):
+    """
+    Постраничная растеризация открытого PDF документа
 
-    pdf_document = fitz.open(pdf_path)
+    Страницы рендерятся по одной, поэтому в памяти держится только
+    текущая страница, а не весь документ. При заданном max_image_tokens
+    DPI выбирается для каждой страницы так, чтобы изображение с сохранением
+    пропорций заполнило бюджет визуальных токенов и легло на сетку патчей
+    ColQwen2: плотный A3 скан и почти пустой слайд стоят одинаково.
 
-    for page_number in tqdm(range(len(pdf_document))):
+    Args:
+        pdf_document (fitz.Document): Открытый PDF документ
+        max_image_tokens (int, optional): Бюджет визуальных токенов на страницу
+            (None - разрешение PyMuPDF по умолчанию, 72 DPI)
+
+    Yields:
+        tuple: Номер страницы (с 1) и PIL изображение с атрибутом render_dpi
+    """
+    for page_number in range(len(pdf_document)):
         # Получаем страницу
         page = pdf_document.load_page(page_number)
 
-        # Рендерим страницу в изображение (pixmap)
-        pix = page.get_pixmap()
+        # Масштаб рендеринга под бюджет токенов (размеры страницы в пунктах, 72 на дюйм)
+        zoom = 1.0
+        target_size = None
+        if max_image_tokens:
+            grid_w, grid_h = token_grid(page.rect.width, page.rect.height, max_image_tokens, upscale=True)
+            target_size = (grid_w * PATCH_SIZE, grid_h * PATCH_SIZE)
+            zoom = max(target_size[0] / page.rect.width, target_size[1] / page.rect.height)
+
+        # Рендерим страницу в изображение (pixmap) без альфа-канала
+        pix = page.get_pixmap(matrix=fitz.Matrix(zoom, zoom), alpha=False)
 
-        # Конвертируем pixmap в PIL изображение
-        img = Image.open(io.BytesIO(pix.tobytes()))
+        # PIL изображение напрямую из пикселей pixmap, без кодирования в PNG и обратно
+        mode = "L" if pix.n == 1 else "RGB"
+        img = Image.frombytes(mode, (pix.width, pix.height), pix.samples)
+
+        # Приведение к сетке патчей (отличие от рендера - доли патча)
+        if target_size and img.size != target_size:
+            img = img.resize(target_size, Image.LANCZOS)
+        img.render_dpi = round(72 * zoom, 1)
+
+        yield page_number + 1, img
+
+
+def pdf_to_pil_images(pdf_path, output_directory, user_files=False):
+    # Открываем PDF файл
+
+    pdf_document = fitz.open(pdf_path)
 
+    for page_number, img in tqdm(iter_pdf_pages(pdf_document), total=len(pdf_document)):
         # Сохраняем изображение в выходную директорию
         if user_files:
             # Добавляем метку времени для пользовательских файлов
             timestamp = datetime.now().timestamp()
             image_filename = os.path.join(output_directory, 
-                f"{os.path.basename(pdf_path)}_timestamp__{timestamp}__page_{page_number + 1}.png")
+                f"{os.path.basename(pdf_path)}_timestamp__{timestamp}__page_{page_number}.png")
         else:
             image_filename = os.path.join(output_directory, 
-                f"{os.path.basename(pdf_path)}_page_{page_number + 1}.png")
+                f"{os.path.basename(pdf_path)}_page_{page_number}.png")
             
         img.save(image_filename)
 
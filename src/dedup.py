@@ -0,0 +1,154 @@
+"""
+Поиск одинаковых и почти одинаковых страниц перед кодированием.
+
+В архиве много повторяющихся страниц: титульные листы, типовые юридические
+разделы, повторно загруженные PDF. Для каждой страницы считается
+перцептивный хэш; страница, отличающаяся от уже встреченной не более чем
+на max_distance бит, не кодируется и не попадает в индекс, а записывается
+в payload представителя (поле duplicates), так что выдача по-прежнему
+показывает все исходные файлы.
+
+Поиск соседей по расстоянию Хэмминга - индекс по полосам: хэш делится на
+max_distance + 1 частей, и у хэшей на расстоянии не больше max_distance
+хотя бы одна часть совпадает точно. Копии ищутся только внутри раздела
+(арендатора): имена файлов одного арендатора не попадают в выдачу другого.
+"""
+
+import threading
+from collections import defaultdict
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Tuple
+
+from PIL import Image
+
+from src.utils import perceptual_hash
+
+
+@dataclass
+class DuplicateGroup:
+    """
+    Представитель группы одинаковых страниц.
+
+    Attributes:
+        hash (int): Перцептивный хэш представителя
+        aspect (float): Отношение ширины к высоте
+        filename (str): Файл представителя
+        point_id (int): Идентификатор точки представителя (None - еще не загружен)
+        duplicates (list): Копии страницы: {"filename", "page_number"}
+    """
+    hash: int
+    aspect: float
+    filename: Optional[str] = None
+    point_id: Optional[int] = None
+    duplicates: List[dict] = field(default_factory=list)
+
+    def payload(self) -> dict:
+        """
+        Поля payload представителя, по которым группа восстанавливается из коллекции
+        """
+        return {
+            "phash": format(self.hash, "x"),
+            "aspect": round(self.aspect, 4),
+            "duplicates": self.duplicates,
+        }
+
+
+class PageDeduplicator:
+    """
+    Индекс перцептивных хэшей страниц коллекции.
+    """
+
+    def __init__(self, max_distance: int = 6, hash_size: int = 16, aspect_tolerance: float = 0.02):
+        """
+        Args:
+            max_distance (int): Максимальное расстояние Хэмминга между копиями (0 - только точные)
+            hash_size (int): Сторона сетки хэша (hash_size ** 2 бит)
+            aspect_tolerance (float): Допустимое относительное различие пропорций страниц
+        """
+        self.max_distance = max_distance
+        self.hash_size = hash_size
+        self.aspect_tolerance = aspect_tolerance
+
+        bits = hash_size ** 2
+        bands = max_distance + 1
+        self._bands = [(bits * i // bands, bits * (i + 1) // bands) for i in range(bands)]
+        self._index: Dict[Optional[str], List[Dict[int, List[DuplicateGroup]]]] = defaultdict(
+            lambda: [defaultdict(list) for _ in self._bands]
+        )
+        self._lock = threading.Lock()
+        self.groups = 0
+        self.duplicates = 0
+
+    def _keys(self, value: int) -> List[int]:
+        return [(value >> start) & ((1 << (end - start)) - 1) for start, end in self._bands]
+
+    def _find(self, value: int, aspect: float, partition: Optional[str]) -> Optional[DuplicateGroup]:
+        for band, key in zip(self._index[partition], self._keys(value)):
+            for group in band.get(key, ()):
+                if (
+                    bin(group.hash ^ value).count("1") <= self.max_distance
+                    and abs(group.aspect - aspect) <= self.aspect_tolerance * group.aspect
+                ):
+                    return group
+        return None
+
+    def _add(self, group: DuplicateGroup, partition: Optional[str]):
+        for band, key in zip(self._index[partition], self._keys(group.hash)):
+            band[key].append(group)
+        self.groups += 1
+
+    def match(self, image: Image.Image, partition: Optional[str] = None) -> Tuple[DuplicateGroup, bool]:
+        """
+        Поиск группы страницы; новая страница становится представителем
+
+        Повторная загрузка того же файла (совпадает имя) в копии не записывается.
+
+        Args:
+            image (Image.Image): Изображение страницы с метаданными
+            partition (str, optional): Раздел (арендатор), внутри которого ищутся копии
+
+        Returns:
+            tuple: Группа и признак того, что страница - новый представитель
+        """
+        value = perceptual_hash(image, self.hash_size)
+        aspect = image.width / image.height
+        filename = getattr(image, "filename", None)
+        with self._lock:
+            group = self._find(value, aspect, partition)
+            if group is None:
+                group = DuplicateGroup(hash=value, aspect=aspect, filename=filename)
+                self._add(group, partition)
+                return group, True
+
+            known = {group.filename, *(duplicate["filename"] for duplicate in group.duplicates)}
+            if filename not in known:
+                group.duplicates.append({
+                    "filename": filename,
+                    "page_number": getattr(image, "page_number", None),
+                })
+                self.duplicates += 1
+            return group, False
+
+    def restore(self, point_id: int, payload: dict, partition: Optional[str] = None):
+        """
+        Восстановление группы по payload точки уже построенной коллекции
+        """
+        if not payload.get("phash") or not payload.get("aspect"):
+            return
+        group = DuplicateGroup(
+            hash=int(payload["phash"], 16),
+            aspect=payload["aspect"],
+            filename=payload.get("filename"),
+            point_id=point_id,
+            duplicates=list(payload.get("duplicates") or []),
+        )
+        with self._lock:
+            self._add(group, partition)
+            self.duplicates += len(group.duplicates)
+
+    def drop(self, partition: Optional[str]):
+        """
+        Забыть хэши раздела (после удаления документов арендатора)
+        """
+        with self._lock:
+            self._index.pop(partition, None)
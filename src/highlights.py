@@ -0,0 +1,139 @@
+"""
+Подсветка релевантных областей страницы по сохраненным мультивекторам.
+
+Вектор страницы ColQwen2 - это векторы токенов, часть из которых
+соответствует патчам 28x28 пикселей сетки страницы (по строкам).
+MaxSim складывается из максимумов сходства каждого токена запроса
+с векторами страницы, поэтому по матрице сходства запроса и страницы,
+которую Qdrant возвращает вместе с найденной точкой, видно, какие патчи
+дали вклад в оценку. Энкодер не вызывается: одно матричное умножение
+(токены запроса x токены страницы) на найденную страницу.
+
+Для каждой страницы возвращаются тепловая карта по сетке патчей
+(максимальное сходство патча с токенами запроса, нормированное по странице)
+и прямоугольники связных областей выше порога в долях размера страницы.
+"""
+
+from collections import deque
+from typing import List, Optional, Tuple
+
+import numpy as np
+from PIL import Image
+
+from configs.service_config import HighlightConfig
+from src.utils import PATCH_SIZE
+
+
+def image_token_offset(processor, default: int) -> int:
+    """
+    Позиция первого визуального токена в мультивекторе страницы
+
+    Определяется по input_ids процессора для пробного изображения;
+    если процессор недоступен (модели в отдельном процессе), берется default.
+    """
+    offset = getattr(processor, "image_token_offset", None)
+    if offset is not None:
+        return offset
+    try:
+        probe = processor.process_images([Image.new("RGB", (PATCH_SIZE * 2, PATCH_SIZE * 2), "white")])
+        image_token_id = processor.tokenizer.convert_tokens_to_ids(processor.image_token)
+        return int((probe["input_ids"][0] == image_token_id).nonzero()[0])
+    except Exception:
+        return default
+
+
+class PatchHighlighter:
+    """
+    Тепловая карта и области совпадения по векторам запроса и страницы.
+    """
+
+    def __init__(self, config: HighlightConfig, image_token_offset: int):
+        """
+        Args:
+            config (HighlightConfig): Порог областей и их число
+            image_token_offset (int): Позиция первого визуального токена страницы
+        """
+        self.config = config
+        self.image_token_offset = image_token_offset
+
+    def _patch_vectors(self, page: np.ndarray, grid: Tuple[int, int]) -> Optional[np.ndarray]:
+        patches = grid[0] * grid[1]
+        # Паддинг батча хранится нулевыми векторами в конце
+        length = int(np.count_nonzero(np.abs(page).sum(axis=1)))
+        # Без суффикса после изображения (заглушка) визуальные токены занимают конец
+        offset = min(self.image_token_offset, length - patches)
+        if offset < 0:
+            return None
+        return page[offset:offset + patches]
+
+    def _boxes(self, heat: np.ndarray, contributions: np.ndarray) -> List[dict]:
+        """
+        Связные области (4-соседство) патчей с нормированным сходством выше порога
+        """
+        grid_h, grid_w = heat.shape
+        mask = heat >= self.config.threshold
+        seen = np.zeros_like(mask)
+        total = contributions.sum()
+        boxes = []
+        for start in zip(*np.nonzero(mask)):
+            if seen[start]:
+                continue
+            seen[start] = True
+            cells = [start]
+            frontier = deque([start])
+            while frontier:
+                y, x = frontier.popleft()
+                for ny, nx in ((y - 1, x), (y + 1, x), (y, x - 1), (y, x + 1)):
+                    if 0 <= ny < grid_h and 0 <= nx < grid_w and mask[ny, nx] and not seen[ny, nx]:
+                        seen[ny, nx] = True
+                        cells.append((ny, nx))
+                        frontier.append((ny, nx))
+            ys, xs = zip(*cells)
+            boxes.append({
+                "x0": min(xs) / grid_w,
+                "y0": min(ys) / grid_h,
+                "x1": (max(xs) + 1) / grid_w,
+                "y1": (max(ys) + 1) / grid_h,
+                "score": round(float(max(heat[cell] for cell in cells)), 3),
+                # Доля оценки MaxSim, набранная патчами области
+                "score_share": round(float(sum(contributions[cell] for cell in cells) / total), 3)
+                if total > 0 else 0.0,
+            })
+        boxes.sort(key=lambda box: (box["score_share"], box["score"]), reverse=True)
+        return boxes[:self.config.max_boxes]
+
+    def highlight(self, query: np.ndarray, page: np.ndarray, grid: Tuple[int, int]) -> Optional[dict]:
+        """
+        Подсветка одной найденной страницы
+
+        Args:
+            query (np.ndarray): Векторы токенов запроса (tokens, dim)
+            page (np.ndarray): Сохраненный мультивектор страницы (tokens, dim)
+            grid (tuple): Сетка патчей страницы (по ширине, по высоте)
+
+        Returns:
+            dict: Сетка, тепловая карта (строки сетки) и области; None, если
+                визуальные токены не удалось сопоставить с сеткой
+        """
+        grid_w, grid_h = grid
+        patches = self._patch_vectors(page, grid)
+        if patches is None:
+            return None
+
+        similarity = query @ patches.T
+        # Вклад MaxSim: максимум каждого токена запроса достается одному патчу
+        contributions = np.zeros(len(patches), dtype=np.float32)
+        np.add.at(contributions, similarity.argmax(axis=1), np.maximum(similarity.max(axis=1), 0))
+
+        heat = similarity.max(axis=0)
+        low, high = heat.min(), heat.max()
+        heat = (heat - low) / (high - low) if high > low else np.zeros_like(heat)
+        heat = heat.reshape(grid_h, grid_w)
+
+        result = {
+            "grid": [grid_w, grid_h],
+            "boxes": self._boxes(heat, contributions.reshape(grid_h, grid_w)),
+        }
+        if self.config.heatmap:
+            result["heatmap"] = np.round(heat, 3).tolist()
+        return result
@@ -0,0 +1,502 @@
+"""
+Переносимый пакет индекса для быстрого развертывания окружений.
+
+Пакет - директория с манифестом и частями одинакового размера:
+    manifest.json        версия формата, параметры коллекции, модель и ее ревизия,
+                         соответствие точек файлам страниц, контрольные суммы частей
+    points/*.npz         точки коллекции: идентификаторы, payload и векторы (float16)
+    pages/*.tar          изображения страниц с миниатюрами и превью
+
+Коллекция сохраняется точками, а не снапшотом хранилища Qdrant: формат
+не зависит от версии Qdrant, и импорт в пустой сервер - это параллельная
+загрузка частей через upsert без повторного кодирования страниц. Каждая
+часть проверяется по SHA-256 до загрузки, после загрузки сверяется число
+точек и выборочно - сами точки. Импорт создает версионированную коллекцию
+и переключает на нее алиас, как reindex.
+
+Примеры:
+    python -m src.index_bundle export --output bundles/nornikel
+    python -m src.index_bundle import --bundle bundles/nornikel --workers 8
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import random
+import tarfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Iterator, List, Optional
+
+import numpy as np
+from pydantic import TypeAdapter
+from qdrant_client import QdrantClient
+from qdrant_client.http import models
+from tqdm import tqdm
+
+from configs.service_config import IndexingConfig, ModelConfig, QdrantConfig
+from src.page_store import PAGE_EXTENSIONS, PAGES_MANIFEST
+from src.qdrant_connection import (
+    call_with_retries,
+    check_alias_name,
+    create_qdrant_client,
+    resolve_collection,
+    switch_alias,
+)
+from src.tenants import TENANT_FIELD
+
+# Версия формата пакета; импорт отказывается читать более новые
+FORMAT_VERSION = 1
+MANIFEST_NAME = "manifest.json"
+
+
+def sha256_file(path: str) -> str:
+    hasher = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            hasher.update(block)
+    return hasher.hexdigest()
+
+
+def model_revision(model_name: str) -> Optional[str]:
+    """
+    Ревизия модели на Hugging Face Hub (None, если хаб недоступен)
+    """
+    try:
+        from huggingface_hub import HfApi
+        return HfApi().model_info(model_name).sha
+    except Exception as e:
+        print(f"Ревизия модели {model_name} не определена: {e}")
+        return None
+
+
+def _write_points_chunk(path: str, points: list) -> dict:
+    """
+    Запись части точек; мультивекторы хранятся одним массивом токенов со смещениями
+    """
+    arrays = {
+        "ids": np.asarray([point.id for point in points], dtype=np.int64),
+        "payload": np.asarray(json.dumps([point.payload for point in points], ensure_ascii=False)),
+    }
+    vectors = [point.vector if isinstance(point.vector, dict) else {"": point.vector} for point in points]
+    for name in vectors[0]:
+        values = [vector[name] for vector in vectors]
+        if values and isinstance(values[0][0], list):
+            lengths = [len(value) for value in values]
+            arrays[f"multi__{name}"] = np.concatenate([np.asarray(value, dtype=np.float16) for value in values])
+            arrays[f"offsets__{name}"] = np.concatenate([[0], np.cumsum(lengths)]).astype(np.int64)
+        else:
+            arrays[f"dense__{name}"] = np.asarray(values, dtype=np.float16)
+
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "wb") as f:
+        np.savez(f, **arrays)
+    os.replace(tmp_path, path)
+    return {"file": os.path.basename(path), "points": len(points), "sha256": sha256_file(path)}
+
+
+def _read_points_chunk(path: str) -> List[models.PointStruct]:
+    with np.load(path, allow_pickle=False) as data:
+        ids = data["ids"].tolist()
+        payloads = json.loads(str(data["payload"]))
+        vectors: List[dict] = [{} for _ in ids]
+        for key in data.files:
+            kind, _, name = key.partition("__")
+            if kind == "multi":
+                tokens = data[key].astype(np.float32)
+                offsets = data[f"offsets__{name}"]
+                for i in range(len(ids)):
+                    vectors[i][name] = tokens[offsets[i]:offsets[i + 1]].tolist()
+            elif kind == "dense":
+                for i, vector in enumerate(data[key].astype(np.float32)):
+                    vectors[i][name] = vector.tolist()
+
+    return [
+        models.PointStruct(id=point_id, vector=vector.get("", vector), payload=payload)
+        for point_id, vector, payload in zip(ids, vectors, payloads)
+    ]
+
+
+def _page_files(directory: str) -> List[str]:
+    """
+    Файлы страниц и их уменьшенных копий относительно directory
+    """
+    files = []
+    for root, _, names in os.walk(directory):
+        for name in names:
+            if name.lower().endswith(PAGE_EXTENSIONS):
+                files.append(os.path.relpath(os.path.join(root, name), directory))
+    return sorted(files)
+
+
+def _write_pages_archive(path: str, directory: str, files: List[str]) -> dict:
+    tmp_path = f"{path}.tmp"
+    with tarfile.open(tmp_path, "w") as tar:
+        for name in files:
+            tar.add(os.path.join(directory, name), arcname=name)
+    os.replace(tmp_path, path)
+    return {"file": os.path.basename(path), "files": len(files), "sha256": sha256_file(path)}
+
+
+def _scroll(client: QdrantClient, collection_name: str, limit: int, config: QdrantConfig) -> Iterator[list]:
+    offset = None
+    while True:
+        points, offset = call_with_retries(
+            lambda: client.scroll(
+                collection_name=collection_name,
+                limit=limit,
+                offset=offset,
+                with_payload=True,
+                with_vectors=True
+            ),
+            config
+        )
+        if points:
+            yield points
+        if offset is None:
+            return
+
+
+def export_bundle(
+    client: QdrantClient,
+    collection_name: str,
+    output: str,
+    pages_directory: str,
+    model_name: str,
+    revision: Optional[str] = None,
+    chunk_points: int = 256,
+    pages_per_archive: int = 2000,
+    workers: int = 4,
+    qdrant_config: Optional[QdrantConfig] = None
+) -> dict:
+    """
+    Экспорт коллекции и хранилища страниц в пакет
+
+    Args:
+        client (QdrantClient): Клиент Qdrant
+        collection_name (str): Коллекция или алиас рабочей коллекции
+        output (str): Директория пакета (создается)
+        pages_directory (str): Директория страниц (PageStore)
+        model_name (str): Модель, которой закодированы страницы
+        revision (str, optional): Ревизия модели (по умолчанию запрашивается у хаба)
+        chunk_points (int): Точек в одной части
+        pages_per_archive (int): Файлов страниц в одном архиве
+        workers (int): Потоков записи частей
+        qdrant_config (QdrantConfig, optional): Параметры повторов запросов
+
+    Returns:
+        dict: Манифест пакета
+    """
+    qdrant_config = qdrant_config or QdrantConfig()
+    source = resolve_collection(client, collection_name)
+    info = client.get_collection(source)
+    os.makedirs(os.path.join(output, "points"), exist_ok=True)
+    os.makedirs(os.path.join(output, "pages"), exist_ok=True)
+
+    pages: Dict[int, str] = {}
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as writer:
+        point_futures = []
+        with tqdm(total=info.points_count, desc="Export points") as pbar:
+            for i, points in enumerate(_scroll(client, source, chunk_points, qdrant_config)):
+                pages.update({point.id: (point.payload or {}).get("filename") for point in points})
+                path = os.path.join(output, "points", f"chunk_{i:05d}.npz")
+                point_futures.append(writer.submit(_write_points_chunk, path, points))
+                # Не больше 2 * workers частей в памяти в ожидании записи
+                if len(point_futures) > 2 * workers:
+                    point_futures[-2 * workers - 1].result()
+                pbar.update(len(points))
+
+        files = _page_files(pages_directory)
+        page_futures = [
+            writer.submit(
+                _write_pages_archive,
+                os.path.join(output, "pages", f"pages_{i // pages_per_archive:05d}.tar"),
+                pages_directory,
+                files[i:i + pages_per_archive]
+            )
+            for i in range(0, len(files), pages_per_archive)
+        ]
+        point_chunks = [future.result() for future in point_futures]
+        page_archives = [future.result() for future in tqdm(page_futures, desc="Export pages")]
+
+    manifest = {
+        "format_version": FORMAT_VERSION,
+        "created_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "collection": {
+            "name": collection_name,
+            "source": source,
+            "points": sum(chunk["points"] for chunk in point_chunks),
+            "vectors": _dump(info.config.params.vectors),
+            "payload_schema": {
+                field_name: _dump_index_schema(schema)
+                for field_name, schema in (info.payload_schema or {}).items()
+            },
+        },
+        "model": {"name": model_name, "revision": revision or model_revision(model_name)},
+        "pages": {str(point_id): filename for point_id, filename in sorted(pages.items())},
+        "point_chunks": point_chunks,
+        "page_archives": page_archives,
+    }
+    with open(os.path.join(output, MANIFEST_NAME), "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=2, ensure_ascii=False)
+
+    print(f"Пакет {output}: {manifest['collection']['points']} точек, {len(files)} файлов страниц")
+    return manifest
+
+
+def _dump(vectors) -> dict:
+    if isinstance(vectors, dict):
+        return {name: params.model_dump(mode="json", exclude_none=True) for name, params in vectors.items()}
+    return vectors.model_dump(mode="json", exclude_none=True)
+
+
+def _dump_index_schema(schema: models.PayloadIndexInfo):
+    """
+    Схема индекса payload с параметрами (например, is_tenant у индекса арендаторов)
+    """
+    if schema.params is not None:
+        return schema.params.model_dump(mode="json", exclude_none=True)
+    return schema.data_type.value if hasattr(schema.data_type, "value") else schema.data_type
+
+
+def _load_index_schema(field_name: str, schema):
+    """
+    Схема индекса payload для create_payload_index; в пакетах без параметров
+    индекс арендаторов восстанавливается с is_tenant
+    """
+    if isinstance(schema, dict):
+        return TypeAdapter(models.PayloadSchemaParams).validate_python(schema)
+    if field_name == TENANT_FIELD:
+        return models.KeywordIndexParams(type=models.KeywordIndexType.KEYWORD, is_tenant=True)
+    return schema
+
+
+def _load_vectors(vectors: dict):
+    if "size" in vectors:
+        return models.VectorParams.model_validate(vectors)
+    return {name: models.VectorParams.model_validate(params) for name, params in vectors.items()}
+
+
+def _verify(path: str, expected: dict):
+    actual = sha256_file(path)
+    if actual != expected["sha256"]:
+        raise ValueError(f"Контрольная сумма {expected['file']} не совпадает: {actual} != {expected['sha256']}")
+
+
+def _upload_chunk(
+    client: QdrantClient,
+    collection_name: str,
+    path: str,
+    chunk: dict,
+    upload_batch: int,
+    config: QdrantConfig
+) -> int:
+    _verify(path, chunk)
+    points = _read_points_chunk(path)
+    for start in range(0, len(points), upload_batch):
+        batch = points[start:start + upload_batch]
+        call_with_retries(
+            lambda: client.upsert(collection_name=collection_name, points=batch, wait=True),
+            config
+        )
+    return len(points)
+
+
+def _extract_archive(path: str, archive: dict, pages_directory: str) -> int:
+    _verify(path, archive)
+    with tarfile.open(path) as tar:
+        tar.extractall(pages_directory, filter="data")
+    return archive["files"]
+
+
+def import_bundle(
+    client: QdrantClient,
+    bundle: str,
+    pages_directory: str,
+    collection_name: Optional[str] = None,
+    model_name: Optional[str] = None,
+    workers: int = 4,
+    upload_batch: int = 16,
+    verify_sample: int = 20,
+    force: bool = False,
+    qdrant_config: Optional[QdrantConfig] = None
+) -> str:
+    """
+    Импорт пакета в Qdrant и хранилище страниц
+
+    Args:
+        client (QdrantClient): Клиент Qdrant
+        bundle (str): Директория пакета
+        pages_directory (str): Директория страниц (PageStore)
+        collection_name (str, optional): Алиас рабочей коллекции (по умолчанию из манифеста)
+        model_name (str, optional): Модель кодирования запросов в этом окружении
+        workers (int): Параллельно загружаемых частей
+        upload_batch (int): Точек в одном upsert
+        verify_sample (int): Сколько точек сверить с пакетом после загрузки
+        force (bool): Импортировать при несовпадении модели
+        qdrant_config (QdrantConfig, optional): Параметры повторов запросов
+
+    Returns:
+        str: Имя созданной коллекции
+    """
+    qdrant_config = qdrant_config or QdrantConfig()
+    with open(os.path.join(bundle, MANIFEST_NAME), encoding="utf-8") as f:
+        manifest = json.load(f)
+    if manifest["format_version"] > FORMAT_VERSION:
+        raise ValueError(f"Версия пакета {manifest['format_version']} новее поддерживаемой {FORMAT_VERSION}")
+    if model_name and manifest["model"]["name"] != model_name and not force:
+        raise ValueError(
+            f"Пакет построен моделью {manifest['model']['name']}, а запросы кодирует {model_name}; "
+            "запустите с --force, если это ожидаемо"
+        )
+
+    alias = collection_name or manifest["collection"]["name"]
+    check_alias_name(client, alias)
+    version = f"{alias}_v{time.strftime('%Y%m%d%H%M%S')}"
+    client.create_collection(
+        collection_name=version,
+        vectors_config=_load_vectors(manifest["collection"]["vectors"]),
+        on_disk_payload=True
+    )
+    for field_name, schema in manifest["collection"]["payload_schema"].items():
+        client.create_payload_index(
+            version, field_name=field_name, field_schema=_load_index_schema(field_name, schema)
+        )
+
+    try:
+        os.makedirs(pages_directory, exist_ok=True)
+        with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+            page_futures = [
+                pool.submit(_extract_archive, os.path.join(bundle, "pages", archive["file"]), archive, pages_directory)
+                for archive in manifest["page_archives"]
+            ]
+            point_futures = [
+                pool.submit(
+                    _upload_chunk, client, version,
+                    os.path.join(bundle, "points", chunk["file"]), chunk, upload_batch, qdrant_config
+                )
+                for chunk in manifest["point_chunks"]
+            ]
+            with tqdm(total=manifest["collection"]["points"], desc="Import points") as pbar:
+                for future in point_futures:
+                    pbar.update(future.result())
+            for future in page_futures:
+                future.result()
+
+        _check_import(client, version, bundle, manifest, pages_directory, verify_sample)
+    except Exception:
+        client.delete_collection(version)
+        raise
+
+    # Порядок страниц в наборе данных должен совпадать с идентификаторами точек
+    with open(os.path.join(pages_directory, PAGES_MANIFEST), "w", encoding="utf-8") as f:
+        json.dump({"pages": manifest["pages"]}, f, ensure_ascii=False)
+
+    switch_alias(client, alias, version)
+    print(f"Алиас {alias} переключен на {version}")
+    return version
+
+
+def _check_import(
+    client: QdrantClient,
+    collection_name: str,
+    bundle: str,
+    manifest: dict,
+    pages_directory: str,
+    verify_sample: int
+):
+    """
+    Сверка загруженного с пакетом: число точек, выборка точек, файлы страниц
+    """
+    expected = manifest["collection"]["points"]
+    count = client.count(collection_name, exact=True).count
+    if count != expected:
+        raise RuntimeError(f"В коллекции {collection_name} {count} точек, в пакете {expected}")
+
+    chunks = random.sample(manifest["point_chunks"], min(verify_sample, len(manifest["point_chunks"])))
+    for chunk in chunks:
+        reference = random.choice(_read_points_chunk(os.path.join(bundle, "points", chunk["file"])))
+        stored = client.retrieve(collection_name, ids=[reference.id], with_payload=True, with_vectors=True)
+        if not stored or stored[0].payload != reference.payload:
+            raise RuntimeError(f"Точка {reference.id} не совпадает с пакетом")
+        stored_vector = stored[0].vector if isinstance(stored[0].vector, dict) else {"": stored[0].vector}
+        reference_vector = reference.vector if isinstance(reference.vector, dict) else {"": reference.vector}
+        for name, vector in reference_vector.items():
+            if np.asarray(stored_vector.get(name)).shape != np.asarray(vector).shape:
+                raise RuntimeError(f"Вектор {name or 'default'} точки {reference.id} не совпадает с пакетом")
+
+    missing = [
+        filename for filename in manifest["pages"].values()
+        if filename and not os.path.exists(os.path.join(pages_directory, filename))
+    ]
+    if missing:
+        raise RuntimeError(f"Нет файлов страниц: {len(missing)} (например, {missing[0]})")
+
+
+def parse_args(argv=None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Экспорт и импорт пакета индекса")
+    parser.add_argument("--qdrant-host", default=None, help="Хост Qdrant (по умолчанию QDRANT_HOST)")
+    parser.add_argument("--pages-directory", default=IndexingConfig().data_directory)
+    parser.add_argument("--workers", type=int, default=4, help="Параллельно обрабатываемых частей")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    export = commands.add_parser("export", help="Сохранить коллекцию и страницы в пакет")
+    export.add_argument("--output", required=True, help="Директория пакета")
+    export.add_argument("--collection", default=QdrantConfig().collection_name, help="Коллекция или алиас")
+    export.add_argument("--model-name", default=ModelConfig().name)
+    export.add_argument("--model-revision", default=None, help="Ревизия модели (по умолчанию с хаба)")
+    export.add_argument("--chunk-points", type=int, default=256, help="Точек в одной части")
+    export.add_argument("--pages-per-archive", type=int, default=2000, help="Файлов страниц в одном архиве")
+
+    restore = commands.add_parser("import", help="Загрузить пакет в пустой Qdrant")
+    restore.add_argument("--bundle", required=True, help="Директория пакета")
+    restore.add_argument("--collection", default=None, help="Алиас рабочей коллекции (по умолчанию из пакета)")
+    restore.add_argument("--model-name", default=ModelConfig().name)
+    restore.add_argument("--upload-batch", type=int, default=16, help="Точек в одном upsert")
+    restore.add_argument("--verify-sample", type=int, default=20, help="Точек для выборочной сверки")
+    restore.add_argument("--force", action="store_true", help="Импортировать при несовпадении модели")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    qdrant_config = QdrantConfig()
+    if args.qdrant_host:
+        qdrant_config.host = args.qdrant_host
+    # Части пакета крупнее обычных запросов
+    qdrant_config.timeout = max(qdrant_config.timeout, 120)
+    client = create_qdrant_client(qdrant_config)
+
+    start = time.perf_counter()
+    if args.command == "export":
+        export_bundle(
+            client,
+            args.collection,
+            args.output,
+            args.pages_directory,
+            args.model_name,
+            revision=args.model_revision,
+            chunk_points=args.chunk_points,
+            pages_per_archive=args.pages_per_archive,
+            workers=args.workers,
+            qdrant_config=qdrant_config
+        )
+    else:
+        import_bundle(
+            client,
+            args.bundle,
+            args.pages_directory,
+            collection_name=args.collection,
+            model_name=args.model_name,
+            workers=args.workers,
+            upload_batch=args.upload_batch,
+            verify_sample=args.verify_sample,
+            force=args.force,
+            qdrant_config=qdrant_config
+        )
+    print(f"Готово за {time.perf_counter() - start:.1f} с")
+
+
+if __name__ == "__main__":
+    main()
@@ -2,56 +2,212 @@
 Модуль для индексации и поиска документов с использованием Qdrant и ColQwen2.
 """
 
+import asyncio
+import hashlib
+import json
+import os
+import threading
+import time
+from concurrent.futures import ALL_COMPLETED, FIRST_COMPLETED, ThreadPoolExecutor, wait
+from functools import partial
 import yaml
+import numpy as np
 import torch
-from typing import List, Dict, Optional
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Tuple
 
-from qdrant_client import QdrantClient
+from qdrant_client import AsyncQdrantClient, QdrantClient
 from qdrant_client.http import models
 from tqdm import tqdm
 
 from colpali_engine.models import ColQwen2, ColQwen2Processor
+from configs.service_config import (
+    HighlightConfig,
+    IndexingConfig,
+    LatencySLOConfig,
+    QdrantConfig,
+    QueryPruningConfig,
+)
+from src.batching import DEFAULT_MAX_IMAGE_TOKENS, AdaptiveBatcher, expected_image_tokens
 from src.data_preparation.data_preparer import DocumentDataPreparer  # Импорт вашего data preparer
+from src.dedup import DuplicateGroup, PageDeduplicator
+from src.highlights import PatchHighlighter, image_token_offset
+from src.latency_slo import LatencySLOController
+from src.metrics import (
+    INDEXED_PAGES,
+    INDEXING_THROUGHPUT,
+    QDRANT_QUERY_SECONDS,
+    QUERY_ENCODE_SECONDS,
+    register_device_memory,
+)
+from src.parallel_encoding import ParallelPageEncoder, colqwen2_cpu_encoder
+from src.profiling import span
+from src.qdrant_connection import (
+    alias_target,
+    async_call_with_retries,
+    call_with_retries,
+    check_alias_name,
+    create_async_qdrant_client,
+    create_qdrant_client,
+    switch_alias,
+)
+from src.query_pruning import QueryTokenPruner
+from src.tenants import GLOBAL_TENANT, TENANT_FIELD, search_scope, tenant_filter, tenant_of_filename
+from src.utils import PATCH_SIZE, token_grid
 from PIL import Image
 
+# Размерность векторов токенов ColQwen2 (для коллекции без модели в процессе)
+EMBEDDING_DIM = 128
+
 
 class DocumentIndexer:
     def __init__(
         self,
         dataset: List[Image.Image] = None,
         model_name: str = "vidore/colqwen2-v0.1", 
-        qdrant_host: str = "localhost", 
+        qdrant_host: Optional[str] = None, 
         collection_name: str = "nornikel_prod",
+        model=None,
+        processor=None,
+        qdrant_client: Optional[QdrantClient] = None,
+        quantization: str = "int8",
+        pooling: Optional[str] = None,
+        qdrant_config: Optional[QdrantConfig] = None,
+        query_encoder=None,
+        max_image_tokens: Optional[int] = None,
+        query_pruning: Optional[QueryPruningConfig] = None,
+        duplicate_max_distance: Optional[int] = None,
+        tenant_payload_m: int = 16,
+        latency_slo: Optional[LatencySLOConfig] = None,
+        encoder_workers: int = 0,
+        threads_per_worker: Optional[int] = None,
+        encoder_factory: Optional[Callable[[], tuple]] = None,
+        highlights: Optional[HighlightConfig] = None,
     ):
         """
         Инициализация индексатора документов
+
+        Args:
+            dataset (List[Image.Image], optional): Изображения страниц
+            model_name (str): Идентификатор модели ColQwen2
+            qdrant_host (str, optional): Хост сервера Qdrant (по умолчанию из qdrant_config)
+            collection_name (str): Название коллекции
+            model (optional): Готовая модель вместо загрузки ColQwen2 (например, заглушка для бенчмарков)
+            processor (optional): Готовый процессор вместо ColQwen2Processor
+            qdrant_client (QdrantClient, optional): Готовый клиент Qdrant (например, локальный режим)
+            quantization (str): Квантизация векторов коллекции: "int8", "binary" или "none"
+            pooling (str, optional): "mean" - дополнительный усредненный вектор страницы
+                для быстрого предварительного отбора кандидатов (prefetch)
+            qdrant_config (QdrantConfig, optional): Подключение к Qdrant, пул и повторы
+                (по умолчанию из переменных окружения QDRANT_*)
+            query_encoder (optional): Внешний кодировщик запросов с методом encode_query
+                (клиент модельного сервера); модель в процессе при этом не загружается
+                и доступен только поиск
+            max_image_tokens (int, optional): Бюджет визуальных токенов на страницу: страницы
+                крупнее уменьшаются до сетки патчей в его пределах (None - предел процессора)
+            query_pruning (QueryPruningConfig, optional): Прореживание токенов запроса перед
+                MaxSim (для внешнего кодировщика выполняется на его стороне)
+            duplicate_max_distance (int, optional): Порог перцептивного хэша для копий страниц:
+                копии не кодируются и записываются в payload представителя (None - без поиска копий)
+            tenant_payload_m (int): Связность графов HNSW внутри раздела арендатора
+            latency_slo (LatencySLOConfig, optional): Регулятор hnsw_ef, oversampling и
+                предвыборки по целевому p95 для запросов без явных параметров поиска
+            encoder_workers (int): Число процессов CPU для кодирования страниц в index_documents
+                (0 - модель в этом процессе); модель в этом процессе при этом не загружается,
+                если не передана явно
+            threads_per_worker (int, optional): Потоков torch и ядер на воркер
+                (по умолчанию доступные ядра делятся поровну)
+            encoder_factory (Callable, optional): Загрузчик (модель, процессор) в воркерах
+                encoder_workers (по умолчанию ColQwen2 model_name на CPU)
+            highlights (HighlightConfig, optional): Подсветка совпадений на найденных страницах
+                по сохраненным мультивекторам (по умолчанию с настройками HighlightConfig)
         """
         # Инициализация модели и процессора
-        self.model = ColQwen2.from_pretrained(
-            model_name,
-            torch_dtype=torch.bfloat16,
-            device_map="cuda:0"
-        )
-        self.processor = ColQwen2Processor.from_pretrained(model_name)
+        self.query_encoder = query_encoder
+        self.model_name = model_name
+        self.encoder_workers = encoder_workers
+        self.threads_per_worker = threads_per_worker
+        self.encoder_factory = encoder_factory or partial(colqwen2_cpu_encoder, model_name)
+        if query_encoder is not None or (encoder_workers and model is None):
+            self.model = None
+            self.processor = processor
+        else:
+            self.model = model if model is not None else ColQwen2.from_pretrained(
+                model_name,
+                torch_dtype=torch.bfloat16,
+                device_map="cuda:0"
+            )
+            self.processor = processor if processor is not None else ColQwen2Processor.from_pretrained(model_name)
+            register_device_memory(str(self.model.device))
+
+            # Предел процессора не должен обрезать бюджет больше стандартного
+            image_processor = getattr(self.processor, "image_processor", None)
+            if max_image_tokens and getattr(image_processor, "max_pixels", None):
+                image_processor.max_pixels = max(image_processor.max_pixels, max_image_tokens * PATCH_SIZE ** 2)
+        self.max_image_tokens = max_image_tokens
+        self.query_pruner = QueryTokenPruner(query_pruning) \
+            if query_pruning is not None and query_pruning.enabled else None
         
         # Инициализация Qdrant клиента
-        self.qdrant_client = QdrantClient(host=qdrant_host)
+        self.qdrant_config = qdrant_config or QdrantConfig()
+        if qdrant_host:
+            self.qdrant_config.host = qdrant_host
+        self.qdrant_client = qdrant_client if qdrant_client is not None \
+            else create_qdrant_client(self.qdrant_config)
+        # Асинхронный клиент создается в event loop при первом запросе
+        self._async_qdrant_client: Optional[AsyncQdrantClient] = None
         self.collection_name = collection_name
         
         # Параметры векторизации
         self.vector_size = None
+        self.quantization = quantization
+        self.pooling = pooling
+        self.latency_slo = LatencySLOController(latency_slo, quantization, pooling) \
+            if latency_slo is not None and latency_slo.enabled else None
         
         # Инициализация DocumentDataPreparer
         self.dataset = dataset
+        # Идентификаторы точек - индексы в dataset, выдаются под блокировкой
+        self._dataset_lock = threading.Lock()
+
+        # Хэши страниц коллекции для поиска копий (строится при индексации или из payload)
+        self.duplicate_max_distance = duplicate_max_distance
+        self._deduplicator: Optional[PageDeduplicator] = None
+        self.tenant_payload_m = tenant_payload_m
+
+        highlights = highlights or HighlightConfig()
+        self.highlighter = PatchHighlighter(
+            highlights,
+            image_token_offset(self.processor, highlights.image_token_offset)
+            if self.processor is not None else highlights.image_token_offset
+        )
 
     def create_collection(
         self, 
         vector_size: Optional[int] = None, 
-        distance: models.Distance = models.Distance.COSINE
+        distance: models.Distance = models.Distance.COSINE,
+        collection_name: Optional[str] = None
     ):
         """
         Создание коллекции в Qdrant
+
+        Существующая коллекция с тем же именем пересоздается. Для коллекции,
+        на которую смотрит поиск через алиас, используйте reindex.
+
+        Args:
+            vector_size (int, optional): Размер вектора (по умолчанию по первой странице)
+            distance (models.Distance): Метрика расстояния
+            collection_name (str, optional): Имя коллекции (по умолчанию self.collection_name)
         """
+        collection_name = collection_name or self.collection_name
+        if alias_target(self.qdrant_client, collection_name) is not None:
+            raise ValueError(
+                f"{collection_name} - алиас рабочей коллекции, пересоздание остановит поиск. "
+                "Используйте reindex()"
+            )
+
+        if vector_size is None and self.model is None:
+            # Страницы кодируют воркеры: размерность известна заранее
+            vector_size = EMBEDDING_DIM
         if vector_size is None:
             # Получаем размер вектора из первого изображения
             sample_image = self.dataset[0]
@@ -68,101 +224,1062 @@ class DocumentIndexer:
             multivector_config=models.MultiVectorConfig(
                 comparator=models.MultiVectorComparator.MAX_SIM
             ),
-            quantization_config=models.ScalarQuantization(
+            quantization_config=self._quantization_config(),
+        )
+
+        if self.pooling:
+            # Полные мультивекторы для переранжирования и усредненный вектор для prefetch
+            vector_params = {
+                "original": vector_params,
+                f"{self.pooling}_pooling": models.VectorParams(
+                    size=vector_size,
+                    distance=distance,
+                    quantization_config=self._quantization_config(),
+                ),
+            }
+        
+        self.qdrant_client.recreate_collection(
+            collection_name=collection_name,
+            vectors_config=vector_params,
+            # Отдельный граф HNSW для каждого значения tenant
+            hnsw_config=models.HnswConfigDiff(payload_m=self.tenant_payload_m),
+            on_disk_payload=True
+        )
+        self._create_tenant_index(collection_name)
+
+    def _create_tenant_index(self, collection_name: str):
+        self.qdrant_client.create_payload_index(
+            collection_name=collection_name,
+            field_name=TENANT_FIELD,
+            field_schema=models.KeywordIndexParams(type=models.KeywordIndexType.KEYWORD, is_tenant=True),
+        )
+
+    def ensure_tenant_index(self):
+        """
+        Индекс арендаторов для коллекции, построенной до их появления:
+        точкам без поля tenant назначается общий раздел
+        """
+        info = self.qdrant_client.get_collection(self.collection_name)
+        if TENANT_FIELD in (info.payload_schema or {}):
+            return
+        call_with_retries(
+            lambda: self.qdrant_client.set_payload(
+                collection_name=self.collection_name,
+                payload={TENANT_FIELD: GLOBAL_TENANT},
+                points=models.Filter(
+                    must=[models.IsEmptyCondition(is_empty=models.PayloadField(key=TENANT_FIELD))]
+                ),
+            ),
+            self.qdrant_config
+        )
+        self._create_tenant_index(self.collection_name)
+        print(f"Коллекция {self.collection_name}: создан индекс арендаторов")
+
+    def list_versions(self) -> List[str]:
+        """
+        Версии коллекции (alias_v<timestamp>) от старых к новым
+        """
+        prefix = f"{self.collection_name}_v"
+        names = [c.name for c in self.qdrant_client.get_collections().collections]
+        return sorted(name for name in names if name.startswith(prefix))
+
+    def _validate_version(self, collection_name: str, smoke_query: Optional[str], expected: int):
+        """
+        Проверка новой версии перед переключением: число точек и пробный запрос
+        """
+        count = self.qdrant_client.count(collection_name, exact=True).count
+        if count != expected:
+            raise RuntimeError(
+                f"В коллекции {collection_name} {count} точек, ожидалось {expected}"
+            )
+
+        if smoke_query:
+            request = self._query_request(self.encode_query(smoke_query), 1, None, None)
+            request["collection_name"] = collection_name
+            if not self.qdrant_client.query_points(**request).points:
+                raise RuntimeError(f"Пробный запрос к {collection_name} не вернул результатов")
+
+    def reindex(
+        self,
+        batch_size: int = 16,
+        metadata: Dict[str, str] = {"source": "document_archive"},
+        smoke_query: Optional[str] = None,
+        keep_versions: int = 2,
+        checkpoint_path: Optional[str] = None,
+        max_in_flight: int = 4
+    ) -> str:
+        """
+        Переиндексация без простоя
+
+        Индекс строится в новой версионированной коллекции, пока поиск
+        продолжает читать текущую через алиас self.collection_name. После
+        проверки числа точек и пробного запроса алиас атомарно переключается
+        на новую версию; предыдущие версии (до keep_versions) остаются для отката.
+
+        Args:
+            batch_size (int): Размер батча индексации
+            metadata (dict): Общие метаданные индексации
+            smoke_query (str, optional): Пробный запрос для проверки новой версии
+            keep_versions (int): Сколько последних версий хранить, включая новую
+            checkpoint_path (str, optional): Файл контрольной точки; недостроенная версия
+                при сбое сохраняется, и повторный вызов продолжает ее построение
+            max_in_flight (int): Максимальное число неподтвержденных upsert
+
+        Returns:
+            str: Имя новой версии коллекции
+
+        Raises:
+            RuntimeError: Индекс лежит в обычной коллекции с именем алиаса; ее
+                замена алиасом не атомарна и выполняется вручную
+        """
+        # Проверка до построения: иначе версия строилась бы зря
+        check_alias_name(self.qdrant_client, self.collection_name)
+
+        version = None
+        checkpoint = self._load_checkpoint(checkpoint_path)
+        if checkpoint is not None and checkpoint.get("collection") in self.list_versions():
+            version = checkpoint["collection"]
+            print(f"Продолжение построения версии {version}")
+        else:
+            version = f"{self.collection_name}_v{time.strftime('%Y%m%d%H%M%S')}"
+            print(f"Построение версии {version}")
+            self.create_collection(collection_name=version)
+
+        try:
+            stats = self.index_documents(
+                batch_size=batch_size,
+                metadata=metadata,
+                collection_name=version,
+                checkpoint_path=checkpoint_path,
+                max_in_flight=max_in_flight
+            )
+        except Exception:
+            # Без контрольной точки недостроенная версия не нужна
+            if not checkpoint_path:
+                self.qdrant_client.delete_collection(version)
+            raise
+
+        try:
+            self._validate_version(version, smoke_query, stats["points"])
+        except Exception:
+            # Версия, не прошедшая проверку, не должна оставаться в хранилище
+            self.qdrant_client.delete_collection(version)
+            raise
+
+        switch_alias(self.qdrant_client, self.collection_name, version)
+        print(f"Алиас {self.collection_name} переключен на {version}")
+
+        for old_version in self.list_versions()[:-keep_versions]:
+            if old_version != version:
+                self.qdrant_client.delete_collection(old_version)
+                print(f"Удалена старая версия {old_version}")
+
+        return version
+
+    def rollback(self) -> str:
+        """
+        Переключение алиаса на предыдущую версию коллекции
+
+        Returns:
+            str: Имя версии, на которую переключен алиас
+        """
+        current = alias_target(self.qdrant_client, self.collection_name)
+        versions = self.list_versions()
+        if current not in versions or versions.index(current) == 0:
+            raise RuntimeError("Нет предыдущей версии для отката")
+
+        previous = versions[versions.index(current) - 1]
+        switch_alias(self.qdrant_client, self.collection_name, previous)
+        print(f"Алиас {self.collection_name} возвращен на {previous}")
+        return previous
+
+    def _quantization_config(self):
+        """
+        Конфигурация квантизации по self.quantization
+        """
+        if self.quantization == "int8":
+            return models.ScalarQuantization(
                 scalar=models.ScalarQuantizationConfig(
                     type=models.ScalarType.INT8,
                     quantile=0.99,
                     always_ram=True,
                 ),
-            ),
+            )
+        if self.quantization == "binary":
+            return models.BinaryQuantization(
+                binary=models.BinaryQuantizationConfig(always_ram=True),
+            )
+        if self.quantization == "none":
+            return None
+        raise ValueError(f"Неизвестный тип квантизации: {self.quantization}")
+
+    def _pool(self, multivector: torch.Tensor) -> List[float]:
+        """
+        Свертка мультивектора в один вектор для prefetch (нулевой паддинг не учитывается)
+        """
+        mask = multivector.abs().sum(dim=-1) > 0
+        pooled = multivector[mask].mean(dim=0) if mask.any() else multivector.mean(dim=0)
+        return pooled.tolist()
+
+    def _patch_grid(self, width: int, height: int) -> Tuple[int, int]:
+        """
+        Сетка патчей, которую страница заняла в мультивекторе
+        """
+        return token_grid(width, height, self.max_image_tokens or DEFAULT_MAX_IMAGE_TOKENS)
+
+    def _make_point(
+        self,
+        point_id: int,
+        embedding: torch.Tensor,
+        image: Image.Image,
+        metadata: Dict[str, str],
+        group: Optional[DuplicateGroup] = None
+    ) -> models.PointStruct:
+        """
+        Формирование точки Qdrant для страницы
+
+        Args:
+            point_id (int): Идентификатор точки (индекс страницы в наборе данных)
+            embedding (torch.Tensor): Мультивектор страницы
+            image (Image.Image): Изображение страницы с метаданными
+            metadata (dict): Общие метаданные индексации
+            group (DuplicateGroup, optional): Группа копий, представителем которой является страница
+
+        Раздел страницы берется из metadata["tenant"], иначе из имени ее файла.
+
+        Returns:
+            models.PointStruct: Точка для upsert
+        """
+        embedding = embedding.cpu().float()
+        multivector = embedding.numpy().tolist()
+        vector = multivector
+        if self.pooling:
+            vector = {
+                "original": multivector,
+                f"{self.pooling}_pooling": self._pool(embedding),
+            }
+
+        return models.PointStruct(
+            id=point_id,
+            vector=vector,
+            payload={
+                **metadata,
+                TENANT_FIELD: metadata.get(TENANT_FIELD) or tenant_of_filename(image.filename),
+                "filename": image.filename,
+                "page_number": getattr(image, 'page_number', None),
+                "text": getattr(image, 'text', None),  # Добавляем текст из изображения
+                # Сколько визуальных токенов страница заняла в индексе и при каком DPI отрисована
+                "visual_tokens": expected_image_tokens(
+                    image.width, image.height, self.max_image_tokens or DEFAULT_MAX_IMAGE_TOKENS
+                ),
+                # Сетка патчей (по ширине, по высоте) для подсветки совпадений
+                "patch_grid": list(self._patch_grid(image.width, image.height)),
+                "render_dpi": getattr(image, 'render_dpi', None),
+                **(group.payload() if group is not None else {}),
+            }
         )
-        
-        self.qdrant_client.recreate_collection(
-            collection_name=self.collection_name,
-            vectors_config=vector_params,
-            on_disk_payload=True
+
+    def _dataset_fingerprint(self) -> str:
+        """
+        Отпечаток порядка страниц: идентификаторы точек - позиции в dataset,
+        поэтому продолжать можно только при том же порядке
+        """
+        hasher = hashlib.sha1()
+        for image in self.dataset:
+            hasher.update(f"{getattr(image, 'filename', '')}\n".encode("utf-8"))
+        return hasher.hexdigest()
+
+    @staticmethod
+    def _load_checkpoint(checkpoint_path: Optional[str]) -> Optional[dict]:
+        if not checkpoint_path or not os.path.exists(checkpoint_path):
+            return None
+        try:
+            with open(checkpoint_path, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError) as e:
+            print(f"Контрольная точка {checkpoint_path} не прочитана ({e}), индексация с начала")
+            return None
+
+    @staticmethod
+    def _save_checkpoint(checkpoint_path: str, state: dict):
+        directory = os.path.dirname(checkpoint_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        tmp_path = f"{checkpoint_path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(state, f)
+        os.replace(tmp_path, checkpoint_path)
+
+    @staticmethod
+    def _to_ranges(ids: Iterable[int]) -> List[List[int]]:
+        """
+        Сжатие множества идентификаторов в отрезки [начало, конец)
+        """
+        ranges: List[List[int]] = []
+        for point_id in sorted(ids):
+            if ranges and ranges[-1][1] == point_id:
+                ranges[-1][1] = point_id + 1
+            else:
+                ranges.append([point_id, point_id + 1])
+        return ranges
+
+    @staticmethod
+    def _from_ranges(ranges: List[List[int]]) -> set:
+        return {point_id for start, end in ranges for point_id in range(start, end)}
+
+    def _resumable_state(self, checkpoint_path: Optional[str], collection_name: str) -> Optional[dict]:
+        """
+        Контрольная точка, с которой можно продолжить индексацию в collection_name
+        """
+        state = self._load_checkpoint(checkpoint_path)
+        if state is None:
+            return None
+        if (
+            state.get("collection") != collection_name
+            or state.get("fingerprint") != self._dataset_fingerprint()
+            or not self.qdrant_client.collection_exists(collection_name)
+        ):
+            print(f"Контрольная точка {checkpoint_path} относится к другой индексации, индексация с начала")
+            return None
+        return state
+
+    def _count_points(self, collection_name: str, point_ids: Optional[List[int]] = None) -> int:
+        """
+        Точное число точек коллекции (point_ids - только из этих идентификаторов)
+        """
+        count_filter = None
+        if point_ids is not None:
+            if not point_ids:
+                return 0
+            count_filter = models.Filter(must=[models.HasIdCondition(has_id=point_ids)])
+        return call_with_retries(
+            lambda: self.qdrant_client.count(collection_name, count_filter=count_filter, exact=True).count,
+            self.qdrant_config
+        )
+
+    def _wait_for_points(self, collection_name: str, expected: int, timeout: float = 600.0):
+        """
+        Барьер согласованности: upsert с wait=False подтверждает только запись
+        в WAL, поэтому ждем, пока все точки будут применены к коллекции
+
+        Args:
+            collection_name (str): Коллекция
+            expected (int): Итоговое число точек коллекции: точки, которые были в ней
+                до загрузки, плюс новые (точки коллекции сами по себе барьер не проходят)
+            timeout (float): Предельное время ожидания, в секундах
+        """
+        deadline = time.monotonic() + timeout
+        delay = 0.1
+        while True:
+            count = self._count_points(collection_name)
+            if count >= expected:
+                return
+            if time.monotonic() > deadline:
+                raise TimeoutError(f"В коллекции {collection_name} {count} точек из {expected}")
+            time.sleep(delay)
+            delay = min(delay * 2, 2.0)
+
+    def _batcher(self, batch_size: int, token_budget: Optional[int]) -> AdaptiveBatcher:
+        return AdaptiveBatcher(
+            self.model,
+            self.processor,
+            max_batch_size=batch_size,
+            token_budget=token_budget,
+            max_image_tokens=self.max_image_tokens
         )
 
+    def _encode_batches(
+        self,
+        batcher: AdaptiveBatcher,
+        pending: List[tuple],
+        stats: dict
+    ) -> Iterator[Tuple[list, List[torch.Tensor]]]:
+        """
+        Батчи страниц с мультивекторами: в этом процессе или в encoder_workers
+        процессах CPU (тогда батчи приходят в порядке готовности, а время
+        запуска воркеров записывается в stats["encoder_startup_seconds"])
+        """
+        if not self.encoder_workers:
+            for batch in batcher.batches(pending):
+                yield batch, batcher.encode([image for _, image in batch])
+            return
+
+        with ParallelPageEncoder(
+            self.encoder_factory,
+            self.encoder_workers,
+            threads_per_worker=self.threads_per_worker,
+            max_image_tokens=self.max_image_tokens
+        ) as encoder:
+            stats["encoder_startup_seconds"] = encoder.startup_seconds
+            for batch, embeddings in encoder.map(batcher.batches(pending)):
+                batcher.batch_sizes[len(batch)] += 1
+                yield batch, embeddings
+
     def index_documents(
         self, 
         batch_size: int = 16, 
-        metadata: Dict[str, str] = {"source": "document_archive"}
-    ):
+        metadata: Dict[str, str] = {"source": "document_archive"},
+        collection_name: Optional[str] = None,
+        checkpoint_path: Optional[str] = None,
+        max_in_flight: int = 4,
+        token_budget: Optional[int] = None
+    ) -> dict:
         """
         Индексация документов
+
+        Страницы группируются по ожидаемому числу визуальных токенов, размер
+        батча подбирается под бюджет токенов (по умолчанию из свободной памяти
+        GPU) и уменьшается при нехватке памяти. При encoder_workers > 0 батчи
+        кодируются параллельно процессами CPU, запись в Qdrant остается здесь.
+
+        Кодирование следующего батча не ждет Qdrant: upsert отправляется
+        с wait=False из пула потоков, одновременно не более max_in_flight
+        батчей. Подтвержденные страницы записываются в контрольную точку,
+        и повторный запуск после сбоя продолжает с неподтвержденных.
+        Батчи, не загруженные после повторов, отправляются еще раз в конце;
+        в завершение ожидается применение всех точек.
+
+        При заданном duplicate_max_distance копии страниц не кодируются:
+        точку получает первая страница группы, остальные перечисляются
+        в ее payload.
+
+        Args:
+            batch_size (int): Максимальный размер батча
+            metadata (dict): Общие метаданные индексации
+            collection_name (str, optional): Целевая коллекция (по умолчанию self.collection_name)
+            checkpoint_path (str, optional): Файл контрольной точки (None - без возобновления)
+            max_in_flight (int): Максимальное число неподтвержденных upsert
+            token_budget (int, optional): Бюджет визуальных токенов на батч с учетом паддинга
+
+        Returns:
+            dict: Фактические размеры батчей, число отступлений при OOM,
+                число точек и пропущенных копий, время запуска воркеров кодирования
         """
         # Получение подготовленных изображений
+        collection_name = collection_name or self.collection_name
+
+        state = self._resumable_state(checkpoint_path, collection_name)
+        if state is not None:
+            print(f"Продолжение индексации: подтверждено страниц {len(self._from_ranges(state['committed']))}")
+        else:
+            # Создание коллекции, если она еще не создана
+            if self.vector_size is None:
+                self.create_collection(collection_name=collection_name)
+            state = {
+                "collection": collection_name,
+                "fingerprint": self._dataset_fingerprint(),
+                "committed": [],
+            }
+        committed = self._from_ranges(state["committed"])
+
+        def upsert(points: List[models.PointStruct]):
+            call_with_retries(
+                lambda: self.qdrant_client.upsert(collection_name=collection_name, points=points, wait=False),
+                self.qdrant_config
+            )
+
+        in_flight = {}
+        failed = []
+
+        def save_checkpoint():
+            if checkpoint_path:
+                state["committed"] = self._to_ranges(committed)
+                self._save_checkpoint(checkpoint_path, state)
+
+        def collect(return_when):
+            done, _ = wait(in_flight, return_when=return_when)
+            for future in done:
+                points = in_flight.pop(future)
+                if future.exception() is not None:
+                    print(f"Батч со страницы {points[0].id} не загружен: {future.exception()}")
+                    failed.append(points)
+                    continue
+                committed.update(point.id for point in points)
+            if done:
+                save_checkpoint()
+
+        # Копии страниц не кодируются: точки получают только представители групп
+        groups: Dict[int, DuplicateGroup] = {}
+        point_ids = list(range(len(self.dataset)))
+        if self.duplicate_max_distance is not None:
+            deduplicator = PageDeduplicator(self.duplicate_max_distance)
+            for i, image in enumerate(tqdm(self.dataset, desc="Hashing pages")):
+                group, is_new = deduplicator.match(image, tenant_of_filename(image.filename))
+                if is_new:
+                    group.point_id = i
+                    groups[i] = group
+            point_ids = sorted(groups)
+            self._deduplicator = deduplicator
+            print(f"Копий страниц пропущено: {len(self.dataset) - len(point_ids)}")
+
+        batcher = self._batcher(batch_size, token_budget)
+        pending = [(i, self.dataset[i]) for i in point_ids if i not in committed]
+        encoder_stats = {}
+        # Барьер ждет новых точек сверх уже лежащих в коллекции: повторный upsert
+        # существующей точки (неподтвержденной до сбоя) счетчик не увеличивает
+        pending_ids = [i for i, _ in pending]
+        expected_points = self._count_points(collection_name) + len(pending_ids) \
+            - self._count_points(collection_name, pending_ids)
 
-        # Создание коллекции, если она еще не создана
-        if self.vector_size is None:
-            self.create_collection()
-        
         # Индексация с прогресс-баром
-        with tqdm(total=len(self.dataset), desc="Indexing Documents") as pbar:
-            for i in range(0, 3, batch_size):
-                batch = self.dataset[i : i + batch_size]
-                
-                # Генерация эмбеддингов
-                with torch.no_grad():
-                    batch_images = self.processor.process_images(batch).to(self.model.device)
-                    image_embeddings = self.model(**batch_images)
-                
-                # Подготовка точек для Qdrant
-                points = []
-                for j, embedding in enumerate(image_embeddings):
-                    multivector = embedding.cpu().float().numpy().tolist()
-                    points.append(
-                        models.PointStruct(
-                            id=i + j,
-                            vector=multivector,
-                            payload={
-                                **metadata,
-                                "filename": batch[j].filename,
-                                "page_number": getattr(batch[j], 'page_number', None),
-                                "text": getattr(batch[j], 'text', None)  # Добавляем текст из изображения
-                            }
-                        )
+        start_time = time.perf_counter()
+        indexed = 0
+        with ThreadPoolExecutor(max_workers=max(1, max_in_flight)) as uploader, \
+                tqdm(total=len(point_ids), initial=len(committed), desc="Indexing Documents") as pbar:
+            try:
+                for batch, image_embeddings in self._encode_batches(batcher, pending, encoder_stats):
+                    ids = [point_id for point_id, _ in batch]
+
+                    # Подготовка точек для Qdrant
+                    points = [
+                        self._make_point(point_id, embedding, image, metadata, groups.get(point_id))
+                        for (point_id, image), embedding in zip(batch, image_embeddings)
+                    ]
+
+                    # Загрузка точек в Qdrant без ожидания, в пределах окна
+                    if len(in_flight) >= max_in_flight:
+                        collect(FIRST_COMPLETED)
+                    in_flight[uploader.submit(upsert, points)] = points
+
+                    pbar.update(len(ids))
+                    indexed += len(ids)
+                    INDEXED_PAGES.inc(len(ids))
+                    INDEXING_THROUGHPUT.set(indexed / (time.perf_counter() - start_time))
+            finally:
+                # Подтвержденные до сбоя батчи должны попасть в контрольную точку
+                if in_flight:
+                    collect(ALL_COMPLETED)
+
+        # Повтор только незагруженных батчей
+        for points in failed:
+            upsert(points)
+            committed.update(point.id for point in points)
+            save_checkpoint()
+
+        self._wait_for_points(collection_name, expected_points)
+        if checkpoint_path and os.path.exists(checkpoint_path):
+            os.remove(checkpoint_path)
+
+        stats = batcher.stats()
+        stats.update(encoder_stats)
+        stats["points"] = len(point_ids)
+        stats["duplicates"] = len(self.dataset) - len(point_ids)
+        print(f"Indexing complete! Размеры батчей: {stats['batch_sizes']}, OOM: {stats['oom_retries']}")
+        return stats
+
+    def _append_pages(self, pages: List[Image.Image]) -> int:
+        """
+        Добавление страниц в конец набора данных
+
+        Returns:
+            int: Идентификатор первой добавленной страницы
+        """
+        with self._dataset_lock:
+            start_id = len(self.dataset)
+            self.dataset.extend(pages)
+        return start_id
+
+    def _collection_deduplicator(self) -> Optional[PageDeduplicator]:
+        """
+        Хэши страниц рабочей коллекции; если индексация в этом процессе
+        не выполнялась, они восстанавливаются из payload без чтения векторов
+        """
+        if self.duplicate_max_distance is None:
+            return None
+        with self._dataset_lock:
+            if self._deduplicator is None:
+                deduplicator = PageDeduplicator(self.duplicate_max_distance)
+                offset = None
+                while True:
+                    points, offset = call_with_retries(
+                        lambda: self.qdrant_client.scroll(
+                            collection_name=self.collection_name,
+                            with_payload=["phash", "aspect", "filename", "duplicates", TENANT_FIELD],
+                            with_vectors=False,
+                            limit=1000,
+                            offset=offset
+                        ),
+                        self.qdrant_config
                     )
-                
-                # Загрузка точек в Qdrant
-                self.qdrant_client.upsert(
+                    for point in points:
+                        payload = point.payload or {}
+                        deduplicator.restore(point.id, payload, payload.get(TENANT_FIELD, GLOBAL_TENANT))
+                    if offset is None:
+                        break
+                self._deduplicator = deduplicator
+        return self._deduplicator
+
+    def _update_duplicates(self, group: DuplicateGroup):
+        """
+        Запись нового списка копий в payload уже загруженного представителя
+        """
+        call_with_retries(
+            lambda: self.qdrant_client.set_payload(
+                collection_name=self.collection_name,
+                payload={"duplicates": group.duplicates},
+                points=[group.point_id]
+            ),
+            self.qdrant_config
+        )
+
+    def index_pages(
+        self,
+        pages: Iterable[Image.Image],
+        batch_size: int = 16,
+        metadata: Dict[str, str] = {"source": "document_archive"},
+        should_stop: Optional[Callable[[], bool]] = None,
+        on_batch: Optional[Callable[[int], None]] = None,
+        dataset_page: Optional[Callable[[Image.Image], Image.Image]] = None,
+        token_budget: Optional[int] = None,
+        on_points: Optional[Callable[[Dict[int, str]], None]] = None
+    ) -> dict:
+        """
+        Дозагрузка новых страниц в рабочую коллекцию
+
+        Страницы читаются из итератора по мере кодирования, поэтому
+        растеризация, кодирование и upsert идут конвейером. Страница
+        добавляется в dataset до upsert, чтобы найденная точка всегда
+        имела изображение; поиск при этом продолжает работать. Батч
+        набирается в порядке страниц до бюджета токенов и делится при OOM.
+        Копии уже проиндексированных страниц не кодируются, а дописываются
+        в payload представителя.
+
+        Args:
+            pages (Iterable[Image.Image]): Изображения новых страниц с метаданными
+            batch_size (int): Максимальный размер батча
+            metadata (dict): Общие метаданные индексации
+            should_stop (Callable, optional): Проверка отмены между батчами
+            on_batch (Callable, optional): Вызывается с числом страниц после каждого батча
+            dataset_page (Callable, optional): Что хранить в dataset вместо закодированного
+                изображения (например, лениво открытую сохраненную копию страницы)
+            token_budget (int, optional): Бюджет визуальных токенов на батч с учетом паддинга
+            on_points (Callable, optional): Вызывается до upsert батча с идентификаторами
+                точек и файлами их страниц (например, для записи в манифест порядка)
+
+        Returns:
+            dict: Фактические размеры батчей, число отступлений при OOM и пропущенных копий
+        """
+        if self.model is None:
+            raise RuntimeError("Модель ColQwen2 не загружена в этом процессе, индексация недоступна")
+
+        deduplicator = self._collection_deduplicator()
+        tenant = metadata.get(TENANT_FIELD, GLOBAL_TENANT)
+        duplicates = 0
+
+        def representatives() -> Iterable[Image.Image]:
+            nonlocal duplicates
+            for page in pages:
+                if deduplicator is None:
+                    yield page
+                    continue
+                group, is_new = deduplicator.match(page, tenant)
+                if is_new:
+                    page.duplicate_group = group
+                    yield page
+                    continue
+                # Представитель из текущего батча получит копию вместе с точкой
+                duplicates += 1
+                if group.point_id is not None:
+                    self._update_duplicates(group)
+                if on_batch is not None:
+                    on_batch(1)
+
+        indexed = 0
+        start_time = time.perf_counter()
+        batcher = self._batcher(batch_size, token_budget)
+        for batch in batcher.batches(((None, page) for page in representatives()), sort=False):
+            if should_stop is not None and should_stop():
+                break
+            batch = [page for _, page in batch]
+
+            # Генерация эмбеддингов
+            image_embeddings = batcher.encode(batch)
+
+            start_id = self._append_pages(
+                [dataset_page(page) for page in batch] if dataset_page is not None else batch
+            )
+            groups = [getattr(page, "duplicate_group", None) for page in batch]
+            for j, group in enumerate(groups):
+                if group is not None:
+                    group.point_id = start_id + j
+            points = [
+                self._make_point(start_id + j, embedding, batch[j], metadata, groups[j])
+                for j, embedding in enumerate(image_embeddings)
+            ]
+            if on_points is not None:
+                on_points({start_id + j: page.filename for j, page in enumerate(batch)})
+            call_with_retries(
+                lambda: self.qdrant_client.upsert(collection_name=self.collection_name, points=points),
+                self.qdrant_config
+            )
+
+            indexed += len(batch)
+            INDEXED_PAGES.inc(len(batch))
+            INDEXING_THROUGHPUT.set(indexed / (time.perf_counter() - start_time))
+            if on_batch is not None:
+                on_batch(len(batch))
+
+        stats = batcher.stats()
+        stats["duplicates"] = duplicates
+        return stats
+
+    def tenant_pages(self, tenant: str) -> int:
+        """
+        Число страниц арендатора в рабочей коллекции (для квоты)
+        """
+        return call_with_retries(
+            lambda: self.qdrant_client.count(
+                self.collection_name, count_filter=tenant_filter(tenant), exact=True
+            ).count,
+            self.qdrant_config
+        )
+
+    def delete_pages(self, point_ids: List[int], filenames: List[str], tenant: str = GLOBAL_TENANT):
+        """
+        Удаление страниц одного документа из рабочей коллекции (отмена или сбой загрузки)
+
+        Удаляются только точки этого документа (по идентификаторам в разделе
+        арендатора), а его файлы убираются из списков копий других точек
+        раздела. Хэши копий после этого восстанавливаются из payload при
+        следующей индексации.
+
+        Args:
+            point_ids (List[int]): Точки, загруженные для документа
+            filenames (List[str]): Файлы страниц документа (уникальны для задачи загрузки)
+            tenant (str): Раздел, в который загружался документ
+        """
+        if not filenames:
+            return
+        removed = set(filenames)
+        if point_ids:
+            call_with_retries(
+                lambda: self.qdrant_client.delete(
+                    collection_name=self.collection_name,
+                    points_selector=models.FilterSelector(filter=models.Filter(must=[
+                        tenant_filter(tenant),
+                        models.HasIdCondition(has_id=list(point_ids)),
+                    ])),
+                    wait=True
+                ),
+                self.qdrant_config
+            )
+
+        offset = None
+        while True:
+            points, offset = call_with_retries(
+                lambda: self.qdrant_client.scroll(
                     collection_name=self.collection_name,
-                    points=points
+                    scroll_filter=models.Filter(must=[
+                        tenant_filter(tenant),
+                        models.FieldCondition(key="duplicates[].filename", match=models.MatchAny(any=filenames)),
+                    ]),
+                    with_payload=["duplicates"],
+                    with_vectors=False,
+                    limit=1000,
+                    offset=offset
+                ),
+                self.qdrant_config
+            )
+            for point in points:
+                duplicates = [
+                    duplicate for duplicate in (point.payload or {}).get("duplicates") or []
+                    if duplicate["filename"] not in removed
+                ]
+                call_with_retries(
+                    lambda: self.qdrant_client.set_payload(
+                        collection_name=self.collection_name,
+                        payload={"duplicates": duplicates},
+                        points=[point.id]
+                    ),
+                    self.qdrant_config
                 )
-                
-                pbar.update(len(batch))
+            if offset is None:
+                break
 
-        print("Indexing complete!")
+        with self._dataset_lock:
+            self._deduplicator = None
+
+    def delete_tenant(self, tenant: str) -> List[str]:
+        """
+        Удаление всех страниц арендатора из рабочей коллекции
+
+        Args:
+            tenant (str): Арендатор (общий архив так удалить нельзя)
+
+        Returns:
+            List[str]: Файлы удаленных страниц и их копий
+        """
+        if tenant == GLOBAL_TENANT:
+            raise ValueError("Общий архив не удаляется как раздел арендатора")
+
+        filenames = []
+        offset = None
+        while True:
+            points, offset = call_with_retries(
+                lambda: self.qdrant_client.scroll(
+                    collection_name=self.collection_name,
+                    scroll_filter=tenant_filter(tenant),
+                    with_payload=["filename", "duplicates"],
+                    with_vectors=False,
+                    limit=1000,
+                    offset=offset
+                ),
+                self.qdrant_config
+            )
+            for point in points:
+                payload = point.payload or {}
+                filenames.append(payload.get("filename"))
+                filenames.extend(duplicate["filename"] for duplicate in payload.get("duplicates") or [])
+            if offset is None:
+                break
+
+        call_with_retries(
+            lambda: self.qdrant_client.delete(
+                collection_name=self.collection_name,
+                points_selector=models.FilterSelector(filter=tenant_filter(tenant)),
+                wait=True
+            ),
+            self.qdrant_config
+        )
+        if self._deduplicator is not None:
+            self._deduplicator.drop(tenant)
+        return [filename for filename in filenames if filename]
+
+    def encode_query(self, query_text: str) -> torch.Tensor:
+        """
+        Кодирование текстового запроса в мультивектор
+
+        Args:
+            query_text (str): Текстовый запрос
+
+        Returns:
+            torch.Tensor: Эмбеддинги токенов запроса (tokens, dim) на CPU
+        """
+        if self.query_encoder is not None:
+            with QUERY_ENCODE_SECONDS.time(), span("query_encode_remote"):
+                return self.query_encoder.encode_query(query_text)
+
+        with QUERY_ENCODE_SECONDS.time(), torch.no_grad():
+            with span("process_queries"):
+                batch_query = self.processor.process_queries([query_text]).to(self.model.device)
+            with span("query_forward"):
+                query_embedding = self.model(**batch_query)[0].cpu().float()
+
+        if self.query_pruner is not None:
+            with span("query_pruning"):
+                input_ids = batch_query.get("input_ids")
+                query_embedding = self.query_pruner.prune(
+                    query_embedding,
+                    attention_mask=batch_query["attention_mask"][0],
+                    input_ids=input_ids[0] if input_ids is not None else None,
+                    pad_token_id=getattr(getattr(self.processor, "tokenizer", None), "pad_token_id", None)
+                )
+        return query_embedding
+
+    def _query_request(
+        self,
+        query_tensor: torch.Tensor,
+        top_k: int,
+        search_params: Optional[models.SearchParams],
+        prefetch_limit: Optional[int],
+        tenant: str = GLOBAL_TENANT,
+        with_vectors: bool = False
+    ) -> dict:
+        """
+        Аргументы query_points для мультивектора запроса внутри одного раздела
+
+        С with_vectors вместе с точками возвращаются их мультивекторы (для подсветки).
+        """
+        query_filter = tenant_filter(tenant)
+        request = dict(
+            collection_name=self.collection_name,
+            query=query_tensor.numpy().tolist(),
+            query_filter=query_filter,
+            limit=top_k,
+            search_params=search_params,
+            with_vectors=with_vectors,
+        )
+        if self.pooling:
+            request.update(
+                prefetch=models.Prefetch(
+                    query=self._pool(query_tensor),
+                    using=f"{self.pooling}_pooling",
+                    filter=query_filter,
+                    limit=prefetch_limit or top_k * 10,
+                    params=search_params,
+                ),
+                using="original",
+                with_vectors=["original"] if with_vectors else False,
+            )
+        return request
+
+    @staticmethod
+    def _batch_request(request: dict) -> models.QueryRequest:
+        """
+        Аргументы query_points в виде элемента query_batch_points
+        """
+        return models.QueryRequest(
+            query=request["query"],
+            using=request.get("using"),
+            prefetch=request.get("prefetch"),
+            filter=request["query_filter"],
+            params=request["search_params"],
+            limit=request["limit"],
+            with_payload=True,
+            with_vector=request["with_vectors"],
+        )
+
+    @staticmethod
+    def _merge_results(responses: List[models.QueryResponse], top_k: int) -> models.QueryResponse:
+        """
+        Объединение выдачи разделов: оценки MaxSim сопоставимы между разделами
+        """
+        points = [point for response in responses for point in response.points]
+        points.sort(key=lambda point: point.score, reverse=True)
+        return models.QueryResponse(points=points[:top_k])
+
+    def _attach_highlights(self, query_tensor: torch.Tensor, points: List[models.ScoredPoint]):
+        """
+        Подсветка совпадений для найденных точек по их мультивекторам
+
+        Результат записывается в payload["highlights"], мультивектор из ответа удаляется.
+        Сетка страниц, проиндексированных до появления patch_grid, берется по
+        изображению из dataset.
+        """
+        query = query_tensor.numpy()
+        for point in points:
+            vector = point.vector
+            point.vector = None
+            if isinstance(vector, dict):
+                vector = vector.get("original")
+            grid = (point.payload or {}).get("patch_grid")
+            if grid is None and self.dataset is not None and point.id < len(self.dataset):
+                grid = self._patch_grid(self.dataset[point.id].width, self.dataset[point.id].height)
+            if not vector or grid is None:
+                continue
+            point.payload["highlights"] = self.highlighter.highlight(
+                query, np.asarray(vector, dtype=np.float32), tuple(grid)
+            )
 
     def search_documents(
         self, 
         query_text: str, 
-        top_k: int = 5
+        top_k: int = 5,
+        search_params: Optional[models.SearchParams] = None,
+        prefetch_limit: Optional[int] = None,
+        tenant: Optional[str] = None,
+        highlights: bool = False
     ) -> List[Dict]:
         """
         Поиск документов по текстовому запросу
+
+        Args:
+            query_text (str): Текстовый запрос
+            top_k (int): Количество возвращаемых документов
+            search_params (models.SearchParams, optional): Параметры поиска Qdrant
+                (hnsw_ef, rescore и oversampling квантизации)
+            prefetch_limit (int, optional): Число кандидатов, отбираемых по
+                усредненному вектору перед MaxSim (только при pooling)
+            tenant (str, optional): Арендатор: поиск по общему архиву и его документам
+                (None - только общий архив)
+            highlights (bool): Вернуть для каждой страницы тепловую карту и области
+                совпадения (payload["highlights"]); векторы страниц приходят вместе
+                с результатом, энкодер повторно не вызывается
+
+        Без явных search_params и prefetch_limit параметры выбирает регулятор
+        по целевой задержке (если он включен).
         """
         # Генерация эмбеддинга запроса
-        with torch.no_grad():
-            batch_query = self.processor.process_queries([query_text]).to(self.model.device)
-            query_embedding = self.model(**batch_query)
-        
-        # Конвертация эмбеддинга
-        multivector_query = query_embedding[0].cpu().float().numpy().tolist()
-        
-        # Поиск в Qdrant
-        search_result = self.qdrant_client.query_points(
-            collection_name=self.collection_name, 
-            query=multivector_query, 
-            limit=top_k
-        )
-        
+        query_tensor = self.encode_query(query_text)
+        controlled = self.latency_slo is not None and search_params is None and prefetch_limit is None
+        if controlled:
+            search_params, prefetch_limit = self.latency_slo.params(top_k)
+        requests = [
+            self._query_request(query_tensor, top_k, search_params, prefetch_limit, scope, highlights)
+            for scope in search_scope(tenant)
+        ]
+
+        # Поиск в Qdrant: по запросу на раздел в одном вызове
+        start = time.perf_counter()
+        with QDRANT_QUERY_SECONDS.time(), span("qdrant_query"):
+            if len(requests) == 1:
+                search_result = call_with_retries(
+                    lambda: self.qdrant_client.query_points(**requests[0]),
+                    self.qdrant_config
+                )
+            else:
+                search_result = self._merge_results(call_with_retries(
+                    lambda: self.qdrant_client.query_batch_points(
+                        collection_name=self.collection_name,
+                        requests=[self._batch_request(request) for request in requests]
+                    ),
+                    self.qdrant_config
+                ), top_k)
+        if controlled:
+            self.latency_slo.observe(time.perf_counter() - start)
+        if highlights:
+            with span("highlights"):
+                self._attach_highlights(query_tensor, search_result.points)
         return search_result
 
-    def search_by_text_and_return_images(self, query_text, top_k=5):
-        results = self.search_documents(query_text, top_k)
+    def _get_async_client(self) -> AsyncQdrantClient:
+        if self._async_qdrant_client is None:
+            self._async_qdrant_client = create_async_qdrant_client(self.qdrant_config)
+        return self._async_qdrant_client
+
+    async def search_documents_async(
+        self,
+        query_text: str,
+        top_k: int = 5,
+        search_params: Optional[models.SearchParams] = None,
+        prefetch_limit: Optional[int] = None,
+        tenant: Optional[str] = None,
+        highlights: bool = False
+    ) -> List[Dict]:
+        """
+        Асинхронный поиск документов для обработчиков запросов
+
+        Кодирование запроса выполняется в пуле потоков, запрос к Qdrant -
+        через AsyncQdrantClient, не занимая поток на время ожидания ответа.
+        Аргументы совпадают с search_documents.
+        """
+        query_tensor = await asyncio.to_thread(self.encode_query, query_text)
+        controlled = self.latency_slo is not None and search_params is None and prefetch_limit is None
+        if controlled:
+            search_params, prefetch_limit = self.latency_slo.params(top_k)
+        requests = [
+            self._query_request(query_tensor, top_k, search_params, prefetch_limit, scope, highlights)
+            for scope in search_scope(tenant)
+        ]
+
+        client = self._get_async_client()
+        start = time.perf_counter()
+        with QDRANT_QUERY_SECONDS.time(), span("qdrant_query"):
+            if len(requests) == 1:
+                search_result = await async_call_with_retries(
+                    lambda: client.query_points(**requests[0]),
+                    self.qdrant_config
+                )
+            else:
+                search_result = self._merge_results(await async_call_with_retries(
+                    lambda: client.query_batch_points(
+                        collection_name=self.collection_name,
+                        requests=[self._batch_request(request) for request in requests]
+                    ),
+                    self.qdrant_config
+                ), top_k)
+        if controlled:
+            self.latency_slo.observe(time.perf_counter() - start)
+        if highlights:
+            with span("highlights"):
+                self._attach_highlights(query_tensor, search_result.points)
+        return search_result
+
+    def search_by_text_and_return_images(self, query_text, top_k=5, tenant=None):
+        results = self.search_documents(query_text, top_k, tenant=tenant)
         row_ids = [r.id for r in results.points]
-        return [self.dataset[i] for i in row_ids]
+        with span("dataset_lookup"):
+            return [self.dataset[i] for i in row_ids]
 
     def index_new_documents(
             self,
@@ -190,29 +1307,19 @@ class DocumentIndexer:
                             image_embeddings = self.model(**batch_images)
                         
                         # Подготовка точек для Qdrant
-                        points = []
-                        for j, embedding in enumerate(image_embeddings):
-                            multivector = embedding.cpu().float().numpy().tolist()
-                            points.append(
-                                models.PointStruct(
-                                    id=i + j,
-                                    vector=multivector,
-                                    payload={
-                                        **metadata,
-                                        "filename": batch[j].filename,
-                                        "page_number": getattr(batch[j], 'page_number', None),
-                                        "text": getattr(batch[j], 'text', None)  # Добавляем текст из изображения
-                                    }
-                                )
-                            )
-                            
-                            # Загрузка точек в Qdrant
-                            self.qdrant_client.upsert(
-                                collection_name=self.collection_name,
-                                points=points
-                            )
+                        points = [
+                            self._make_point(i + j, embedding, batch[j], metadata)
+                            for j, embedding in enumerate(image_embeddings)
+                        ]
                             
-                            pbar.update(len(batch))
+                        # Загрузка точек в Qdrant
+                        self.qdrant_client.upsert(
+                            collection_name=self.collection_name,
+                            points=points
+                        )
+
+                        pbar.update(len(batch))
+                        INDEXED_PAGES.inc(len(batch))
 
             print("Индексация новых документов завершена!")
 
@@ -221,24 +1328,27 @@ def main():
     """
     Пример использования
     """
-    data_preparer = DocumentDataPreparer("data/prepared_data/")
+    indexing_config = IndexingConfig()
+    data_preparer = DocumentDataPreparer(indexing_config.data_directory)
     dataset = data_preparer.prepare_documents()
 
-    # Создание индексатора с параметрами из конфигурации
+    # Создание индексатора с параметрами из конфигурации; на узлах без GPU
+    # страницы кодируют encoder_workers процессов CPU
     indexer = DocumentIndexer(
         dataset=dataset,
         model_name='vidore/colqwen2-v0.1',
         qdrant_host='localhost',
-        collection_name='document_collection'
+        collection_name='document_collection',
+        encoder_workers=indexing_config.encoder_workers,
+        threads_per_worker=indexing_config.threads_per_worker
     )
 
-    # Создание коллекции
-    # indexer.create_collection()
-
-    # Индексация документов
-    # indexer.index_documents(
+    # Индексация документов в новую версию коллекции с переключением алиаса
+    # indexer.reindex(
     #     batch_size=3,
     #     metadata={"source": "document_archive"},
+    #     smoke_query="годовой отчет",
+    #     checkpoint_path="data/index_checkpoint.json",
     # )
 
     # Пример поиска
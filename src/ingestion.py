@@ -0,0 +1,416 @@
+"""
+Фоновая загрузка пользовательских документов.
+
+Загруженный PDF ставится в очередь, и отдельный поток-воркер выполняет
+растеризацию, кодирование и upsert страниц, не занимая обработчики
+запросов. Растеризация идет в отдельном потоке на prefetch_batches батчей
+вперед, так что время до появления документа в поиске определяется
+кодированием. Каждая страница один раз записывается в PageStore вместе
+с миниатюрой и превью для выдачи, промежуточных PNG нет.
+
+Прогресс задачи (страницы, страниц в секунду, оставшееся время) доступен
+по ее идентификатору. Поиск все это время обслуживается как обычно, новые
+страницы становятся доступны по мере загрузки батчей. Задачу можно
+отменить: уже загруженные точки и файлы страниц документа при этом
+удаляются, как и при ошибке индексации, так что частично загруженный
+документ в поиске и в квоте арендатора не остается.
+Документ принадлежит арендатору, который его загрузил; число страниц
+арендатора ограничено квотой TenantConfig.max_pages.
+"""
+
+import os
+import queue
+import threading
+import time
+import uuid
+from dataclasses import dataclass, field
+from typing import Dict, Iterator, List, Optional
+
+import fitz
+from PIL import Image
+
+from configs.service_config import IndexingMetadata, IngestionConfig, PageImagesConfig, TenantConfig
+from src.data_preparation.prepare_data import iter_pdf_pages
+from src.metrics import ERRORS, QUEUE_DEPTH
+from src.page_store import PageStore
+from src.tenants import GLOBAL_TENANT, TENANT_FIELD, tenant_document_name
+
+# Статусы, после которых задача больше не меняется
+FINISHED_STATUSES = ("done", "failed", "cancelled")
+
+
+class QuotaExceededError(Exception):
+    """
+    Документ не помещается в квоту страниц арендатора
+    """
+
+
+@dataclass
+class IngestionJob:
+    """
+    Задача загрузки одного документа.
+
+    Attributes:
+        id (str): Идентификатор задачи
+        filename (str): Исходное имя файла
+        tenant (str): Арендатор, которому принадлежит документ
+        path (str): Путь к сохраненному файлу (None, если документ принят в память)
+        data (bytes): Содержимое документа, принятого потоком без записи на диск
+        status (str): queued, running, done, failed или cancelled
+        pages_total (int): Число страниц (известно после открытия документа)
+        pages_done (int): Число проиндексированных страниц
+        error (str): Текст ошибки для failed
+        batch_stats (dict): Фактические размеры батчей энкодера после завершения
+        page_files (List[str]): Файлы страниц, записанные задачей (удаляются при отмене)
+        point_ids (List[int]): Идентификаторы точек страниц задачи (записаны в манифест порядка)
+    """
+    id: str
+    filename: str
+    tenant: str = GLOBAL_TENANT
+    path: Optional[str] = None
+    data: Optional[bytes] = field(default=None, repr=False)
+    status: str = "queued"
+    pages_total: Optional[int] = None
+    pages_done: int = 0
+    error: Optional[str] = None
+    batch_stats: Optional[dict] = None
+    created_at: float = field(default_factory=time.time)
+    started_at: Optional[float] = None
+    finished_at: Optional[float] = None
+    cancel_event: threading.Event = field(default_factory=threading.Event, repr=False)
+    page_files: List[str] = field(default_factory=list, repr=False)
+    point_ids: List[int] = field(default_factory=list, repr=False)
+
+    def to_dict(self) -> dict:
+        """
+        Состояние задачи для API
+        """
+        pages_per_second = None
+        eta_seconds = None
+        if self.started_at is not None:
+            elapsed = (self.finished_at or time.time()) - self.started_at
+            if elapsed > 0 and self.pages_done:
+                pages_per_second = self.pages_done / elapsed
+                if self.status == "running" and self.pages_total is not None:
+                    eta_seconds = (self.pages_total - self.pages_done) / pages_per_second
+
+        return {
+            "id": self.id,
+            "filename": self.filename,
+            "tenant": self.tenant,
+            "status": self.status,
+            "pages_total": self.pages_total,
+            "pages_done": self.pages_done,
+            "pages_per_second": pages_per_second,
+            "eta_seconds": eta_seconds,
+            "error": self.error,
+            "batch_stats": self.batch_stats,
+            "created_at": self.created_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+        }
+
+
+class IngestionQueue:
+    """
+    Очередь задач загрузки с одним фоновым воркером.
+
+    Один воркер: задачи делят GPU с обработкой запросов, и параллельная
+    индексация нескольких документов только отнимала бы его у поиска.
+    """
+
+    def __init__(
+        self,
+        indexer,
+        config: Optional[IngestionConfig] = None,
+        metadata: Optional[IndexingMetadata] = None,
+        images_config: Optional[PageImagesConfig] = None,
+        tenant_config: Optional[TenantConfig] = None
+    ):
+        """
+        Args:
+            indexer (DocumentIndexer): Индексатор рабочей коллекции с загруженной моделью
+            config (IngestionConfig, optional): Параметры очереди
+            metadata (IndexingMetadata, optional): Общие метаданные индексации
+            images_config (PageImagesConfig, optional): Размеры миниатюр и превью страниц
+            tenant_config (TenantConfig, optional): Квота страниц арендатора
+        """
+        self.indexer = indexer
+        self.config = config or IngestionConfig()
+        self.tenant_config = tenant_config or TenantConfig()
+        self.metadata = {"source": (metadata or IndexingMetadata()).source}
+        self._jobs: Dict[str, IngestionJob] = {}
+        self._lock = threading.Lock()
+        self._queue: queue.Queue = queue.Queue()
+        self._worker: Optional[threading.Thread] = None
+
+        os.makedirs(self.config.upload_directory, exist_ok=True)
+        self.page_store = PageStore(
+            self.config.pages_directory,
+            image_format=self.config.page_format,
+            quality=self.config.page_quality,
+            images_config=images_config
+        )
+
+    def upload_path(self, filename: str) -> str:
+        """
+        Путь для сохранения загружаемого файла (с уникальным префиксом)
+        """
+        return os.path.join(
+            self.config.upload_directory,
+            f"{uuid.uuid4().hex[:12]}__{os.path.basename(filename)}"
+        )
+
+    def _start_worker(self):
+        if self._worker is None or not self._worker.is_alive():
+            self._worker = threading.Thread(target=self._run, name="ingestion-worker", daemon=True)
+            self._worker.start()
+
+    def check_quota(self, tenant: str, pages: int = 0) -> int:
+        """
+        Проверка квоты страниц арендатора (общий архив квотой не ограничен)
+
+        Args:
+            tenant (str): Арендатор
+            pages (int): Число добавляемых страниц
+
+        Returns:
+            int: Число уже загруженных страниц арендатора
+
+        Raises:
+            QuotaExceededError: Квота исчерпана или документ в нее не помещается
+        """
+        if tenant == GLOBAL_TENANT:
+            return 0
+        used = self.indexer.tenant_pages(tenant)
+        if used + max(pages, 1) > self.tenant_config.max_pages:
+            raise QuotaExceededError(
+                f"Квота арендатора {tenant}: занято {used} из {self.tenant_config.max_pages} страниц"
+            )
+        return used
+
+    def submit(
+        self,
+        path: Optional[str],
+        filename: str,
+        data: Optional[bytes] = None,
+        tenant: str = GLOBAL_TENANT
+    ) -> IngestionJob:
+        """
+        Постановка PDF в очередь
+
+        Args:
+            path (str): Путь к файлу на диске (None, если передан data)
+            filename (str): Исходное имя файла
+            data (bytes, optional): Содержимое PDF, принятое в память
+            tenant (str): Арендатор, загружающий документ
+
+        Returns:
+            IngestionJob: Созданная задача
+
+        Raises:
+            QuotaExceededError: Квота страниц арендатора исчерпана
+        """
+        if self.indexer.model is None:
+            raise RuntimeError("Модель ColQwen2 не загружена в этом процессе, индексация недоступна")
+        self.check_quota(tenant)
+
+        with self._lock:
+            queued = sum(1 for job in self._jobs.values() if job.status == "queued")
+            if queued >= self.config.max_queued_jobs:
+                raise OverflowError("Очередь индексации заполнена")
+            job = IngestionJob(
+                id=uuid.uuid4().hex[:12],
+                filename=os.path.basename(filename),
+                tenant=tenant,
+                path=path,
+                data=data
+            )
+            self._jobs[job.id] = job
+            self._prune()
+
+        self._queue.put(job.id)
+        QUEUE_DEPTH.labels(queue="ingestion").inc()
+        self._start_worker()
+        return job
+
+    def get(self, job_id: str) -> Optional[IngestionJob]:
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def jobs(self, tenant: Optional[str] = None) -> List[IngestionJob]:
+        """
+        Задачи очереди, новые первыми (tenant - только задачи арендатора)
+        """
+        with self._lock:
+            jobs = [job for job in self._jobs.values() if tenant is None or job.tenant == tenant]
+        return sorted(jobs, key=lambda job: job.created_at, reverse=True)
+
+    def cancel(self, job_id: str) -> Optional[IngestionJob]:
+        """
+        Отмена задачи: из очереди - сразу, выполняющейся - после текущего батча
+        с удалением уже загруженных страниц документа
+        """
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None:
+                return None
+            if job.status == "queued":
+                job.status = "cancelled"
+                job.finished_at = time.time()
+                job.data = None
+            job.cancel_event.set()
+        return job
+
+    def _prune(self):
+        finished = [job for job in self._jobs.values() if job.status in FINISHED_STATUSES]
+        finished.sort(key=lambda job: job.finished_at or job.created_at)
+        for job in finished[:max(0, len(finished) - self.config.keep_finished_jobs)]:
+            del self._jobs[job.id]
+
+    def _pages(self, job: IngestionJob, pdf_document) -> Iterator[Image.Image]:
+        """
+        Страницы документа с метаданными; изображение сохраняется один раз,
+        чтобы страница попала в набор данных и после перезапуска сервиса.
+        Имя файла содержит идентификатор задачи: повторная загрузка документа
+        с тем же именем не перезаписывает страницы предыдущей
+        """
+        document_name = tenant_document_name(job.tenant, f"{job.id}__{job.filename}")
+        for page_number, image in iter_pdf_pages(pdf_document, self.indexer.max_image_tokens):
+            filename = self.page_store.page_filename(document_name, page_number)
+            job.page_files.append(filename)
+            self.page_store.save(image, filename)
+            self.page_store.save_renditions(image, filename)
+            image.filename = filename
+            image.page_number = page_number
+            yield image
+
+    @staticmethod
+    def _prefetch(pages: Iterator[Image.Image], size: int) -> Iterator[Image.Image]:
+        """
+        Растеризация в отдельном потоке не более чем на size страниц вперед
+
+        Закрытие генератора останавливает поток и дожидается его, после
+        этого документ можно закрывать.
+        """
+        buffer: queue.Queue = queue.Queue(maxsize=max(1, size))
+        stop = threading.Event()
+        done = object()
+
+        def put(item) -> bool:
+            while not stop.is_set():
+                try:
+                    buffer.put(item, timeout=0.1)
+                    return True
+                except queue.Full:
+                    continue
+            return False
+
+        def produce():
+            try:
+                for page in pages:
+                    if not put(page):
+                        return
+            except Exception as e:
+                put(e)
+            finally:
+                put(done)
+
+        producer = threading.Thread(target=produce, name="ingestion-rasterizer", daemon=True)
+        producer.start()
+        try:
+            while True:
+                item = buffer.get()
+                if item is done:
+                    return
+                if isinstance(item, Exception):
+                    raise item
+                yield item
+        finally:
+            stop.set()
+            producer.join()
+
+    def _open(self, job: IngestionJob):
+        if job.data is not None:
+            return fitz.open(stream=job.data, filetype="pdf")
+        return fitz.open(job.path)
+
+    def _process(self, job: IngestionJob):
+        def on_batch(count: int):
+            job.pages_done += count
+
+        def on_points(pages: Dict[int, str]):
+            # Манифест пишется до upsert: после перезапуска точки найдут свои страницы
+            job.point_ids.extend(pages)
+            self.page_store.record_pages(pages)
+
+        with self._open(job) as pdf_document:
+            job.pages_total = len(pdf_document)
+            # Повторная проверка: пока задача ждала, квоту могли занять другие документы
+            self.check_quota(job.tenant, job.pages_total)
+            pages = self._prefetch(
+                self._pages(job, pdf_document),
+                self.config.prefetch_batches * self.config.batch_size
+            )
+            try:
+                job.batch_stats = self.indexer.index_pages(
+                    pages,
+                    batch_size=self.config.batch_size,
+                    metadata={**self.metadata, TENANT_FIELD: job.tenant},
+                    should_stop=job.cancel_event.is_set,
+                    on_batch=on_batch,
+                    # В памяти остается только лениво открытая сжатая копия страницы
+                    dataset_page=lambda page: self.page_store.open(page.filename, page.page_number),
+                    on_points=on_points
+                )
+            finally:
+                pages.close()
+
+    def _discard(self, job: IngestionJob) -> Optional[str]:
+        """
+        Удаление точек и файлов страниц отмененной или упавшей задачи
+
+        Returns:
+            str: Текст ошибки, если страницы не удалось удалить из индекса
+        """
+        if not job.page_files:
+            return None
+        try:
+            self.indexer.delete_pages(job.point_ids, job.page_files, job.tenant)
+        except Exception as e:
+            # Файлы не удаляются: без них оставшиеся точки выдавали бы ошибку
+            print(f"Страницы задачи {job.id} не удалены из индекса: {e}")
+            ERRORS.labels(stage="ingestion").inc()
+            return f"Страницы документа не удалены из индекса: {e}"
+        for filename in job.page_files:
+            self.page_store.delete(filename)
+        self.page_store.forget_pages(job.point_ids)
+        return None
+
+    def _run(self):
+        while True:
+            job_id = self._queue.get()
+            QUEUE_DEPTH.labels(queue="ingestion").dec()
+            job = self.get(job_id)
+            if job is None or job.status != "queued":
+                continue
+
+            job.status = "running"
+            job.started_at = time.time()
+            try:
+                self._process(job)
+                if job.cancel_event.is_set():
+                    job.error = self._discard(job)
+                    job.status = "cancelled"
+                else:
+                    job.status = "done"
+            except Exception as e:
+                print(f"Ошибка индексации {job.filename}: {e}")
+                ERRORS.labels(stage="ingestion").inc()
+                job.status = "failed"
+                # Частично загруженный документ не остается в поиске и в квоте
+                discard_error = self._discard(job)
+                job.error = f"{e}; {discard_error}" if discard_error else str(e)
+            finally:
+                job.finished_at = time.time()
+                job.data = None
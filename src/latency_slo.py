@@ -0,0 +1,126 @@
+"""
+Регулятор точности поиска по целевой задержке.
+
+Стоимость запроса к Qdrant задают hnsw_ef (ширина обхода графа),
+oversampling квантизации (сколько кандидатов пересчитывается по исходным
+векторам) и число кандидатов предвыборки по усредненному вектору. Регулятор
+держит скользящее окно задержек запросов к Qdrant и по его p95 сдвигает
+уровень усилия: выше цели - на уровень вниз, заметно ниже цели - на уровень
+вверх. При всплеске нагрузки выдача становится немного менее точной, но
+укладывается в таймауты, а в спокойное время возвращается к полной точности.
+
+Задержка кодирования запроса в окно не входит: она от этих параметров не зависит.
+"""
+
+import threading
+from collections import deque
+from typing import Optional, Tuple
+
+from qdrant_client.http import models
+
+from configs.service_config import LatencySLOConfig
+from src.metrics import SEARCH_EFFORT_LEVEL, SEARCH_LATENCY_P95
+
+
+def _interpolate(bounds: Tuple[float, float], fraction: float) -> float:
+    low, high = bounds
+    return low + (high - low) * fraction
+
+
+class LatencySLOController:
+    """
+    Выбор параметров поиска по текущему уровню усилия.
+
+    Attributes:
+        level (int): Текущий уровень усилия (0 - самый быстрый)
+    """
+
+    def __init__(self, config: LatencySLOConfig, quantization: str = "int8", pooling: Optional[str] = None):
+        """
+        Args:
+            config (LatencySLOConfig): Цель по задержке и границы параметров
+            quantization (str): Квантизация коллекции (без нее oversampling не задается)
+            pooling (str, optional): Усредненный вектор коллекции (без него нет предвыборки)
+        """
+        self.config = config
+        self.quantization = quantization
+        self.pooling = pooling
+        self.max_level = max(1, config.levels) - 1
+        self.level = self.max_level
+        self._latencies: deque = deque(maxlen=config.window)
+        self._since_change = 0
+        self._lock = threading.Lock()
+        SEARCH_EFFORT_LEVEL.set(self.level)
+
+    def params(self, top_k: int) -> Tuple[models.SearchParams, Optional[int]]:
+        """
+        Параметры запроса для текущего уровня
+
+        Args:
+            top_k (int): Количество возвращаемых документов
+
+        Returns:
+            tuple: Параметры поиска Qdrant и число кандидатов предвыборки
+        """
+        config = self.config
+        fraction = self.level / self.max_level if self.max_level else 1.0
+
+        quantization = None
+        if self.quantization != "none":
+            quantization = models.QuantizationSearchParams(
+                rescore=True,
+                oversampling=round(_interpolate(config.oversampling, fraction), 2),
+            )
+        search_params = models.SearchParams(
+            hnsw_ef=int(_interpolate(config.hnsw_ef, fraction)),
+            quantization=quantization,
+        )
+
+        prefetch_limit = None
+        if self.pooling:
+            prefetch_limit = max(top_k, round(_interpolate(config.prefetch_factor, fraction) * top_k))
+        return search_params, prefetch_limit
+
+    def observe(self, seconds: float):
+        """
+        Учет задержки запроса к Qdrant и, при необходимости, смена уровня
+
+        После смены уровня окно очищается: решения принимаются только
+        по задержкам, измеренным с новыми параметрами.
+        """
+        config = self.config
+        with self._lock:
+            self._latencies.append(seconds)
+            self._since_change += 1
+            if self._since_change < config.min_samples:
+                return
+
+            ordered = sorted(self._latencies)
+            p95 = ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))]
+            SEARCH_LATENCY_P95.set(p95)
+
+            target = config.target_p95_ms / 1000
+            level = self.level
+            if p95 > target and level > 0:
+                level -= 1
+            elif p95 < target * config.headroom and level < self.max_level:
+                level += 1
+            if level != self.level:
+                self.level = level
+                self._latencies.clear()
+                self._since_change = 0
+                SEARCH_EFFORT_LEVEL.set(level)
+
+    def state(self) -> dict:
+        """
+        Текущий уровень и параметры для отчетов
+        """
+        search_params, prefetch_factor = self.params(1)
+        quantization = search_params.quantization
+        return {
+            "level": self.level,
+            "max_level": self.max_level,
+            "hnsw_ef": search_params.hnsw_ef,
+            "oversampling": quantization.oversampling if quantization else None,
+            "prefetch_factor": prefetch_factor,
+        }
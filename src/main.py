@@ -1,11 +1,55 @@
+import time
+
 import uvicorn
-from fastapi import FastAPI
+from fastapi import FastAPI, Request, Response
+
+from configs.service_config import MonitoringConfig, ProfilingConfig, SecurityConfig
+from src.metrics import IN_FLIGHT_REQUESTS, REQUEST_SECONDS, render_metrics
+from src.profiling import TracingMiddleware
+from src.rate_limiter import AdmissionController, RateLimitMiddleware
+from src.routers.index_router import index_router
+from src.routers.pages_router import pages_router
 from src.routers.search_router import search_router
 
 app = FastAPI(title="Document Search Service")
+monitoring_config = MonitoringConfig()
+security_config = SecurityConfig()
+profiling_config = ProfilingConfig()
 
 # Подключение роутеров
 app.include_router(search_router)
+app.include_router(index_router)
+app.include_router(pages_router)
+
+# Ограничение частоты и сброс нагрузки по приоритетам
+app.add_middleware(RateLimitMiddleware, controller=AdmissionController(security_config))
+
+# Длительности этапов в Server-Timing и профилирование по запросу администратора
+if profiling_config.tracing_enabled:
+    app.add_middleware(TracingMiddleware, config=profiling_config)
+
+if monitoring_config.enabled:
+    @app.middleware("http")
+    async def track_requests(request: Request, call_next):
+        """
+        Учет запросов в обработке и времени ответа по маршрутам
+        """
+        start = time.perf_counter()
+        with IN_FLIGHT_REQUESTS.track_inprogress():
+            response = await call_next(request)
+        # Шаблон маршрута вместо фактического пути, чтобы не плодить метки
+        route = request.scope.get("route")
+        path = getattr(route, "path", "unmatched")
+        REQUEST_SECONDS.labels(path=path).observe(time.perf_counter() - start)
+        return response
+
+    @app.get(monitoring_config.prometheus.path, include_in_schema=False)
+    def metrics():
+        """
+        Эндпоинт метрик Prometheus
+        """
+        body, content_type = render_metrics()
+        return Response(content=body, media_type=content_type)
 
 if __name__ == "__main__":
     uvicorn.run(app, host="0.0.0.0", port=8000)
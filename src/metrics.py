@@ -0,0 +1,139 @@
+"""
+Метрики Prometheus для всех этапов конвейера поиска и генерации.
+
+Метрики объявлены на уровне модуля и обновляются прямо в местах вызова:
+запись в гистограмму или счетчик prometheus_client - это одна блокировка
+и сложение, поэтому инструментирование можно держать включенным под нагрузкой.
+Метрики, которые дорого считать (память устройства), вычисляются только при сборе.
+"""
+
+from prometheus_client import CONTENT_TYPE_LATEST, Counter, Gauge, Histogram, generate_latest
+
+# Границы корзин в секундах: от миллисекунд (Qdrant, base64) до десятков секунд (генерация)
+LATENCY_BUCKETS = (
+    0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0
+)
+
+# Задержки этапов
+QUERY_ENCODE_SECONDS = Histogram(
+    "rag_query_encode_seconds",
+    "Время кодирования текстового запроса ColQwen2",
+    buckets=LATENCY_BUCKETS,
+)
+QDRANT_QUERY_SECONDS = Histogram(
+    "rag_qdrant_query_seconds",
+    "Время выполнения запроса к Qdrant",
+    buckets=LATENCY_BUCKETS,
+)
+IMAGE_LOAD_SECONDS = Histogram(
+    "rag_image_load_seconds",
+    "Время загрузки изображения страницы",
+    buckets=LATENCY_BUCKETS,
+)
+BASE64_DECODE_SECONDS = Histogram(
+    "rag_base64_decode_seconds",
+    "Время декодирования изображения из base64",
+    buckets=LATENCY_BUCKETS,
+)
+GENERATION_SECONDS = Histogram(
+    "rag_generation_seconds",
+    "Время генерации ответа MiniCPM-V",
+    buckets=LATENCY_BUCKETS,
+)
+REQUEST_SECONDS = Histogram(
+    "rag_http_request_seconds",
+    "Время обработки HTTP запроса",
+    ["path"],
+    buckets=LATENCY_BUCKETS,
+)
+INDEXING_BATCH_SIZE = Histogram(
+    "rag_indexing_batch_size",
+    "Фактический размер батча визуального энкодера",
+    buckets=(1, 2, 4, 8, 16, 32, 64),
+)
+QUERY_TOKENS = Histogram(
+    "rag_query_tokens",
+    "Число векторов запроса до и после прореживания",
+    ["stage"],
+    buckets=(4, 8, 12, 16, 24, 32, 48, 64, 128),
+)
+
+# Счетчики
+CACHE_REQUESTS = Counter(
+    "rag_cache_requests_total",
+    "Обращения к кэшам по результату (hit, disk_hit, miss)",
+    ["cache", "result"],
+)
+ERRORS = Counter(
+    "rag_errors_total",
+    "Ошибки по этапам",
+    ["stage"],
+)
+REJECTED_REQUESTS = Counter(
+    "rag_rejected_requests_total",
+    "Отклоненные запросы по причине (rate_limit, overload) и приоритету",
+    ["route_class", "reason", "priority"],
+)
+INDEXED_PAGES = Counter(
+    "rag_indexed_pages_total",
+    "Количество проиндексированных страниц",
+)
+ENCODER_OOM = Counter(
+    "rag_encoder_oom_total",
+    "Батчи визуального энкодера, разделенные из-за нехватки памяти",
+)
+
+# Текущее состояние
+IN_FLIGHT_REQUESTS = Gauge(
+    "rag_in_flight_requests",
+    "Количество HTTP запросов в обработке",
+)
+QUEUE_DEPTH = Gauge(
+    "rag_queue_depth",
+    "Количество задач, ожидающих освобождения модели",
+    ["queue"],
+)
+MODEL_DEVICE_MEMORY_BYTES = Gauge(
+    "rag_model_device_memory_bytes",
+    "Память, занятая тензорами на устройстве",
+    ["device"],
+)
+SEARCH_EFFORT_LEVEL = Gauge(
+    "rag_search_effort_level",
+    "Текущий уровень усилия поиска (0 - самый быстрый)",
+)
+SEARCH_LATENCY_P95 = Gauge(
+    "rag_search_latency_p95_seconds",
+    "p95 задержки запроса к Qdrant в окне регулятора точности",
+)
+INDEXING_THROUGHPUT = Gauge(
+    "rag_indexing_pages_per_second",
+    "Скорость индексации в текущем или последнем запуске",
+)
+
+
+def register_device_memory(device: str):
+    """
+    Регистрация метрики памяти устройства, вычисляемой при сборе
+
+    Args:
+        device (str): Устройство PyTorch (например, cuda:0)
+    """
+    import torch
+
+    if not device.startswith("cuda") or not torch.cuda.is_available():
+        return
+
+    MODEL_DEVICE_MEMORY_BYTES.labels(device=device).set_function(
+        lambda: torch.cuda.memory_allocated(device)
+    )
+
+
+def render_metrics() -> tuple:
+    """
+    Сериализация всех метрик в текстовый формат Prometheus
+
+    Returns:
+        tuple: Тело ответа и его content-type
+    """
+    return generate_latest(), CONTENT_TYPE_LATEST
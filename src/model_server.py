@@ -0,0 +1,270 @@
+"""
+Отдельный процесс-владелец моделей для нескольких HTTP воркеров.
+
+ColQwen2 и MiniCPM-V загружаются один раз в процессе модельного сервера,
+HTTP воркеры (uvicorn --workers N, Gradio) подключаются к нему через
+Unix-сокет (multiprocessing.connection). По сокету передаются только
+небольшие словари с метаданными, а эмбеддинги запросов и пиксели страниц
+передаются через разделяемую память без сериализации в списки.
+
+Запуск:
+    MODEL_SERVER_ADDRESS=/tmp/nornikel_model_server.sock python -m src.model_server
+
+С --stub вместо моделей загружаются CPU-заглушки из src.benchmarks: сервис
+поднимается без GPU для нагрузочного тестирования (src.benchmarks.load_test).
+"""
+
+import argparse
+import os
+import threading
+from multiprocessing import shared_memory
+from multiprocessing.connection import Client, Connection, Listener
+from typing import Iterator, Optional
+
+import numpy as np
+import torch
+from PIL import Image
+
+from configs.service_config import ModelServerConfig, QueryPruningConfig, VisionCacheConfig
+from src.utils import from_shared_memory, to_shared_memory
+
+
+def _authkey(config: ModelServerConfig) -> bytes:
+    """
+    Ключ аутентификации сокета: по подключению передаются pickle-объекты,
+    поэтому работа без ключа или с ключом по умолчанию не допускается
+    """
+    if not config.authkey:
+        raise ValueError(
+            "Не задан MODEL_SERVER_AUTHKEY: задайте общий секрет модельного сервера и воркеров, "
+            "например python -c \"import secrets; print(secrets.token_hex(32))\""
+        )
+    return config.authkey.encode()
+
+
+class ModelServer:
+    """
+    Процесс, владеющий моделями и обслуживающий запросы воркеров.
+
+    Каждое подключение обслуживается отдельным потоком; доступ к моделям
+    сериализуется их собственными блокировками.
+    """
+
+    def __init__(
+        self,
+        config: ModelServerConfig,
+        vision_cache_config: Optional[VisionCacheConfig] = None,
+        query_pruning_config: Optional[QueryPruningConfig] = None,
+        stub: bool = False
+    ):
+        """
+        Args:
+            config (ModelServerConfig): Адрес сокета и модели
+            vision_cache_config (VisionCacheConfig, optional): Кэш визуального энкодера
+            query_pruning_config (QueryPruningConfig, optional): Прореживание токенов запроса
+            stub (bool): CPU-заглушки вместо моделей (для нагрузочного тестирования)
+        """
+        from src.indexer import DocumentIndexer
+        from src.multimodal_inference import MultimodalInference
+        from src.vision_cache import VisionEncoderCache
+
+        self.config = config
+
+        # Индексатор используется только как кодировщик запросов
+        encoder = {}
+        if stub:
+            from src.benchmarks.stub_encoder import StubColQwen2, StubColQwen2Processor
+            encoder = {"model": StubColQwen2(), "processor": StubColQwen2Processor()}
+        self.indexer = DocumentIndexer(
+            dataset=None,
+            model_name=config.encoder_model_name,
+            query_pruning=query_pruning_config or QueryPruningConfig(),
+            **encoder
+        )
+        self._encoder_lock = threading.Lock()
+
+        if stub:
+            from src.benchmarks.stub_generator import StubMultimodalInference
+            self.multimodal_inference = StubMultimodalInference()
+            return
+
+        vision_cache_config = vision_cache_config or VisionCacheConfig()
+        vision_cache = None
+        if vision_cache_config.enabled:
+            vision_cache = VisionEncoderCache(
+                max_entries=vision_cache_config.max_entries,
+                disk_directory=vision_cache_config.disk_directory
+            )
+        self.multimodal_inference = MultimodalInference(
+            model_name=config.multimodal_model_name,
+            vision_cache=vision_cache
+        )
+
+    def _encode_query(self, request: dict) -> dict:
+        with self._encoder_lock:
+            embedding = self.indexer.encode_query(request["text"])
+        return to_shared_memory(embedding.numpy())
+
+    @staticmethod
+    def _receive_image(request: dict) -> Image.Image:
+        pixels = from_shared_memory(request["image"], unlink=False)
+        image = Image.fromarray(pixels, mode=request["mode"])
+        image.filename = request.get("filename")
+        return image
+
+    def _handle(self, connection: Connection, request: dict):
+        op = request.get("op")
+        if op == "ping":
+            connection.send({"ok": True})
+        elif op == "encode_query":
+            connection.send({"ok": True, "embedding": self._encode_query(request)})
+        elif op == "generate":
+            image = self._receive_image(request)
+            response = self.multimodal_inference.generate_response(image, request["query"])
+            connection.send({"ok": True, "response": response})
+        elif op == "generate_stream":
+            image = self._receive_image(request)
+            for chunk in self.multimodal_inference.generate_response_stream(image, request["query"]):
+                connection.send({"ok": True, "chunk": chunk})
+            connection.send({"ok": True, "done": True})
+        else:
+            connection.send({"ok": False, "error": f"Неизвестная операция: {op}"})
+
+    def _serve_connection(self, connection: Connection):
+        with connection:
+            while True:
+                try:
+                    request = connection.recv()
+                except (EOFError, ConnectionResetError):
+                    return
+                try:
+                    self._handle(connection, request)
+                except Exception as e:
+                    print(f"Ошибка модельного сервера: {e}")
+                    connection.send({"ok": False, "error": str(e)})
+
+    def serve_forever(self):
+        if os.path.exists(self.config.address):
+            os.remove(self.config.address)
+
+        with Listener(self.config.address, family="AF_UNIX", authkey=_authkey(self.config)) as listener:
+            # Сокет доступен только пользователю сервиса
+            os.chmod(self.config.address, 0o600)
+            print(f"Модельный сервер слушает {self.config.address}")
+            while True:
+                try:
+                    connection = listener.accept()
+                except Exception as e:
+                    print(f"Ошибка подключения к модельному серверу: {e}")
+                    continue
+                threading.Thread(target=self._serve_connection, args=(connection,), daemon=True).start()
+
+
+class ModelServerClient:
+    """
+    Клиент модельного сервера для HTTP воркера.
+
+    Повторяет интерфейс, который DocumentSearchService использует у
+    DocumentIndexer (encode_query) и MultimodalInference (generate_response*).
+    Каждый поток держит собственное соединение: Connection не потокобезопасен.
+    """
+
+    def __init__(self, config: ModelServerConfig):
+        self.config = config
+        # Ошибка конфигурации - при запуске воркера, а не на первом запросе
+        _authkey(config)
+        self._local = threading.local()
+
+    def _connection(self) -> Connection:
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            connection = Client(self.config.address, family="AF_UNIX", authkey=_authkey(self.config))
+            self._local.connection = connection
+        return connection
+
+    def _reset(self):
+        connection = getattr(self._local, "connection", None)
+        if connection is not None:
+            connection.close()
+        self._local.connection = None
+
+    def _call(self, request: dict) -> dict:
+        try:
+            connection = self._connection()
+            connection.send(request)
+            reply = connection.recv()
+        except (EOFError, OSError):
+            # Сервер перезапущен: одно переподключение
+            self._reset()
+            connection = self._connection()
+            connection.send(request)
+            reply = connection.recv()
+        if not reply.get("ok"):
+            raise RuntimeError(reply.get("error", "Ошибка модельного сервера"))
+        return reply
+
+    @staticmethod
+    def _image_request(image: Image.Image) -> dict:
+        mode = image.mode if image.mode in ("RGB", "L") else "RGB"
+        pixels = np.asarray(image.convert(mode))
+        return {
+            "image": to_shared_memory(pixels),
+            "mode": mode,
+            "filename": getattr(image, "filename", None),
+        }
+
+    @staticmethod
+    def _release_image(request: dict):
+        shm = shared_memory.SharedMemory(name=request["image"]["shm"])
+        shm.close()
+        shm.unlink()
+
+    def ping(self) -> bool:
+        return self._call({"op": "ping"})["ok"]
+
+    def encode_query(self, query_text: str) -> torch.Tensor:
+        """
+        Кодирование запроса в модельном сервере
+
+        Returns:
+            torch.Tensor: Эмбеддинги токенов запроса (tokens, dim)
+        """
+        reply = self._call({"op": "encode_query", "text": query_text})
+        return torch.from_numpy(from_shared_memory(reply["embedding"], unlink=True))
+
+    def generate_response(self, image: Image.Image, query: str) -> str:
+        request = {"op": "generate", "query": query, **self._image_request(image)}
+        try:
+            return self._call(request)["response"]
+        finally:
+            self._release_image(request)
+
+    def generate_response_stream(self, image: Image.Image, query: str) -> Iterator[str]:
+        request = {"op": "generate_stream", "query": query, **self._image_request(image)}
+        try:
+            connection = self._connection()
+            connection.send(request)
+            while True:
+                reply = connection.recv()
+                if not reply.get("ok"):
+                    raise RuntimeError(reply.get("error", "Ошибка модельного сервера"))
+                if reply.get("done"):
+                    return
+                yield reply["chunk"]
+        except GeneratorExit:
+            # Поток прерван клиентом: соединение в неизвестном состоянии
+            self._reset()
+            raise
+        finally:
+            self._release_image(request)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Процесс-владелец моделей")
+    parser.add_argument("--stub", action="store_true", help="CPU-заглушки вместо ColQwen2 и MiniCPM-V")
+    args = parser.parse_args(argv)
+    ModelServer(ModelServerConfig(), stub=args.stub).serve_forever()
+
+
+if __name__ == "__main__":
+    main()
@@ -3,16 +3,49 @@
 Позволяет генерировать текстовые ответы на основе изображений и текстовых запросов.
 """
 
+import threading
+from contextlib import contextmanager
+from typing import Iterator, Optional, Union
+
 import torch
 from PIL import Image
-from transformers import AutoModel, AutoTokenizer
+from transformers import AutoModel, AutoProcessor, AutoTokenizer
+
+from src.metrics import ERRORS, GENERATION_SECONDS, QUEUE_DEPTH
+from src.profiling import span
+from src.utils import image_hash, stream_in_worker
+from src.vision_cache import VisionCacheEntry, VisionEncoderCache
+
+
+class _CachedImageProcessor:
+    """
+    Обертка над image processor MiniCPM-V, позволяющая подставить
+    заранее нарезанные слайсы страницы вместо повторной нарезки.
+    """
+
+    def __init__(self, image_processor):
+        self._image_processor = image_processor
+        self.cached_inputs = None
+        self.last_inputs = None
+
+    def __call__(self, images, **kwargs):
+        if self.cached_inputs is not None:
+            image_inputs, self.cached_inputs = self.cached_inputs, None
+        else:
+            image_inputs = self._image_processor(images, **kwargs)
+        self.last_inputs = image_inputs
+        return image_inputs
+
+    def __getattr__(self, name):
+        return getattr(self._image_processor, name)
 
 
 class MultimodalInference:
     def __init__(
         self, 
         model_name: str = 'openbmb/MiniCPM-V-2_6-int4', 
-        device: str = 'cuda' if torch.cuda.is_available() else 'cpu'
+        device: str = 'cuda' if torch.cuda.is_available() else 'cpu',
+        vision_cache: Optional[VisionEncoderCache] = None
     ):
         """
         Инициализация модели мультимодального вывода
@@ -20,6 +53,7 @@ class MultimodalInference:
         Args:
             model_name (str): Идентификатор модели из Hugging Face
             device (str): Устройство для запуска модели
+            vision_cache (VisionEncoderCache, optional): Кэш выходов визуального энкодера
         """
         # Загрузка модели и токенизатора
         self.model = AutoModel.from_pretrained(
@@ -35,6 +69,23 @@ class MultimodalInference:
         self.model.eval()
         self.device = device
 
+        # Кэш визуального энкодера: процессор с подменяемой нарезкой страниц
+        self.vision_cache = vision_cache
+        self.processor = None
+        if self.vision_cache is not None:
+            self.processor = AutoProcessor.from_pretrained(
+                model_name,
+                trust_remote_code=True
+            )
+            self._image_processor = _CachedImageProcessor(self.processor.image_processor)
+            self.processor.image_processor = self._image_processor
+
+        # Ревизия модели входит в ключ кэша
+        self.model_revision = getattr(self.model.config, '_commit_hash', None) or model_name
+
+        # Генерация на одной модели выполняется последовательно
+        self._lock = threading.Lock()
+
     def generate_response(
         self, 
         image: Image.Image, 
@@ -57,21 +108,138 @@ class MultimodalInference:
             msgs = [{'role': 'user', 'content': [image, query]}]
 
             # Генерация ответа
-            with torch.no_grad():
-                response = self.model.chat(
-                    image=image, 
-                    msgs=msgs, 
-                    tokenizer=self.tokenizer,
-                    max_length=max_length,
-                    temperature=0.2,
-                )
+            with self._acquire_model(), GENERATION_SECONDS.time(), span("generation"):
+                response = self._chat(image, msgs, max_length)
 
             return response
 
         except Exception as e:
+            ERRORS.labels(stage="generation").inc()
             print(f"Ошибка при выводе: {e}")
             return "Извините, не удалось обработать изображение и запрос."
 
+    def generate_response_stream(
+        self,
+        image: Image.Image,
+        query: str,
+        max_length: int = 10000
+    ) -> Iterator[str]:
+        """
+        Потоковая генерация ответа на основе изображения и запроса
+
+        Args:
+            image (Image.Image): Входное изображение
+            query (str): Текстовый запрос об изображении
+            max_length (int): Максимальная длина генерируемого ответа
+
+        Yields:
+            str: Очередной фрагмент ответа модели
+        """
+        try:
+            msgs = [{'role': 'user', 'content': [image, query]}]
+
+            def produce():
+                with GENERATION_SECONDS.time():
+                    yield from self._chat(image, msgs, max_length, stream=True)
+
+            # Модель захватывает поток-производитель, а не потребитель:
+            # оборванный клиент не удерживает блокировку
+            yield from stream_in_worker(produce, self._acquire_model)
+
+        except Exception as e:
+            ERRORS.labels(stage="generation").inc()
+            print(f"Ошибка при выводе: {e}")
+            yield "Извините, не удалось обработать изображение и запрос."
+
+    @contextmanager
+    def _acquire_model(self):
+        """
+        Захват модели с учетом ожидающих запросов в метрике очереди
+        """
+        queue_depth = QUEUE_DEPTH.labels(queue="generation")
+        queue_depth.inc()
+        try:
+            with span("generation_queue"):
+                self._lock.acquire()
+        finally:
+            queue_depth.dec()
+        try:
+            yield
+        finally:
+            self._lock.release()
+
+    def _chat(
+        self,
+        image: Image.Image,
+        msgs: list,
+        max_length: int,
+        stream: bool = False
+    ) -> Union[str, Iterator[str]]:
+        """
+        Вызов model.chat с переиспользованием выходов визуального энкодера
+
+        При попадании в кэш в модель передаются готовые слайсы и
+        vision_hidden_states, и визуальный энкодер не запускается.
+        При промахе выход ресемплера перехватывается хуком и сохраняется.
+        Визуальная часть отрабатывает до возврата из chat и при stream=True.
+
+        Args:
+            image (Image.Image): Входное изображение
+            msgs (list): Сообщения в формате модели
+            max_length (int): Максимальная длина генерируемого ответа
+            stream (bool): Вернуть генератор фрагментов вместо строки
+
+        Returns:
+            str или Iterator[str]: Ответ модели
+        """
+        chat_kwargs = dict(
+            image=image,
+            msgs=msgs,
+            tokenizer=self.tokenizer,
+            max_length=max_length,
+            temperature=0.2,
+            stream=stream,
+        )
+
+        if self.vision_cache is None:
+            with torch.no_grad():
+                return self.model.chat(**chat_kwargs)
+
+        with span("vision_cache_lookup"):
+            key = self.vision_cache.make_key(image_hash(image), self.model_revision)
+            entry = self.vision_cache.get(key)
+
+        with torch.no_grad():
+            if entry is not None:
+                self._image_processor.cached_inputs = entry.image_inputs
+                return self.model.chat(
+                    processor=self.processor,
+                    vision_hidden_states=[entry.vision_hidden_states.to(self.device)],
+                    **chat_kwargs
+                )
+
+            # Ресемплер может вызываться несколькими порциями слайсов
+            self._image_processor.last_inputs = None
+            captured = []
+            handle = self.model.resampler.register_forward_hook(
+                lambda module, inputs, output: captured.append(output.detach())
+            )
+            try:
+                response = self.model.chat(processor=self.processor, **chat_kwargs)
+            finally:
+                handle.remove()
+
+            if captured and self._image_processor.last_inputs is not None:
+                self.vision_cache.put(
+                    key,
+                    VisionCacheEntry(
+                        image_inputs=self._image_processor.last_inputs,
+                        vision_hidden_states=torch.cat(captured)
+                    )
+                )
+
+            return response
+
 
 def main():
     """
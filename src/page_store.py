@@ -0,0 +1,274 @@
+"""
+Хранилище изображений страниц.
+
+Каждая страница записывается один раз в сжатом виде (по умолчанию WebP)
+в директорию набора данных, откуда ее читает DocumentDataPreparer при
+следующем запуске. В памяти после индексации остается только лениво
+открытый файл, а не растр страницы.
+
+Для выдачи рядом со страницей хранятся уменьшенные копии (миниатюра,
+превью) в поддиректориях по имени размера. Они создаются при загрузке
+документа, а для страниц, загруженных раньше, - при первом обращении.
+
+Предварительное создание копий для всего набора данных:
+    python -m src.page_store data/prepared_data/
+"""
+
+import hashlib
+import json
+import os
+import sys
+import threading
+from typing import Dict, Iterable, List, Optional
+
+from PIL import Image
+
+from configs.service_config import PageImagesConfig
+
+# Расширения, под которыми страницы лежат в директории набора данных
+PAGE_EXTENSIONS = (".png", ".webp", ".jpg", ".jpeg")
+
+# Имя размера для исходного изображения страницы
+ORIGINAL_SIZE = "original"
+
+# Манифест порядка страниц: идентификатор точки Qdrant -> файл страницы
+PAGES_MANIFEST = "pages_manifest.json"
+
+MEDIA_TYPES = {
+    ".png": "image/png",
+    ".webp": "image/webp",
+    ".jpg": "image/jpeg",
+    ".jpeg": "image/jpeg",
+}
+
+
+# Манифест дописывают очередь загрузки и сервис поиска из разных потоков
+_MANIFEST_LOCK = threading.Lock()
+
+
+def _extension(image_format: str) -> str:
+    return {"JPEG": ".jpg"}.get(image_format, f".{image_format.lower()}")
+
+
+class PageStore:
+    """
+    Запись и открытие изображений страниц.
+
+    Attributes:
+        directory (str): Директория со страницами
+        image_format (str): Формат записи (WEBP, JPEG, PNG)
+        quality (int): Качество сжатия для WEBP и JPEG
+        images_config (PageImagesConfig): Размеры и формат уменьшенных копий
+    """
+
+    def __init__(
+        self,
+        directory: str,
+        image_format: str = "WEBP",
+        quality: int = 90,
+        images_config: Optional[PageImagesConfig] = None
+    ):
+        self.directory = directory
+        self.image_format = image_format.upper()
+        self.quality = quality
+        self.images_config = images_config or PageImagesConfig()
+        self._rendition_lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+    @property
+    def extension(self) -> str:
+        return _extension(self.image_format)
+
+    @property
+    def sizes(self) -> Dict[str, int]:
+        return self.images_config.sizes
+
+    def page_filename(self, document_name: str, page_number: int) -> str:
+        """
+        Имя файла страницы в принятом в наборе данных формате <документ>_page_<N>
+        """
+        return f"{document_name}_page_{page_number}{self.extension}"
+
+    def save(self, image: Image.Image, filename: str) -> str:
+        """
+        Запись страницы через временный файл (читатели не видят недописанных файлов)
+
+        Args:
+            image (Image.Image): Изображение страницы
+            filename (str): Имя файла в хранилище
+
+        Returns:
+            str: Полный путь к файлу
+        """
+        path = os.path.join(self.directory, filename)
+        tmp_path = f"{path}.tmp"
+        params = {"quality": self.quality} if self.image_format in ("WEBP", "JPEG") else {}
+        image.convert("RGB").save(tmp_path, format=self.image_format, **params)
+        os.replace(tmp_path, path)
+        return path
+
+    def _rendition_path(self, filename: str, size: str) -> str:
+        name = os.path.splitext(filename)[0] + _extension(self.images_config.image_format.upper())
+        return os.path.join(self.directory, size, name)
+
+    def save_renditions(self, image: Image.Image, filename: str):
+        """
+        Запись уменьшенных копий страницы всех настроенных размеров
+
+        Args:
+            image (Image.Image): Изображение страницы
+            filename (str): Имя файла страницы в хранилище
+        """
+        image_format = self.images_config.image_format.upper()
+        params = {"quality": self.images_config.quality} if image_format in ("WEBP", "JPEG") else {}
+        # От большего размера к меньшему: каждая копия уменьшается из предыдущей
+        source = image.convert("RGB")
+        for size, max_side in sorted(self.sizes.items(), key=lambda item: -item[1]):
+            source = source.copy()
+            source.thumbnail((max_side, max_side), Image.LANCZOS, reducing_gap=2.0)
+            path = self._rendition_path(filename, size)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp_path = f"{path}.tmp"
+            source.save(tmp_path, format=image_format, **params)
+            os.replace(tmp_path, path)
+
+    def image_path(self, filename: str, size: str = ORIGINAL_SIZE) -> str:
+        """
+        Путь к изображению страницы нужного размера
+
+        Недостающие уменьшенные копии (страницы, загруженные до их появления)
+        создаются один раз при первом обращении.
+
+        Args:
+            filename (str): Имя файла страницы в хранилище
+            size (str): "original" или имя размера из PageImagesConfig.sizes
+
+        Returns:
+            str: Полный путь к файлу
+        """
+        if size == ORIGINAL_SIZE:
+            return os.path.join(self.directory, filename)
+        if size not in self.sizes:
+            raise KeyError(f"Неизвестный размер изображения: {size}")
+
+        path = self._rendition_path(filename, size)
+        if not os.path.exists(path):
+            with self._rendition_lock:
+                if not os.path.exists(path):
+                    with Image.open(os.path.join(self.directory, filename)) as image:
+                        self.save_renditions(image, filename)
+        return path
+
+    def etag(self, filename: str, size: str = ORIGINAL_SIZE) -> str:
+        """
+        Версия изображения для ETag и адресов в выдаче
+
+        Зависит от исходного файла страницы и настроек копии, а не от самой
+        копии, поэтому вычисляется без ее создания.
+        """
+        stat = os.stat(os.path.join(self.directory, filename))
+        settings = "" if size == ORIGINAL_SIZE else \
+            f"{self.sizes.get(size)}:{self.images_config.image_format}:{self.images_config.quality}"
+        key = f"{filename}:{stat.st_size}:{stat.st_mtime_ns}:{size}:{settings}"
+        return hashlib.sha1(key.encode("utf-8")).hexdigest()[:16]
+
+    def delete(self, filename: str):
+        """
+        Удаление страницы и всех ее уменьшенных копий
+        """
+        paths = [os.path.join(self.directory, filename)]
+        paths += [self._rendition_path(filename, size) for size in self.sizes]
+        for path in paths:
+            if os.path.exists(path):
+                os.remove(path)
+
+    @property
+    def manifest_path(self) -> str:
+        return os.path.join(self.directory, PAGES_MANIFEST)
+
+    def _read_manifest(self) -> Dict[str, str]:
+        if not os.path.exists(self.manifest_path):
+            return {}
+        with open(self.manifest_path, encoding="utf-8") as f:
+            return json.load(f)["pages"]
+
+    def _write_manifest(self, pages: Dict[str, str]):
+        tmp_path = f"{self.manifest_path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"pages": pages}, f, ensure_ascii=False)
+        os.replace(tmp_path, self.manifest_path)
+
+    def record_pages(self, pages: Dict[int, str]):
+        """
+        Запись идентификаторов точек новых страниц в манифест порядка
+
+        Идентификатор точки - позиция страницы в наборе данных, а файлы
+        директории читаются в произвольном порядке, поэтому без записи
+        в манифесте после перезапуска точка указывала бы на чужую страницу.
+
+        Args:
+            pages (dict): Идентификатор точки -> файл страницы
+        """
+        with _MANIFEST_LOCK:
+            manifest = self._read_manifest()
+            manifest.update({str(point_id): filename for point_id, filename in pages.items()})
+            self._write_manifest(manifest)
+
+    def forget_pages(self, point_ids: Iterable[int]):
+        """
+        Удаление из манифеста страниц, точки которых удалены
+        """
+        with _MANIFEST_LOCK:
+            manifest = self._read_manifest()
+            for point_id in point_ids:
+                manifest.pop(str(point_id), None)
+            self._write_manifest(manifest)
+
+    def pin_order(self, dataset: List[Image.Image]):
+        """
+        Закрепление текущего порядка набора данных, если манифеста еще нет
+
+        Индекс архива строится по тому же порядку файлов, поэтому при первом
+        запуске он записывается в манифест до того, как новые страницы
+        изменят содержимое директории.
+        """
+        with _MANIFEST_LOCK:
+            if os.path.exists(self.manifest_path):
+                return
+            self._write_manifest({
+                str(point_id): image.filename
+                for point_id, image in enumerate(dataset)
+                if getattr(image, "filename", None)
+            })
+
+    @staticmethod
+    def media_type(path: str) -> str:
+        return MEDIA_TYPES.get(os.path.splitext(path)[1].lower(), "application/octet-stream")
+
+    def open(self, filename: str, page_number: int = None) -> Image.Image:
+        """
+        Ленивое открытие страницы с метаданными, как в DocumentDataPreparer
+        """
+        image = Image.open(os.path.join(self.directory, filename))
+        image.filename = filename
+        image.page_number = page_number
+        return image
+
+
+def main():
+    """
+    Создание недостающих уменьшенных копий для всех страниц директории
+    """
+    directory = sys.argv[1] if len(sys.argv) > 1 else "data/prepared_data/"
+    store = PageStore(directory)
+    filenames = [name for name in os.listdir(directory) if name.lower().endswith(PAGE_EXTENSIONS)]
+    for i, filename in enumerate(filenames, 1):
+        for size in store.sizes:
+            store.image_path(filename, size)
+        if i % 100 == 0:
+            print(f"Обработано страниц: {i}/{len(filenames)}")
+    print(f"Готово: {len(filenames)} страниц")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,251 @@
+"""
+Параллельное кодирование страниц в нескольких процессах на CPU.
+
+На узлах без GPU одна копия ColQwen2 не загружает все ядра: при небольших
+батчах внутрипоточный параллелизм torch масштабируется плохо. Поэтому
+страницы кодируются N процессами-воркерами, у каждого своя копия модели,
+фиксированное число потоков torch и собственный набор ядер (affinity),
+чтобы воркеры не вытесняли друг друга. Батчи формирует родительский
+процесс (AdaptiveBatcher) и раздает их через общую очередь: воркер берет
+следующий батч, как только освободится, поэтому страницы разного размера
+не приводят к простою. Пиксели страниц передаются через разделяемую
+память, а не pickle через очередь, поэтому родительский процесс не
+становится узким местом при росте числа воркеров. Эмбеддинги
+возвращаются в родительский процесс, который остается единственным
+писателем в Qdrant.
+
+Модель воркера создает загрузчик encoder_factory - picklable вызываемый
+объект без аргументов, возвращающий (модель, процессор), например
+functools.partial(colqwen2_cpu_encoder, model_name). Бенчмарки передают
+загрузчик CPU-заглушки из src.benchmarks.
+"""
+
+import multiprocessing as mp
+import os
+import queue
+import time
+from typing import Callable, Iterable, Iterator, List, Optional, Tuple
+
+import numpy as np
+import torch
+from PIL import Image
+
+from src.utils import from_shared_memory, to_shared_memory
+
+# Атрибуты страницы, которые передаются вместе с пикселями: они нужны энкодеру
+_PAGE_ATTRIBUTES = ("filename", "page_number", "text")
+
+
+def cpu_shards(workers: int, threads_per_worker: Optional[int] = None) -> List[List[int]]:
+    """
+    Разбиение доступных процессу ядер на непересекающиеся наборы для воркеров
+
+    Args:
+        workers (int): Число воркеров
+        threads_per_worker (int, optional): Ядер на воркер (по умолчанию поровну)
+
+    Returns:
+        List[List[int]]: Номера ядер каждого воркера
+    """
+    if hasattr(os, "sched_getaffinity"):
+        cores = sorted(os.sched_getaffinity(0))
+    else:
+        cores = list(range(os.cpu_count() or 1))
+    per_worker = threads_per_worker or max(1, len(cores) // workers)
+    return [
+        [cores[(i * per_worker + j) % len(cores)] for j in range(per_worker)]
+        for i in range(workers)
+    ]
+
+
+def colqwen2_cpu_encoder(model_name: str) -> tuple:
+    """
+    Загрузчик ColQwen2 на CPU для воркеров (используется по умолчанию)
+
+    Args:
+        model_name (str): Идентификатор модели ColQwen2
+
+    Returns:
+        tuple: Модель и процессор
+    """
+    from colpali_engine.models import ColQwen2, ColQwen2Processor
+    model = ColQwen2.from_pretrained(model_name, torch_dtype=torch.float32, device_map="cpu").eval()
+    return model, ColQwen2Processor.from_pretrained(model_name)
+
+
+def _send_page(image: Image.Image) -> tuple:
+    mode = image.mode if image.mode in ("RGB", "L") else "RGB"
+    attributes = {name: getattr(image, name) for name in _PAGE_ATTRIBUTES if hasattr(image, name)}
+    return to_shared_memory(np.asarray(image.convert(mode))), mode, attributes
+
+
+def _receive_page(page: tuple) -> Image.Image:
+    descriptor, mode, attributes = page
+    image = Image.fromarray(from_shared_memory(descriptor, unlink=True), mode=mode)
+    for name, value in attributes.items():
+        setattr(image, name, value)
+    return image
+
+
+def _worker_main(encoder_factory: Callable[[], tuple], max_image_tokens: Optional[int], cores: List[int], tasks, results):
+    """
+    Цикл воркера: батч из очереди задач -> эмбеддинги в очередь результатов
+    """
+    from src.batching import AdaptiveBatcher
+
+    if hasattr(os, "sched_setaffinity"):
+        os.sched_setaffinity(0, cores)
+    torch.set_num_threads(len(cores))
+    torch.set_num_interop_threads(1)
+
+    model, processor = encoder_factory()
+    # Размер батча задает родительский процесс, здесь батч кодируется целиком
+    batcher = AdaptiveBatcher(model, processor, token_budget=1 << 30, max_image_tokens=max_image_tokens)
+    results.put(("ready", None))
+
+    while True:
+        task = tasks.get()
+        if task is None:
+            return
+        batch_number, pages = task
+        try:
+            images = [_receive_page(page) for page in pages]
+            embeddings = batcher.encode(images)
+            results.put((batch_number, [embedding.float().numpy() for embedding in embeddings]))
+        except Exception as e:
+            results.put((batch_number, RuntimeError(f"Ошибка кодирования в воркере: {e}")))
+
+
+class ParallelPageEncoder:
+    """
+    Пул процессов-воркеров с копиями энкодера.
+
+    Использование:
+        with ParallelPageEncoder(partial(colqwen2_cpu_encoder, model_name), workers=4) as encoder:
+            for batch, embeddings in encoder.map(batches):
+                ...
+    """
+
+    # Сколько батчей на воркер держать в очереди: воркер не ждет следующий батч,
+    # а родительский процесс не держит в памяти весь набор страниц
+    PREFETCH_PER_WORKER = 2
+    # Период проверки, что воркеры живы, пока нет результатов
+    POLL_SECONDS = 5.0
+
+    def __init__(
+        self,
+        encoder_factory: Callable[[], tuple],
+        workers: int,
+        threads_per_worker: Optional[int] = None,
+        max_image_tokens: Optional[int] = None
+    ):
+        """
+        Args:
+            encoder_factory (Callable): Загрузчик (модель, процессор) в воркере;
+                должен передаваться в spawn-процесс (функция модуля или partial)
+            workers (int): Число процессов
+            threads_per_worker (int, optional): Потоков torch и ядер на воркер
+                (по умолчанию доступные ядра делятся поровну)
+            max_image_tokens (int, optional): Бюджет визуальных токенов на страницу
+        """
+        self.encoder_factory = encoder_factory
+        self.workers = max(1, workers)
+        self.shards = cpu_shards(self.workers, threads_per_worker)
+        self.max_image_tokens = max_image_tokens
+        # spawn: fork процесса с инициализированным torch и потоками небезопасен
+        self._context = mp.get_context("spawn")
+        self._tasks = self._context.Queue()
+        self._results = self._context.Queue()
+        self._processes: List[mp.Process] = []
+        # Время запуска воркеров и загрузки моделей, не входит в кодирование
+        self.startup_seconds = 0.0
+
+    def __enter__(self) -> "ParallelPageEncoder":
+        self.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def start(self):
+        start = time.perf_counter()
+        for i, cores in enumerate(self.shards):
+            process = self._context.Process(
+                target=_worker_main,
+                args=(self.encoder_factory, self.max_image_tokens, cores, self._tasks, self._results),
+                name=f"encoder-worker-{i}",
+                daemon=True
+            )
+            process.start()
+            self._processes.append(process)
+        for _ in self._processes:
+            self._get_result()
+        self.startup_seconds = time.perf_counter() - start
+        print(f"Воркеров кодирования: {self.workers}, ядра: {self.shards}, запуск: {self.startup_seconds:.1f} с")
+
+    def _get_result(self) -> tuple:
+        while True:
+            try:
+                return self._results.get(timeout=self.POLL_SECONDS)
+            except queue.Empty:
+                dead = [process.name for process in self._processes if not process.is_alive()]
+                if dead:
+                    raise RuntimeError(f"Воркеры кодирования завершились: {', '.join(dead)}")
+
+    def map(
+        self,
+        batches: Iterable[List[Tuple[int, Image.Image]]]
+    ) -> Iterator[Tuple[List[Tuple[int, Image.Image]], List[torch.Tensor]]]:
+        """
+        Кодирование батчей в воркерах; результаты отдаются по мере готовности,
+        не обязательно в исходном порядке
+
+        Args:
+            batches (Iterable): Батчи пар (идентификатор, изображение)
+
+        Yields:
+            tuple: Батч и мультивекторы его страниц
+        """
+        window = self.workers * self.PREFETCH_PER_WORKER
+        submitted = {}
+        batches = iter(batches)
+        exhausted = False
+        batch_number = 0
+
+        while True:
+            while not exhausted and len(submitted) < window:
+                batch = next(batches, None)
+                if batch is None:
+                    exhausted = True
+                    break
+                self._tasks.put((batch_number, [_send_page(image) for _, image in batch]))
+                submitted[batch_number] = batch
+                batch_number += 1
+
+            if not submitted:
+                return
+
+            number, embeddings = self._get_result()
+            batch = submitted.pop(number)
+            if isinstance(embeddings, Exception):
+                raise embeddings
+            yield batch, [torch.from_numpy(embedding) for embedding in embeddings]
+
+    def close(self):
+        # Сегменты страниц, которые не успели забрать воркеры, удаляет родитель
+        while True:
+            try:
+                task = self._tasks.get_nowait()
+            except queue.Empty:
+                break
+            if task is not None:
+                for descriptor, _, _ in task[1]:
+                    from_shared_memory(descriptor, unlink=True)
+        for process in self._processes:
+            if process.is_alive():
+                self._tasks.put(None)
+        for process in self._processes:
+            process.join(timeout=30)
+            if process.is_alive():
+                process.terminate()
+        self._processes = []
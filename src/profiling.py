@@ -0,0 +1,209 @@
+"""
+Трассировка этапов запроса и профилирование отдельных запросов.
+
+Каждый HTTP запрос получает RequestTrace в contextvar; этапы в коде
+оборачиваются в span(...), и их длительности возвращаются клиенту в
+заголовке Server-Timing. Вне запроса span ничего не делает.
+
+По заголовку X-Profile (только с верным X-Admin-Token) для одного запроса
+дополнительно снимается сэмплирующий профиль потоков, участвующих в запросе
+(в формате folded stacks для flamegraph.pl / speedscope), и по желанию
+трасса torch.profiler в формате Chrome trace.
+"""
+
+import contextvars
+import os
+import sys
+import threading
+import time
+import uuid
+from collections import Counter
+from typing import Dict, List, Optional, Set, Tuple
+
+from configs.service_config import ProfilingConfig
+
+_current_trace: contextvars.ContextVar = contextvars.ContextVar("request_trace", default=None)
+
+
+class RequestTrace:
+    """
+    Длительности этапов одного запроса.
+
+    Attributes:
+        request_id (str): Идентификатор запроса
+        spans (list): Пары (этап, длительность в секундах) в порядке завершения
+        threads (set): Идентификаторы потоков, выполнявших этапы запроса
+    """
+
+    def __init__(self, request_id: Optional[str] = None):
+        self.request_id = request_id or uuid.uuid4().hex[:12]
+        self.start = time.perf_counter()
+        self.spans: List[Tuple[str, float]] = []
+        self.threads: Set[int] = {threading.get_ident()}
+        self._lock = threading.Lock()
+
+    def add(self, name: str, duration: float):
+        with self._lock:
+            self.spans.append((name, duration))
+            self.threads.add(threading.get_ident())
+
+    def totals(self) -> Dict[str, float]:
+        """
+        Суммарная длительность по этапам (этап может встречаться несколько раз)
+        """
+        totals: Dict[str, float] = {}
+        with self._lock:
+            for name, duration in self.spans:
+                totals[name] = totals.get(name, 0.0) + duration
+        return totals
+
+    def server_timing(self) -> str:
+        """
+        Значение заголовка Server-Timing в миллисекундах
+        """
+        parts = [f"{name};dur={duration * 1000:.1f}" for name, duration in self.totals().items()]
+        parts.append(f"total;dur={(time.perf_counter() - self.start) * 1000:.1f}")
+        return ", ".join(parts)
+
+
+class span:
+    """
+    Контекстный менеджер этапа запроса; без активной трассы - пустая операция
+    """
+
+    __slots__ = ("name", "trace", "start")
+
+    def __init__(self, name: str):
+        self.name = name
+
+    def __enter__(self):
+        self.trace = _current_trace.get()
+        if self.trace is not None:
+            self.trace.threads.add(threading.get_ident())
+            self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if self.trace is not None:
+            self.trace.add(self.name, time.perf_counter() - self.start)
+        return False
+
+
+def current_trace() -> Optional[RequestTrace]:
+    return _current_trace.get()
+
+
+class SamplingProfiler:
+    """
+    Сэмплирующий профилировщик на sys._current_frames.
+
+    Фоновый поток с заданным интервалом снимает стеки потоков трассы
+    и копит их в виде folded stacks ("a;b;c count").
+    """
+
+    def __init__(self, trace: RequestTrace, interval: float = 0.005):
+        self.trace = trace
+        self.interval = interval
+        self.stacks: Counter = Counter()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="sampling-profiler", daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self):
+        own_ident = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            frames = sys._current_frames()
+            for ident in list(self.trace.threads):
+                frame = frames.get(ident)
+                if frame is None or ident == own_ident:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})")
+                    frame = frame.f_back
+                self.stacks[";".join(reversed(stack))] += 1
+
+    def save(self, path: str):
+        with open(path, "w", encoding="utf-8") as f:
+            for stack, count in self.stacks.most_common():
+                f.write(f"{stack} {count}\n")
+
+
+class TracingMiddleware:
+    """
+    ASGI middleware: трасса на каждый запрос, заголовок Server-Timing
+    и профилирование по запросу администратора
+    """
+
+    def __init__(self, app, config: ProfilingConfig):
+        self.app = app
+        self.config = config
+
+    def _profile_mode(self, scope) -> Optional[str]:
+        if not self.config.admin_token:
+            return None
+        headers = dict(scope.get("headers") or [])
+        mode = headers.get(b"x-profile", b"").decode("latin-1").lower()
+        token = headers.get(b"x-admin-token", b"").decode("latin-1")
+        if mode in ("sampling", "torch") and token == self.config.admin_token:
+            return mode
+        return None
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        trace = RequestTrace()
+        token = _current_trace.set(trace)
+        profile_mode = self._profile_mode(scope)
+        profile_path = None
+        if profile_mode:
+            os.makedirs(self.config.output_directory, exist_ok=True)
+            name = f"{time.strftime('%Y%m%d-%H%M%S')}_{trace.request_id}"
+            profile_path = os.path.join(
+                self.config.output_directory,
+                f"{name}.json" if profile_mode == "torch" else f"{name}.folded"
+            )
+
+        async def send_with_timing(message):
+            if message["type"] == "http.response.start":
+                headers = list(message.get("headers", []))
+                headers.append((b"server-timing", trace.server_timing().encode("latin-1")))
+                headers.append((b"x-request-id", trace.request_id.encode("latin-1")))
+                if profile_path:
+                    headers.append((b"x-profile-path", profile_path.encode("utf-8")))
+                message = {**message, "headers": headers}
+            await send(message)
+
+        profiler = None
+        torch_profiler = None
+        if profile_mode == "sampling":
+            profiler = SamplingProfiler(trace, self.config.sample_interval_ms / 1000)
+            profiler.start()
+        elif profile_mode == "torch":
+            import torch
+
+            activities = [torch.profiler.ProfilerActivity.CPU]
+            if torch.cuda.is_available():
+                activities.append(torch.profiler.ProfilerActivity.CUDA)
+            torch_profiler = torch.profiler.profile(activities=activities, record_shapes=True)
+            torch_profiler.__enter__()
+
+        try:
+            await self.app(scope, receive, send_with_timing)
+        finally:
+            _current_trace.reset(token)
+            if profiler is not None:
+                profiler.stop()
+                profiler.save(profile_path)
+            if torch_profiler is not None:
+                torch_profiler.__exit__(None, None, None)
+                torch_profiler.export_chrome_trace(profile_path)
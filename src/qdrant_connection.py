@@ -0,0 +1,188 @@
+"""
+Создание клиентов Qdrant по QdrantConfig и повторы запросов при недоступности.
+
+gRPC используется по умолчанию: один HTTP/2 канал мультиплексирует все
+запросы и сам переподключается после перезапуска Qdrant, keepalive
+обнаруживает разорванные соединения. Для REST размер пула и keepalive
+задаются через httpx.Limits. Запросы, упавшие из-за недоступности сервера,
+повторяются с экспоненциальной паузой и случайным разбросом.
+
+Здесь же общие для индексатора и пакета индекса операции с алиасами.
+"""
+
+import asyncio
+import random
+import time
+from typing import Awaitable, Callable, Optional, TypeVar
+
+import httpx
+from qdrant_client import AsyncQdrantClient, QdrantClient
+from qdrant_client.http import models
+from qdrant_client.http.exceptions import ResponseHandlingException, UnexpectedResponse
+
+from configs.service_config import QdrantConfig
+
+T = TypeVar("T")
+
+# HTTP статусы, при которых запрос имеет смысл повторить
+_RETRYABLE_STATUSES = {502, 503, 504}
+
+
+def _client_kwargs(config: QdrantConfig) -> dict:
+    return dict(
+        host=config.host,
+        port=config.port,
+        grpc_port=config.grpc_port,
+        prefer_grpc=config.prefer_grpc,
+        timeout=config.timeout,
+        grpc_options={
+            "grpc.keepalive_time_ms": config.keepalive_seconds * 1000,
+            "grpc.keepalive_timeout_ms": config.timeout * 1000,
+            "grpc.keepalive_permit_without_calls": 1,
+            "grpc.http2.max_pings_without_data": 0,
+            "grpc.enable_retries": 1,
+        },
+        limits=httpx.Limits(
+            max_connections=config.pool_size,
+            max_keepalive_connections=config.pool_size,
+            keepalive_expiry=config.keepalive_seconds,
+        ),
+    )
+
+
+def create_qdrant_client(config: QdrantConfig) -> QdrantClient:
+    """
+    Синхронный клиент Qdrant (индексация, фоновые задачи)
+    """
+    return QdrantClient(**_client_kwargs(config))
+
+
+def create_async_qdrant_client(config: QdrantConfig) -> AsyncQdrantClient:
+    """
+    Асинхронный клиент Qdrant для обработки запросов без занятия потоков.
+    Создавать внутри работающего event loop: к нему привязывается gRPC канал.
+    """
+    return AsyncQdrantClient(**_client_kwargs(config))
+
+
+def is_retryable(error: Exception) -> bool:
+    """
+    Ошибка вызвана недоступностью Qdrant, а не некорректным запросом
+    """
+    if isinstance(error, (ResponseHandlingException, httpx.TransportError, ConnectionError)):
+        return True
+    if isinstance(error, UnexpectedResponse):
+        return error.status_code in _RETRYABLE_STATUSES
+    try:
+        import grpc
+    except ImportError:
+        return False
+    if isinstance(error, grpc.RpcError):
+        return error.code() in (grpc.StatusCode.UNAVAILABLE, grpc.StatusCode.DEADLINE_EXCEEDED)
+    return False
+
+
+def _backoff(config: QdrantConfig, attempt: int) -> float:
+    delay = min(config.backoff_max, config.backoff_base * (2 ** attempt))
+    return delay * random.uniform(0.5, 1.0)
+
+
+def call_with_retries(func: Callable[[], T], config: QdrantConfig) -> T:
+    """
+    Вызов синхронного запроса к Qdrant с повторами
+
+    Args:
+        func (Callable): Функция без аргументов, выполняющая запрос
+        config (QdrantConfig): Параметры повторов
+
+    Returns:
+        Результат func
+    """
+    for attempt in range(config.max_retries + 1):
+        try:
+            return func()
+        except Exception as e:
+            if attempt == config.max_retries or not is_retryable(e):
+                raise
+            delay = _backoff(config, attempt)
+            print(f"Qdrant недоступен ({e}), повтор через {delay:.2f} с")
+            time.sleep(delay)
+
+
+async def async_call_with_retries(func: Callable[[], Awaitable[T]], config: QdrantConfig) -> T:
+    """
+    Вызов асинхронного запроса к Qdrant с повторами
+
+    Args:
+        func (Callable): Функция без аргументов, возвращающая корутину запроса
+        config (QdrantConfig): Параметры повторов
+
+    Returns:
+        Результат корутины
+    """
+    for attempt in range(config.max_retries + 1):
+        try:
+            return await func()
+        except Exception as e:
+            if attempt == config.max_retries or not is_retryable(e):
+                raise
+            delay = _backoff(config, attempt)
+            print(f"Qdrant недоступен ({e}), повтор через {delay:.2f} с")
+            await asyncio.sleep(delay)
+
+
+def alias_target(client: QdrantClient, alias: str) -> Optional[str]:
+    """
+    Коллекция, на которую указывает алиас, или None, если алиаса нет
+    """
+    for description in client.get_aliases().aliases:
+        if description.alias_name == alias:
+            return description.collection_name
+    return None
+
+
+def resolve_collection(client: QdrantClient, name: str) -> str:
+    """
+    Имя коллекции, на которую указывает алиас (или само имя)
+    """
+    return alias_target(client, name) or name
+
+
+def check_alias_name(client: QdrantClient, alias: str):
+    """
+    Проверка, что имя алиаса не занято обычной коллекцией
+
+    Удаление коллекции и создание алиаса в Qdrant не объединяются в одну
+    операцию: между ними поиск остался бы без индекса, поэтому такая
+    замена выполняется вручную, а не автоматически.
+
+    Raises:
+        RuntimeError: alias - имя обычной коллекции
+    """
+    if alias_target(client, alias) is None and client.collection_exists(alias):
+        raise RuntimeError(
+            f"{alias} - коллекция, а не алиас. Мигрируйте вручную в окно обслуживания: "
+            f"удалите коллекцию {alias} и повторите операцию, либо используйте другое имя алиаса"
+        )
+
+
+def switch_alias(client: QdrantClient, alias: str, collection_name: str):
+    """
+    Атомарное переключение алиаса на collection_name
+
+    Удаление старого алиаса и создание нового выполняются одной операцией
+    update_collection_aliases. Обычная коллекция с именем алиаса не удаляется
+    (см. check_alias_name).
+
+    Raises:
+        RuntimeError: alias - имя обычной коллекции (нужна ручная миграция)
+    """
+    check_alias_name(client, alias)
+    current = alias_target(client, alias)
+    operations = []
+    if current is not None:
+        operations.append(models.DeleteAliasOperation(delete_alias=models.DeleteAlias(alias_name=alias)))
+    operations.append(models.CreateAliasOperation(
+        create_alias=models.CreateAlias(collection_name=collection_name, alias_name=alias)
+    ))
+    client.update_collection_aliases(change_aliases_operations=operations)
@@ -0,0 +1,131 @@
+"""
+Прореживание токенов запроса перед MaxSim.
+
+Qdrant считает MaxSim как сумму по векторам запроса максимумов сходства
+с векторами страницы, поэтому время запроса растет линейно с их числом.
+Часть векторов ColQwen2 почти не влияет на ранжирование: паддинг батча,
+служебный префикс ("Query: ") и augmentation-токены, которыми процессор
+дополняет короткие запросы. Правила включаются по отдельности, а при
+ограничении max_tokens отбрасываются токены, наиболее похожие на уже
+оставленные: их максимумы по странице почти совпадают.
+
+Правила в бенчмарках задаются строкой, например "padding+augmentation+max16".
+"""
+
+from typing import Optional
+
+import torch
+
+from configs.service_config import QueryPruningConfig
+from src.metrics import QUERY_TOKENS
+
+
+def parse_pruning_spec(spec: str) -> Optional[QueryPruningConfig]:
+    """
+    Конфигурация прореживания из строки правил через "+"
+
+    Правила: padding, augmentation, prefix<N>, norm<X>, max<N>; "none" - без прореживания.
+
+    Args:
+        spec (str): Строка правил, например "padding+prefix3+max16"
+
+    Returns:
+        QueryPruningConfig: Конфигурация или None для "none"
+    """
+    if spec in ("", "none"):
+        return None
+
+    config = QueryPruningConfig(enabled=True, drop_padding=False, drop_augmentation=False)
+    for rule in spec.split("+"):
+        if rule == "padding":
+            config.drop_padding = True
+        elif rule == "augmentation":
+            config.drop_augmentation = True
+        elif rule.startswith("prefix"):
+            config.prefix_tokens = int(rule[len("prefix"):])
+        elif rule.startswith("norm"):
+            config.min_norm = float(rule[len("norm"):])
+        elif rule.startswith("max"):
+            config.max_tokens = int(rule[len("max"):])
+        else:
+            raise ValueError(f"Неизвестное правило прореживания: {rule}")
+    return config
+
+
+def _diverse_subset(vectors: torch.Tensor, size: int) -> torch.Tensor:
+    """
+    Жадный отбор size наименее похожих друг на друга векторов
+
+    Начинает с самого нетипичного вектора и на каждом шаге добавляет тот,
+    чье максимальное сходство с уже отобранными минимально.
+
+    Returns:
+        torch.Tensor: Индексы отобранных векторов по возрастанию
+    """
+    normalized = torch.nn.functional.normalize(vectors, dim=-1)
+    similarity = normalized @ normalized.T
+    selected = [int(similarity.mean(dim=1).argmin())]
+    closest = similarity[selected[0]].clone()
+    closest[selected[0]] = float("inf")
+    while len(selected) < size:
+        index = int(closest.argmin())
+        selected.append(index)
+        closest = torch.maximum(closest, similarity[index])
+        closest[selected] = float("inf")
+    return torch.tensor(sorted(selected), dtype=torch.long)
+
+
+class QueryTokenPruner:
+    """
+    Прореживание мультивектора запроса по правилам QueryPruningConfig.
+    """
+
+    def __init__(self, config: QueryPruningConfig):
+        self.config = config
+
+    def prune(
+        self,
+        embedding: torch.Tensor,
+        attention_mask: Optional[torch.Tensor] = None,
+        input_ids: Optional[torch.Tensor] = None,
+        pad_token_id: Optional[int] = None
+    ) -> torch.Tensor:
+        """
+        Отбор векторов запроса
+
+        Если правила отбрасывают все токены, запрос возвращается без изменений.
+
+        Args:
+            embedding (torch.Tensor): Векторы токенов запроса (tokens, dim)
+            attention_mask (torch.Tensor, optional): Маска внимания (tokens,)
+            input_ids (torch.Tensor, optional): Идентификаторы токенов (tokens,)
+            pad_token_id (int, optional): Токен паддинга, он же augmentation-токен ColQwen2
+
+        Returns:
+            torch.Tensor: Оставленные векторы в исходном порядке
+        """
+        config = self.config
+        norms = embedding.norm(dim=-1)
+        keep = torch.ones(len(embedding), dtype=torch.bool)
+
+        if config.drop_padding:
+            keep &= norms > 0
+            if attention_mask is not None:
+                keep &= attention_mask.cpu().bool()
+        if config.drop_augmentation and input_ids is not None and pad_token_id is not None:
+            # Augmentation-токены совпадают с паддингом, но входят в маску внимания
+            keep &= input_ids.cpu() != pad_token_id
+        if config.prefix_tokens:
+            keep[:config.prefix_tokens] = False
+        if config.min_norm > 0:
+            keep &= norms >= config.min_norm
+
+        indices = keep.nonzero().squeeze(1)
+        if len(indices) == 0:
+            indices = torch.arange(len(embedding))
+        if config.max_tokens and len(indices) > config.max_tokens:
+            indices = indices[_diverse_subset(embedding[indices].float(), config.max_tokens)]
+
+        QUERY_TOKENS.labels(stage="raw").observe(len(embedding))
+        QUERY_TOKENS.labels(stage="pruned").observe(len(indices))
+        return embedding[indices]
@@ -0,0 +1,242 @@
+"""
+Ограничение частоты запросов и сброс нагрузки по приоритетам.
+
+Каждый клиент получает отдельные token bucket для дешевого поиска, дорогой
+генерации и загрузки документов. Помимо частоты ограничивается число
+одновременных запросов каждого класса: batch-запросы отбрасываются уже при
+заполнении доли batch_share предела, интерактивные - только при полном пределе.
+Отказы возвращаются с заголовком Retry-After.
+
+Клиент определяется по API-ключу из SecurityConfig.api_keys, без известного
+ключа - по IP-адресу: произвольный ключ не дает нового бюджета. Приоритет
+задается на сервере для клиента (client_priorities), а не заголовком запроса.
+"""
+
+import math
+import time
+from dataclasses import dataclass
+from typing import Dict, Optional, Tuple
+
+from starlette.responses import JSONResponse
+
+from configs.service_config import SecurityConfig
+from src.metrics import REJECTED_REQUESTS
+
+# Классы маршрутов (метод, путь): генерация на GPU на порядки дороже поиска,
+# загрузка документа занимает энкодер на все его страницы
+ROUTE_CLASSES = {
+    ("POST", "/search/documents"): "search",
+    ("POST", "/search/generate-response"): "generation",
+    ("POST", "/search/ask"): "generation",
+    ("POST", "/index/jobs"): "upload",
+    ("POST", "/index/documents"): "upload",
+}
+
+PRIORITIES = ("interactive", "batch")
+
+
+class TokenBucket:
+    """
+    Token bucket: rate токенов в секунду, не более capacity
+    """
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def try_acquire(self, cost: float = 1.0) -> Tuple[bool, float]:
+        """
+        Попытка списать токены
+
+        Args:
+            cost (float): Стоимость запроса в токенах
+
+        Returns:
+            tuple: Успех и через сколько секунд токенов станет достаточно
+        """
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+        if self.tokens >= cost:
+            self.tokens -= cost
+            return True, 0.0
+        return False, (cost - self.tokens) / self.rate
+
+    def is_idle(self) -> bool:
+        now = time.monotonic()
+        return self.tokens + (now - self.updated) * self.rate >= self.capacity
+
+
+@dataclass
+class Admission:
+    """
+    Решение о допуске запроса.
+
+    Attributes:
+        allowed (bool): Запрос допущен
+        route_class (str): Класс маршрута (search, generation) или None для прочих
+        status_code (int): Код ответа при отказе
+        retry_after (int): Значение Retry-After при отказе, в секундах
+        reason (str): Причина отказа (rate_limit, overload)
+    """
+    allowed: bool
+    route_class: Optional[str] = None
+    status_code: int = 200
+    retry_after: int = 0
+    reason: str = ""
+
+
+class AdmissionController:
+    """
+    Учет бюджетов клиентов и одновременных запросов по классам маршрутов.
+
+    Вызывается из middleware в event loop, поэтому обходится без блокировок.
+    """
+
+    # Раз в столько проверок удаляются полностью восполненные bucket
+    CLEANUP_INTERVAL = 1000
+
+    def __init__(self, config: SecurityConfig):
+        self.config = config
+        self.rates = {
+            "search": config.rate_limit / 60,
+            "generation": config.generation_rate_limit / 60,
+            "upload": config.upload_rate_limit / 60,
+        }
+        self.max_in_flight = {
+            "search": config.max_in_flight_search,
+            "generation": config.max_in_flight_generation,
+            "upload": config.max_in_flight_upload,
+        }
+        self.in_flight: Dict[str, int] = {route_class: 0 for route_class in self.rates}
+        self._buckets: Dict[Tuple[str, str], TokenBucket] = {}
+        self._checks = 0
+
+    def _bucket(self, client_key: str, route_class: str) -> TokenBucket:
+        key = (client_key, route_class)
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            rate = self.rates[route_class]
+            bucket = TokenBucket(rate, max(1.0, rate * self.config.burst_seconds))
+            self._buckets[key] = bucket
+        return bucket
+
+    def _cleanup(self):
+        self._checks += 1
+        if self._checks % self.CLEANUP_INTERVAL == 0:
+            self._buckets = {key: b for key, b in self._buckets.items() if not b.is_idle()}
+
+    def admit(self, method: str, path: str, client_key: str, priority: str) -> Admission:
+        """
+        Проверка бюджета клиента и загрузки сервиса
+
+        Args:
+            method (str): HTTP метод запроса
+            path (str): Путь запроса
+            client_key (str): Ключ клиента
+            priority (str): Класс приоритета (interactive, batch)
+
+        Returns:
+            Admission: Решение о допуске
+        """
+        route_class = ROUTE_CLASSES.get((method, path))
+        if route_class is None:
+            return Admission(allowed=True)
+
+        self._cleanup()
+
+        # Сначала загрузка: при перегрузке batch отбрасывается раньше интерактивных
+        limit = self.max_in_flight[route_class]
+        if priority == "batch":
+            limit = max(1, math.floor(limit * self.config.batch_share))
+        if self.in_flight[route_class] >= limit:
+            return Admission(
+                allowed=False,
+                route_class=route_class,
+                status_code=503,
+                retry_after=self.config.shed_retry_after,
+                reason="overload",
+            )
+
+        allowed, wait = self._bucket(client_key, route_class).try_acquire()
+        if not allowed:
+            return Admission(
+                allowed=False,
+                route_class=route_class,
+                status_code=429,
+                retry_after=max(1, math.ceil(wait)),
+                reason="rate_limit",
+            )
+
+        self.in_flight[route_class] += 1
+        return Admission(allowed=True, route_class=route_class)
+
+    def release(self, admission: Admission):
+        """
+        Освобождение слота после завершения запроса (включая потоковую отдачу)
+        """
+        if admission.allowed and admission.route_class is not None:
+            self.in_flight[admission.route_class] -= 1
+
+
+class RateLimitMiddleware:
+    """
+    ASGI middleware: слот освобождается только после отправки всего тела ответа,
+    поэтому потоковые ответы учитываются в загрузке до конца генерации.
+    """
+
+    def __init__(self, app, controller: AdmissionController):
+        self.app = app
+        self.controller = controller
+        self.client_key_header = controller.config.client_key_header.lower().encode("latin-1")
+
+    def _client_and_priority(self, scope) -> Tuple[str, str]:
+        """
+        Клиент по известному API-ключу (иначе IP-адрес) и его приоритет из конфигурации
+        """
+        config = self.controller.config
+        headers = dict(scope.get("headers") or [])
+        api_key = headers.get(self.client_key_header, b"").decode("latin-1")
+        name = config.api_keys.get(api_key) if api_key else None
+        if name is not None:
+            client_key = f"key:{name}"
+        else:
+            client = scope.get("client")
+            client_key = f"ip:{client[0]}" if client else "unknown"
+
+        priority = config.client_priorities.get(name, config.default_priority) if name \
+            else config.default_priority
+        if priority not in PRIORITIES:
+            priority = "interactive"
+        return client_key, priority
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        client_key, priority = self._client_and_priority(scope)
+        admission = self.controller.admit(scope["method"], scope["path"], client_key, priority)
+
+        if not admission.allowed:
+            REJECTED_REQUESTS.labels(
+                route_class=admission.route_class,
+                reason=admission.reason,
+                priority=priority,
+            ).inc()
+            response = JSONResponse(
+                {"detail": "Слишком много запросов" if admission.reason == "rate_limit"
+                 else "Сервис перегружен, повторите позже"},
+                status_code=admission.status_code,
+                headers={"Retry-After": str(admission.retry_after)},
+            )
+            await response(scope, receive, send)
+            return
+
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            self.controller.release(admission)
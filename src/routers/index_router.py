@@ -0,0 +1,244 @@
+from fastapi import APIRouter, Depends, File, HTTPException, Query, Request, UploadFile
+from fastapi.responses import StreamingResponse
+import asyncio
+import hmac
+import json
+import shutil
+from typing import Optional
+
+from configs.service_config import IngestionConfig
+from src.ingestion import FINISHED_STATUSES, IngestionJob, IngestionQueue, QuotaExceededError
+from src.metrics import ERRORS
+from src.routers.search_router import request_tenant, search_service, tenant_config
+from src.tenants import GLOBAL_TENANT, validate_tenant
+
+# Инициализация роутера и очереди загрузки поверх индексатора сервиса поиска
+index_router = APIRouter(prefix="/index", tags=["index"])
+ingestion_config = IngestionConfig()
+ingestion_queue = IngestionQueue(search_service.indexer, ingestion_config, tenant_config=tenant_config)
+
+# Период опроса прогресса задачи для потоковой выдачи
+PROGRESS_INTERVAL = 0.5
+
+
+def _save_upload(upload: UploadFile, path: str):
+    with open(path, "wb") as f:
+        shutil.copyfileobj(upload.file, f, length=1024 * 1024)
+
+
+def request_admin(request: Request) -> bool:
+    """
+    Запрос администратора индекса: заголовок TenantConfig.admin_header
+    совпадает с настроенным токеном (без токена администратора нет)
+    """
+    token = request.headers.get(tenant_config.admin_header, "")
+    return bool(tenant_config.admin_token) and hmac.compare_digest(token, tenant_config.admin_token)
+
+
+def _require_identity(tenant: Optional[str], admin: bool):
+    """
+    Запросы без арендатора (общий архив, задачи всех арендаторов) доступны только администратору
+    """
+    if tenant is None and not admin:
+        raise HTTPException(
+            status_code=401,
+            detail=f"Требуется заголовок {tenant_config.header} или токен администратора"
+        )
+
+
+def _visible_job(job_id: str, tenant: Optional[str], admin: bool) -> IngestionJob:
+    """
+    Задача, видимая запросу: арендатор видит только свои задачи, администратор - все
+    """
+    _require_identity(tenant, admin)
+    job = ingestion_queue.get(job_id)
+    if job is None or (tenant is not None and job.tenant != tenant):
+        raise HTTPException(status_code=404, detail="Задача не найдена")
+    return job
+
+
+def _owned_tenant(tenant: str, request_tenant_id: Optional[str], admin: bool) -> str:
+    """
+    Раздел арендатора, которым может управлять запрос: свой раздел
+    или любой для администратора без заголовка арендатора
+    """
+    _require_identity(request_tenant_id, admin)
+    try:
+        validate_tenant(tenant)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if tenant == GLOBAL_TENANT:
+        raise HTTPException(status_code=400, detail="Общий архив не является разделом арендатора")
+    if request_tenant_id is not None and request_tenant_id != tenant:
+        raise HTTPException(status_code=403, detail="Доступ к разделу другого арендатора запрещен")
+    return tenant
+
+
+@index_router.post("/jobs", status_code=202)
+async def submit_job(
+    file: UploadFile = File(...),
+    tenant: Optional[str] = Depends(request_tenant),
+    admin: bool = Depends(request_admin)
+):
+    """
+    Эндпоинт загрузки PDF: файл сохраняется и ставится в очередь индексации
+    (с заголовком арендатора - в его раздел, без заголовка - в общий архив
+    по токену администратора)
+    """
+    _require_identity(tenant, admin)
+    if not (file.filename or "").lower().endswith(".pdf"):
+        raise HTTPException(status_code=400, detail="Поддерживаются только PDF файлы")
+
+    try:
+        path = ingestion_queue.upload_path(file.filename)
+        # Запись на диск в пуле потоков, чтобы не задерживать поисковые запросы
+        await asyncio.to_thread(_save_upload, file, path)
+        job = ingestion_queue.submit(path, file.filename, tenant=tenant or GLOBAL_TENANT)
+    except QuotaExceededError as e:
+        raise HTTPException(status_code=403, detail=str(e))
+    except OverflowError as e:
+        raise HTTPException(status_code=429, detail=str(e), headers={"Retry-After": "60"})
+    except RuntimeError as e:
+        raise HTTPException(status_code=503, detail=str(e))
+    except Exception as e:
+        ERRORS.labels(stage="ingestion").inc()
+        raise HTTPException(status_code=500, detail=str(e))
+
+    return job.to_dict()
+
+
+async def _job_events(job: IngestionJob):
+    """
+    NDJSON события прогресса задачи до ее завершения
+    """
+    last = None
+    while True:
+        state = job.to_dict()
+        if state != last:
+            yield json.dumps(state, ensure_ascii=False) + "\n"
+            last = state
+        if state["status"] in FINISHED_STATUSES:
+            return
+        await asyncio.sleep(PROGRESS_INTERVAL)
+
+
+@index_router.post("/documents", status_code=202)
+async def upload_document(
+    request: Request,
+    filename: str = Query(..., description="Имя PDF файла"),
+    wait: bool = Query(False, description="Отдавать прогресс потоком NDJSON до завершения"),
+    tenant: Optional[str] = Depends(request_tenant),
+    admin: bool = Depends(request_admin)
+):
+    """
+    Эндпоинт потоковой загрузки PDF телом запроса (application/pdf)
+
+    Документ принимается по частям в память, на диск пишутся только
+    сжатые изображения страниц. Растеризация, кодирование и upsert идут
+    конвейером в фоновом воркере. Права - как у /index/jobs.
+    """
+    _require_identity(tenant, admin)
+    if not filename.lower().endswith(".pdf"):
+        raise HTTPException(status_code=400, detail="Поддерживаются только PDF файлы")
+
+    max_bytes = ingestion_config.max_upload_mb * 1024 * 1024
+    data = bytearray()
+    async for chunk in request.stream():
+        data.extend(chunk)
+        if len(data) > max_bytes:
+            raise HTTPException(status_code=413, detail="Файл слишком большой")
+    if not data:
+        raise HTTPException(status_code=400, detail="Пустой файл")
+
+    try:
+        job = ingestion_queue.submit(None, filename, data=bytes(data), tenant=tenant or GLOBAL_TENANT)
+    except QuotaExceededError as e:
+        raise HTTPException(status_code=403, detail=str(e))
+    except OverflowError as e:
+        raise HTTPException(status_code=429, detail=str(e), headers={"Retry-After": "60"})
+    except RuntimeError as e:
+        raise HTTPException(status_code=503, detail=str(e))
+
+    if wait:
+        return StreamingResponse(_job_events(job), media_type="application/x-ndjson")
+    return job.to_dict()
+
+
+@index_router.get("/jobs")
+async def list_jobs(tenant: Optional[str] = Depends(request_tenant), admin: bool = Depends(request_admin)):
+    """
+    Эндпоинт списка задач индексации (новые первыми): задачи арендатора
+    или все задачи для администратора
+    """
+    _require_identity(tenant, admin)
+    return [job.to_dict() for job in ingestion_queue.jobs(tenant)]
+
+
+@index_router.get("/jobs/{job_id}")
+async def get_job(
+    job_id: str,
+    tenant: Optional[str] = Depends(request_tenant),
+    admin: bool = Depends(request_admin)
+):
+    """
+    Эндпоинт прогресса задачи: страницы, страниц в секунду, оставшееся время
+    """
+    return _visible_job(job_id, tenant, admin).to_dict()
+
+
+@index_router.delete("/jobs/{job_id}")
+async def cancel_job(
+    job_id: str,
+    tenant: Optional[str] = Depends(request_tenant),
+    admin: bool = Depends(request_admin)
+):
+    """
+    Эндпоинт отмены задачи; выполняющаяся задача останавливается после текущего батча,
+    уже загруженные страницы документа удаляются из индекса
+    """
+    _visible_job(job_id, tenant, admin)
+    job = ingestion_queue.cancel(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Задача не найдена")
+    return job.to_dict()
+
+
+@index_router.get("/tenants/{tenant_id}")
+async def tenant_usage(
+    tenant_id: str,
+    tenant: Optional[str] = Depends(request_tenant),
+    admin: bool = Depends(request_admin)
+):
+    """
+    Эндпоинт занятой арендатором квоты страниц
+    """
+    _owned_tenant(tenant_id, tenant, admin)
+    try:
+        pages = await asyncio.to_thread(search_service.indexer.tenant_pages, tenant_id)
+    except Exception as e:
+        ERRORS.labels(stage="tenants").inc()
+        raise HTTPException(status_code=500, detail=str(e))
+    return {"tenant": tenant_id, "pages": pages, "max_pages": tenant_config.max_pages}
+
+
+@index_router.delete("/tenants/{tenant_id}")
+async def delete_tenant(
+    tenant_id: str,
+    tenant: Optional[str] = Depends(request_tenant),
+    admin: bool = Depends(request_admin)
+):
+    """
+    Эндпоинт удаления всех документов арендатора из индекса и с диска
+
+    Незавершенные задачи арендатора сначала отменяются.
+    """
+    _owned_tenant(tenant_id, tenant, admin)
+    for job in ingestion_queue.jobs(tenant_id):
+        if job.status not in FINISHED_STATUSES:
+            ingestion_queue.cancel(job.id)
+    try:
+        deleted = await asyncio.to_thread(search_service.delete_tenant, tenant_id)
+    except Exception as e:
+        ERRORS.labels(stage="tenants").inc()
+        raise HTTPException(status_code=500, detail=str(e))
+    return {"tenant": tenant_id, "deleted_files": deleted}
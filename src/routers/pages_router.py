@@ -0,0 +1,54 @@
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, Response
+from fastapi.responses import FileResponse
+import asyncio
+from typing import Optional
+
+from src.metrics import ERRORS
+from src.page_store import ORIGINAL_SIZE
+from src.routers.search_router import request_tenant, search_service, tenant_config
+
+# Инициализация роутера изображений страниц
+pages_router = APIRouter(prefix="/pages", tags=["pages"])
+
+# Адрес с версией указывает на неизменяемое содержимое
+IMMUTABLE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+
+
+@pages_router.get("/{page_id}/image")
+async def page_image(
+    page_id: int,
+    request: Request,
+    size: str = Query(ORIGINAL_SIZE, description="original или имя размера (thumb, preview)"),
+    v: str = Query(None, description="Версия изображения из выдачи поиска"),
+    tenant: Optional[str] = Depends(request_tenant)
+):
+    """
+    Эндпоинт изображения страницы с ETag и Cache-Control
+
+    Миниатюры и превью создаются заранее при загрузке документа, сервер
+    только отдает готовый файл. Адреса из выдачи содержат версию и
+    кэшируются браузером и прокси без повторных запросов. Страницы
+    арендатора отдаются только ему и не кэшируются общими прокси.
+    """
+    try:
+        path, etag = await asyncio.to_thread(search_service.page_image, page_id, size, tenant)
+    except IndexError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    except KeyError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        ERRORS.labels(stage="page_image").inc()
+        raise HTTPException(status_code=500, detail=str(e))
+
+    quoted_etag = f'"{etag}"'
+    cache_control = IMMUTABLE_CACHE_CONTROL if v == etag \
+        else f"public, max-age={search_service.page_store.images_config.max_age}"
+    if tenant is not None:
+        cache_control = cache_control.replace("public", "private")
+    headers = {"ETag": quoted_etag, "Cache-Control": cache_control, "Vary": tenant_config.header}
+
+    if_none_match = request.headers.get("if-none-match", "")
+    if quoted_etag in [tag.strip().removeprefix("W/") for tag in if_none_match.split(",")]:
+        return Response(status_code=304, headers=headers)
+
+    return FileResponse(path, media_type=search_service.page_store.media_type(path), headers=headers)
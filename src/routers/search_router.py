@@ -1,35 +1,71 @@
-from fastapi import APIRouter, HTTPException
+from fastapi import APIRouter, Depends, HTTPException, Request
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel
 from PIL import Image
+import asyncio
 import io
+import json
 import base64
+from typing import Optional
 
+from configs.service_config import TenantConfig
+from src.metrics import BASE64_DECODE_SECONDS, ERRORS
+from src.profiling import span
 from src.search import DocumentSearchService
+from src.tenants import verify_tenant_token
 
 # Инициализация роутера и сервиса
 search_router = APIRouter(prefix="/search", tags=["search"])
-search_service = DocumentSearchService()
+tenant_config = TenantConfig()
+search_service = DocumentSearchService(tenant_config=tenant_config)
+
+
+def request_tenant(request: Request) -> Optional[str]:
+    """
+    Арендатор запроса по подписанному токену из заголовка TenantConfig.header
+    (без заголовка - общий архив); идентификатор арендатора без подписи не принимается
+    """
+    token = request.headers.get(tenant_config.header)
+    if not token:
+        return None
+    if not tenant_config.token_secret:
+        raise HTTPException(status_code=401, detail="Токены арендаторов не настроены (TENANT_TOKEN_SECRET)")
+    try:
+        return verify_tenant_token(token, tenant_config.token_secret)
+    except ValueError as e:
+        raise HTTPException(status_code=401, detail=str(e))
+
 
 class SearchRequest(BaseModel):
     query: str
     top_k: int = 2
+    # Тепловая карта и области совпадения для каждой страницы
+    highlights: bool = False
 
 class ResponseGenerationRequest(BaseModel):
     query: str
     image_base64: str
 
+class AskRequest(BaseModel):
+    query: str
+    top_k: int = 2
+    stream: bool = False
+
 @search_router.post("/documents")
-async def search_documents(request: SearchRequest):
+async def search_documents(request: SearchRequest, tenant: Optional[str] = Depends(request_tenant)):
     """
-    Эндпоинт для поиска документов
+    Эндпоинт для поиска документов (общий архив и документы арендатора)
     """
     try:
-        result = search_service.search_documents(
+        result = await search_service.search_documents_async(
             request.query, 
-            request.top_k
+            request.top_k,
+            tenant=tenant,
+            highlights=request.highlights
         )
         return result
     except Exception as e:
+        ERRORS.labels(stage="search").inc()
         raise HTTPException(status_code=500, detail=str(e))
 
 @search_router.post("/generate-response")
@@ -39,15 +75,40 @@ async def generate_response(request: ResponseGenerationRequest):
     """
     try:
         # Декодируем base64 изображение
-        image_bytes = base64.b64decode(request.image_base64)
-        image = Image.open(io.BytesIO(image_bytes))
+        with BASE64_DECODE_SECONDS.time(), span("base64_decode"):
+            image_bytes = base64.b64decode(request.image_base64)
+            image = Image.open(io.BytesIO(image_bytes))
+            image.load()
 
-        # Генерируем ответ
-        response = search_service.generate_response(
+        # Генерируем ответ в пуле потоков, не блокируя event loop
+        response = await asyncio.to_thread(
+            search_service.generate_response,
             request.query, 
             image
         )
         
         return {"response": response}
     except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e)) 
+        ERRORS.labels(stage="generate_response").inc()
+        raise HTTPException(status_code=500, detail=str(e))
+
+@search_router.post("/ask")
+async def ask(request: AskRequest, tenant: Optional[str] = Depends(request_tenant)):
+    """
+    Эндпоинт поиска и генерации ответа за один запрос
+
+    При stream=true ответ отдается как NDJSON: сначала выдача,
+    затем фрагменты ответа и итоговые замеры этапов.
+    """
+    try:
+        if request.stream:
+            events = search_service.ask_stream(request.query, request.top_k, tenant=tenant)
+            return StreamingResponse(
+                (json.dumps(event, ensure_ascii=False) + "\n" for event in events),
+                media_type="application/x-ndjson"
+            )
+
+        return await search_service.ask(request.query, request.top_k, tenant=tenant)
+    except Exception as e:
+        ERRORS.labels(stage="ask").inc()
+        raise HTTPException(status_code=500, detail=str(e))
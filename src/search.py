@@ -1,9 +1,30 @@
+import asyncio
 import base64
 import io
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Iterator, List, Tuple
+
 from PIL import Image
 
+from configs.service_config import (
+    HighlightConfig,
+    IndexingConfig,
+    LatencySLOConfig,
+    ModelServerConfig,
+    PageImagesConfig,
+    QueryPruningConfig,
+    TenantConfig,
+    VisionCacheConfig,
+)
 from src.indexer import DocumentIndexer
+from src.metrics import IMAGE_LOAD_SECONDS
+from src.model_server import ModelServerClient
+from src.page_store import ORIGINAL_SIZE, PageStore
+from src.profiling import span
+from src.tenants import search_scope, tenant_of_filename
 from src.multimodal_inference import MultimodalInference
+from src.vision_cache import VisionEncoderCache
 from src.data_preparation.data_preparer import DocumentDataPreparer
 
 
@@ -12,22 +33,70 @@ class DocumentSearchService:
         self, 
         base_data_directory: str = "data/prepared_data/",
         model_name: str = "vidore/colqwen2-v0.1",
-        multimodal_model_name: str = 'openbmb/MiniCPM-V-2_6-int4'
+        multimodal_model_name: str = 'openbmb/MiniCPM-V-2_6-int4',
+        vision_cache_config: VisionCacheConfig = None,
+        model_server_config: ModelServerConfig = None,
+        page_images_config: PageImagesConfig = None,
+        indexing_config: IndexingConfig = None,
+        query_pruning_config: QueryPruningConfig = None,
+        tenant_config: TenantConfig = None,
+        latency_slo_config: LatencySLOConfig = None,
+        highlight_config: HighlightConfig = None
     ):
         # Подготовка данных
         self.data_preparer = DocumentDataPreparer(base_data_directory)
         self.dataset = self.data_preparer.prepare_documents()
 
+        # Изображения страниц и их уменьшенные копии для выдачи по URL
+        self.page_store = PageStore(base_data_directory, images_config=page_images_config)
+        # Идентификаторы точек - позиции в наборе данных: порядок закрепляется манифестом
+        self.page_store.pin_order(self.dataset)
+
+        # Модели в отдельном процессе, если задан адрес модельного сервера
+        model_server_config = model_server_config or ModelServerConfig()
+        model_server = None
+        if model_server_config.address:
+            model_server = ModelServerClient(model_server_config)
+
         # Инициализация индексатора
+        indexing_config = indexing_config or IndexingConfig()
         self.indexer = DocumentIndexer(
             dataset=self.dataset,
-            model_name=model_name
+            model_name=model_name,
+            query_encoder=model_server,
+            max_image_tokens=indexing_config.max_image_tokens,
+            query_pruning=query_pruning_config or QueryPruningConfig(),
+            duplicate_max_distance=indexing_config.duplicate_max_distance,
+            tenant_payload_m=(tenant_config or TenantConfig()).payload_m,
+            latency_slo=latency_slo_config or LatencySLOConfig(),
+            highlights=highlight_config or HighlightConfig()
         )
+        # Коллекции, построенные до разделения по арендаторам, получают индекс раздела
+        try:
+            self.indexer.ensure_tenant_index()
+        except Exception as e:
+            print(f"Индекс арендаторов не создан: {e}")
 
-        # Инициализация мультимодальной модели
-        self.multimodal_inference = MultimodalInference(
-            model_name=multimodal_model_name
-        )
+        # Кэш визуального энкодера для повторно запрашиваемых страниц
+        vision_cache_config = vision_cache_config or VisionCacheConfig()
+        self.vision_cache = None
+        if vision_cache_config.enabled and model_server is None:
+            self.vision_cache = VisionEncoderCache(
+                max_entries=vision_cache_config.max_entries,
+                disk_directory=vision_cache_config.disk_directory
+            )
+
+        # Инициализация мультимодальной модели (или клиента модельного сервера)
+        if model_server is not None:
+            self.multimodal_inference = model_server
+        else:
+            self.multimodal_inference = MultimodalInference(
+                model_name=multimodal_model_name,
+                vision_cache=self.vision_cache
+            )
+
+        # Пул для загрузки страниц параллельно с форматированием выдачи
+        self._page_loader = ThreadPoolExecutor(max_workers=2)
 
     def image_to_base64(self, image: Image.Image) -> str:
         """
@@ -46,7 +115,8 @@ class DocumentSearchService:
     def search_documents(
         self, 
         query: str, 
-        top_k: int = 3
+        top_k: int = 3,
+        tenant: str = None
     ) -> dict:
         """
         Поиск релевантных документов
@@ -54,6 +124,7 @@ class DocumentSearchService:
         Args:
             query (str): Текстовый запрос
             top_k (int): Количество возвращаемых документов
+            tenant (str, optional): Арендатор (None - только общий архив)
         
         Returns:
             dict: Найденные документы
@@ -62,21 +133,16 @@ class DocumentSearchService:
             # Поиск релевантных изображений
             relevant_images = self.indexer.search_by_text_and_return_images(
                 query, 
-                top_k=top_k
+                top_k=top_k,
+                tenant=tenant
         )
 
         # Подготовка списка документов с base64 изображениями
             documents = []
             images = []
             for idx, image in enumerate(relevant_images):
-                doc_info = {
-                    "index": idx,
-                    "filename": getattr(image, 'filename', 'unknown'),
-                    "page_number": getattr(image, 'page_number', None),
-                    "width": image.width,
-                    "height": image.height,
-                    # "image_base64": self.image_to_base64(image)  # Добавляем base64 изображения
-                }
+                doc_info = self._document_info(idx, image)
+                # doc_info["image_base64"] = self.image_to_base64(image)  # Добавляем base64 изображения
                 images.append(image)
                 documents.append(doc_info)
 
@@ -89,6 +155,278 @@ class DocumentSearchService:
             print(f"Error in search_documents: {e}")
             raise  # Reraise для получения полного трейсбэка
 
+    def _document_info(self, idx: int, image: Image.Image) -> dict:
+        """
+        Описание найденной страницы для выдачи
+
+        Args:
+            idx (int): Позиция в выдаче
+            image (Image.Image): Изображение страницы
+
+        Returns:
+            dict: Метаданные страницы
+        """
+        return {
+            "index": idx,
+            "filename": getattr(image, 'filename', 'unknown'),
+            "page_number": getattr(image, 'page_number', None),
+            "width": image.width,
+            "height": image.height,
+        }
+
+    @staticmethod
+    def _load_page(image: Image.Image) -> Image.Image:
+        """
+        Загрузка пикселей страницы (PIL открывает файлы лениво)
+        """
+        with IMAGE_LOAD_SECONDS.time():
+            image.load()
+        return image
+
+    def _image_urls(self, page_id: int, filename: str) -> Dict[str, str]:
+        """
+        Адреса изображений страницы по размерам; версия в адресе позволяет
+        кэшировать ответ без повторной проверки
+        """
+        urls = {}
+        for size in (*self.page_store.sizes, ORIGINAL_SIZE):
+            try:
+                version = self.page_store.etag(filename, size)
+            except OSError:
+                continue
+            urls[size] = f"/pages/{page_id}/image?size={size}&v={version}"
+        return urls
+
+    def _format_points(self, points: list) -> List[dict]:
+        """
+        Описание найденных точек Qdrant для выдачи
+        """
+        documents = []
+        for idx, point in enumerate(points):
+            image = self.dataset[point.id]
+            doc_info = self._document_info(idx, image)
+            doc_info["id"] = point.id
+            doc_info["score"] = point.score
+            doc_info["images"] = self._image_urls(point.id, getattr(image, "filename", ""))
+            # Другие файлы с той же страницей (копии не индексируются отдельно)
+            doc_info["duplicates"] = (point.payload or {}).get("duplicates", [])
+            # Области совпадения в долях размера страницы (если запрошены)
+            if "highlights" in (point.payload or {}):
+                doc_info["highlights"] = point.payload["highlights"]
+            documents.append(doc_info)
+        return documents
+
+    def page_image(self, page_id: int, size: str = ORIGINAL_SIZE, tenant: str = None) -> Tuple[str, str]:
+        """
+        Файл изображения страницы нужного размера
+
+        Args:
+            page_id (int): Идентификатор страницы (точки Qdrant)
+            size (str): "original" или имя размера из PageImagesConfig.sizes
+            tenant (str, optional): Арендатор; страницы других арендаторов не отдаются
+
+        Returns:
+            tuple: Путь к файлу и его версия (ETag)
+        """
+        if not 0 <= page_id < len(self.dataset):
+            raise IndexError(f"Страница {page_id} не найдена")
+        filename = getattr(self.dataset[page_id], "filename", None)
+        if not filename:
+            raise IndexError(f"У страницы {page_id} нет файла")
+        if tenant_of_filename(filename) not in search_scope(tenant):
+            # Чужие страницы неотличимы от несуществующих
+            raise IndexError(f"Страница {page_id} не найдена")
+        return self.page_store.image_path(filename, size), self.page_store.etag(filename, size)
+
+    def delete_tenant(self, tenant: str) -> int:
+        """
+        Удаление документов арендатора из индекса и их страниц с диска
+
+        Args:
+            tenant (str): Арендатор
+
+        Returns:
+            int: Число удаленных файлов страниц
+        """
+        filenames = self.indexer.delete_tenant(tenant)
+        for filename in filenames:
+            self.page_store.delete(filename)
+        return len(filenames)
+
+    def _retrieve_for_answer(
+        self,
+        query: str,
+        top_k: int,
+        timings: Dict[str, float],
+        tenant: str = None
+    ) -> Tuple[List[dict], Image.Image]:
+        """
+        Поиск страниц и подготовка лучшей из них к генерации
+
+        Загрузка первой страницы запускается в фоне сразу после поиска
+        и идет параллельно с форматированием остальной выдачи.
+
+        Args:
+            query (str): Текстовый запрос
+            top_k (int): Количество возвращаемых документов
+            timings (dict): Словарь для замеров этапов в миллисекундах
+            tenant (str, optional): Арендатор (None - только общий архив)
+
+        Returns:
+            tuple: Найденные документы и изображение лучшей страницы (или None)
+        """
+        start = time.perf_counter()
+        search_result = self.indexer.search_documents(query, top_k, tenant=tenant)
+        timings["retrieval_ms"] = (time.perf_counter() - start) * 1000
+
+        points = search_result.points
+        if not points:
+            return [], None
+
+        start = time.perf_counter()
+        with span("dataset_lookup"):
+            top_page = self._page_loader.submit(self._load_page, self.dataset[points[0].id])
+            documents = self._format_points(points)
+
+        # Загрузка идет в пуле потоков, здесь учитывается только ожидание ее окончания
+        with span("page_load_wait"):
+            top_image = top_page.result()
+        timings["page_load_ms"] = (time.perf_counter() - start) * 1000
+
+        return documents, top_image
+
+    async def _retrieve_for_answer_async(
+        self,
+        query: str,
+        top_k: int,
+        timings: Dict[str, float],
+        tenant: str = None
+    ) -> Tuple[List[dict], Image.Image]:
+        """
+        Асинхронный вариант _retrieve_for_answer для обработчиков запросов
+        """
+        start = time.perf_counter()
+        search_result = await self.indexer.search_documents_async(query, top_k, tenant=tenant)
+        timings["retrieval_ms"] = (time.perf_counter() - start) * 1000
+
+        points = search_result.points
+        if not points:
+            return [], None
+
+        start = time.perf_counter()
+        loop = asyncio.get_running_loop()
+        with span("dataset_lookup"):
+            top_page = loop.run_in_executor(self._page_loader, self._load_page, self.dataset[points[0].id])
+            documents = self._format_points(points)
+
+        with span("page_load_wait"):
+            top_image = await top_page
+        timings["page_load_ms"] = (time.perf_counter() - start) * 1000
+
+        return documents, top_image
+
+    async def search_documents_async(
+        self,
+        query: str,
+        top_k: int = 3,
+        tenant: str = None,
+        highlights: bool = False
+    ) -> dict:
+        """
+        Асинхронный поиск документов без загрузки изображений
+
+        Args:
+            query (str): Текстовый запрос
+            top_k (int): Количество возвращаемых документов
+            tenant (str, optional): Арендатор (None - только общий архив)
+            highlights (bool): Добавить к документам тепловую карту и области совпадения
+
+        Returns:
+            dict: Найденные документы
+        """
+        search_result = await self.indexer.search_documents_async(
+            query, top_k, tenant=tenant, highlights=highlights
+        )
+        with span("dataset_lookup"):
+            documents = self._format_points(search_result.points)
+        return {
+            "query": query,
+            "documents": documents
+        }
+
+    async def ask(
+        self,
+        query: str,
+        top_k: int = 3,
+        tenant: str = None
+    ) -> dict:
+        """
+        Поиск документов и генерация ответа по лучшей странице за один вызов
+
+        Args:
+            query (str): Текстовый запрос
+            top_k (int): Количество возвращаемых документов
+            tenant (str, optional): Арендатор (None - только общий архив)
+
+        Returns:
+            dict: Найденные документы, ответ модели и замеры этапов
+        """
+        total_start = time.perf_counter()
+        timings = {}
+
+        documents, top_image = await self._retrieve_for_answer_async(query, top_k, timings, tenant)
+
+        response = None
+        if top_image is not None:
+            start = time.perf_counter()
+            response = await asyncio.to_thread(self.generate_response, query, top_image)
+            timings["generation_ms"] = (time.perf_counter() - start) * 1000
+
+        timings["total_ms"] = (time.perf_counter() - total_start) * 1000
+
+        return {
+            "query": query,
+            "documents": documents,
+            "response": response,
+            "timings": timings,
+        }
+
+    def ask_stream(
+        self,
+        query: str,
+        top_k: int = 3,
+        tenant: str = None
+    ) -> Iterator[dict]:
+        """
+        Потоковый вариант ask: сначала выдача, затем фрагменты ответа
+
+        Args:
+            query (str): Текстовый запрос
+            top_k (int): Количество возвращаемых документов
+            tenant (str, optional): Арендатор (None - только общий архив)
+
+        Yields:
+            dict: События "documents", "token" и завершающее "done"
+        """
+        total_start = time.perf_counter()
+        timings = {}
+
+        documents, top_image = self._retrieve_for_answer(query, top_k, timings, tenant)
+        yield {"type": "documents", "query": query, "documents": documents}
+
+        if top_image is not None:
+            start = time.perf_counter()
+            first_token = True
+            for chunk in self.multimodal_inference.generate_response_stream(top_image, query):
+                if first_token:
+                    timings["time_to_first_token_ms"] = (time.perf_counter() - start) * 1000
+                    first_token = False
+                yield {"type": "token", "text": chunk}
+            timings["generation_ms"] = (time.perf_counter() - start) * 1000
+
+        timings["total_ms"] = (time.perf_counter() - total_start) * 1000
+        yield {"type": "done", "timings": timings}
+
     def generate_response(
         self,
         query: str,
@@ -0,0 +1,121 @@
+"""
+Разделение документов по арендаторам (tenant).
+
+Корпоративный архив принадлежит общему разделу "global", документы,
+загруженные пользователем, - его арендатору (сессии или организации).
+Раздел хранится в payload точки (поле tenant) с индексом is_tenant:
+Qdrant размещает точки арендатора рядом и строит для каждого значения
+свой граф HNSW (payload_m), поэтому поиск внутри раздела не замедляется
+от объема других разделов. Поиск арендатора - это два запроса (global
+и его раздел), результаты которых объединяются по оценке.
+
+Файлы страниц арендатора получают префикс "@<tenant>__", поэтому
+принадлежность страницы восстанавливается по имени файла и после
+перезапуска, и при полной переиндексации.
+
+Арендатор запроса определяется не по идентификатору от клиента, а по
+токену "<tenant>.<подпись>", подписанному HMAC-SHA256 секретом сервиса
+(TenantConfig.token_secret): подобрать токен чужого арендатора нельзя.
+Токен выдает оператор (python -m src.tenants <tenant>) или интерфейс,
+которому доверен секрет, для своих сессий.
+
+Выдача токена:
+    TENANT_TOKEN_SECRET=... python -m src.tenants acme
+"""
+
+import hashlib
+import hmac
+import os
+import re
+import sys
+from typing import List, Optional
+
+from qdrant_client.http import models
+
+GLOBAL_TENANT = "global"
+TENANT_FIELD = "tenant"
+
+_TENANT_PATTERN = re.compile(r"[A-Za-z0-9_-]{1,64}")
+_FILENAME_PREFIX = "@"
+
+
+def validate_tenant(tenant: str) -> str:
+    """
+    Проверка идентификатора арендатора (он входит в имена файлов)
+
+    Raises:
+        ValueError: Недопустимый идентификатор
+    """
+    if not _TENANT_PATTERN.fullmatch(tenant):
+        raise ValueError("Идентификатор арендатора: латиница, цифры, '-' и '_', не длиннее 64 символов")
+    return tenant
+
+
+def sign_tenant(tenant: str, secret: str) -> str:
+    """
+    Токен арендатора: идентификатор и его подпись секретом сервиса
+    """
+    validate_tenant(tenant)
+    signature = hmac.new(secret.encode("utf-8"), tenant.encode("utf-8"), hashlib.sha256).hexdigest()
+    return f"{tenant}.{signature}"
+
+
+def verify_tenant_token(token: str, secret: str) -> str:
+    """
+    Арендатор из подписанного токена
+
+    Raises:
+        ValueError: Токен не подписан секретом сервиса
+    """
+    tenant = token.rpartition(".")[0]
+    if not tenant or not _TENANT_PATTERN.fullmatch(tenant) or \
+            not hmac.compare_digest(sign_tenant(tenant, secret), token):
+        raise ValueError("Недействительный токен арендатора")
+    return tenant
+
+
+def tenant_document_name(tenant: Optional[str], filename: str) -> str:
+    """
+    Имя документа для файлов страниц с префиксом арендатора
+    """
+    if tenant in (None, GLOBAL_TENANT):
+        return filename
+    return f"{_FILENAME_PREFIX}{tenant}__{filename}"
+
+
+def tenant_of_filename(filename: Optional[str]) -> str:
+    """
+    Арендатор страницы по имени ее файла (global для архива)
+    """
+    if filename and filename.startswith(_FILENAME_PREFIX) and "__" in filename:
+        return filename[len(_FILENAME_PREFIX):].split("__", 1)[0]
+    return GLOBAL_TENANT
+
+
+def search_scope(tenant: Optional[str]) -> List[str]:
+    """
+    Разделы, видимые арендатору: общий архив и его собственные документы
+    """
+    if tenant in (None, GLOBAL_TENANT):
+        return [GLOBAL_TENANT]
+    return [GLOBAL_TENANT, tenant]
+
+
+def tenant_filter(tenant: str) -> models.Filter:
+    return models.Filter(
+        must=[models.FieldCondition(key=TENANT_FIELD, match=models.MatchValue(value=tenant))]
+    )
+
+
+def main():
+    """
+    Выдача токена арендатора по секрету из TENANT_TOKEN_SECRET
+    """
+    secret = os.environ.get("TENANT_TOKEN_SECRET")
+    if not secret or len(sys.argv) != 2:
+        raise SystemExit("Использование: TENANT_TOKEN_SECRET=... python -m src.tenants <tenant>")
+    print(sign_tenant(sys.argv[1], secret))
+
+
+if __name__ == "__main__":
+    main()
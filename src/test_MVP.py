@@ -1,16 +1,16 @@
 import gradio as gr
 import numpy as np
 from PIL import Image
-import fitz
 import os
 import shutil
 from datetime import datetime
-from src.search import DocumentSearchService
-
-from src.data_preparation.prepare_data import convert_all_files
+from configs.service_config import IngestionConfig, UIConfig
+from src.tenants import GLOBAL_TENANT
 
 
 chat_history = []
+# Загруженные через интерфейс файлы и их задачи индексации
+submitted_files = {}
 
 # Определяем базовый путь проекта
 BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
@@ -18,7 +18,19 @@ BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 # Создаем путь для загрузки файлов
 UPLOAD_DIR = os.path.join(BASE_DIR, "data", "user_loaded_files", "raw_files")
 PREPARED_DIR = os.path.join(BASE_DIR, "data", "user_loaded_files", "prepared_data")
-search_service = DocumentSearchService()
+ui_config = UIConfig()
+if ui_config.api_url:
+    # Режим клиента HTTP API: модели и страницы остаются в процессе FastAPI сервиса,
+    # интерфейс можно запускать в нескольких экземплярах независимо от него
+    from src.api_client import ServiceAPIClient
+    search_service = ServiceAPIClient(ui_config)
+    ingestion_queue = None
+else:
+    from src.ingestion import IngestionQueue
+    from src.search import DocumentSearchService
+    search_service = DocumentSearchService()
+    # Загруженные PDF индексируются в фоне, интерфейс при этом не блокируется
+    ingestion_queue = IngestionQueue(search_service.indexer, IngestionConfig(upload_directory=UPLOAD_DIR))
 
 # Создаем директорию, если она не существует
 if not os.path.exists(UPLOAD_DIR):
@@ -43,36 +55,57 @@ def load_local_image(file_path):
         return None
 
 
-def generate_response(input_text, pdf_file, with_generate=False):
-    try:
-        pdf_text = ""
-        saved_pdf_path = None
+def session_tenant(request):
+    """
+    Арендатор сессии интерфейса: загруженные PDF видны только в этой сессии
+    """
+    session_hash = getattr(request, "session_hash", None)
+    return session_hash or GLOBAL_TENANT
 
-        if pdf_file is not None and not with_generate:
-            # Создаем уникальное имя файла с временной меткой
 
-            timestamp = datetime.now().timestamp()
-            filename = f"document__{timestamp}.pdf"
-            saved_pdf_path = os.path.join(UPLOAD_DIR, filename)
+def submit_pdf(pdf_file, tenant=GLOBAL_TENANT):
+    """
+    Постановка загруженного PDF в очередь индексации (один раз на файл)
 
-            # Копируем загруженный файл в нашу директорию
-            shutil.copy2(pdf_file.name, saved_pdf_path)
+    Returns:
+        dict: Состояние задачи индексации
+    """
+    filename = os.path.basename(pdf_file.name)
+    job_id = submitted_files.get(pdf_file.name)
+
+    if ingestion_queue is None:
+        job = search_service.job(job_id, tenant) if job_id else None
+        if job is None:
+            job = search_service.submit(pdf_file.name, filename, tenant=tenant)
+            submitted_files[pdf_file.name] = job["id"]
+        return job
 
-            convert_all_files(UPLOAD_DIR, PREPARED_DIR, user_files=True)
+    job = ingestion_queue.get(job_id or "")
+    if job is None:
+        # Копируем загруженный файл в нашу директорию и ставим в очередь индексации
+        saved_pdf_path = ingestion_queue.upload_path(filename)
+        shutil.copy2(pdf_file.name, saved_pdf_path)
+        job = ingestion_queue.submit(saved_pdf_path, filename, tenant=tenant)
+        submitted_files[pdf_file.name] = job.id
+    return job.to_dict()
 
-            user_png_images = search_service.data_preparer.read_png_files_with_order(PREPARED_DIR)
-            dataset = search_service.data_preparer.prepare_documents()
-            
-            dataset.extend(user_png_images)
-            
-            search_service.indexer.index_new_documents(dataset)
+
+def generate_response(input_text, pdf_file, with_generate=False, tenant=GLOBAL_TENANT):
+    try:
+        pdf_text = ""
+        response = ""
+
+        if pdf_file is not None and not with_generate:
+            job = submit_pdf(pdf_file, tenant)
+            progress = f"{job['pages_done']}/{job['pages_total'] or '?'}"
+            pdf_text = f"Индексация {job['filename']}: {job['status']}, страниц {progress}"
 
         print(pdf_text)
 
         print(f"Запрос: {input_text}")
 
         # Сначала ищем документы
-        search_result, images = search_service.search_documents(input_text, top_k=2)
+        search_result, images = search_service.search_documents(input_text, top_k=ui_config.top_k, tenant=tenant)
         documents = search_result['documents']
         print(f"Найдено документов: {len(documents)}")
         
@@ -81,8 +114,8 @@ def generate_response(input_text, pdf_file, with_generate=False):
             first_image = images[0]
             response = search_service.generate_response(input_text, first_image)
             print(f"Ответ модели: {response}")
-        elif not with_generate and documents:
-            response = ""
+        elif not with_generate:
+            response = pdf_text
         else:
             print("Документы не найдены")
         
@@ -104,13 +137,44 @@ def generate_response(input_text, pdf_file, with_generate=False):
         error_image = np.zeros((200, 200, 3), dtype=np.uint8)
         return f"Произошла ошибка: {str(e)}", error_image, error_image, []
 
+
+def stream_response(input_text, tenant=GLOBAL_TENANT):
+    """
+    Поиск и генерация ответа по лучшей странице с выводом ответа по мере генерации
+
+    Yields:
+        str: Накопленный текст ответа
+    """
+    response = ""
+    try:
+        for event in search_service.ask_stream(input_text, ui_config.top_k, tenant=tenant):
+            if event["type"] == "documents" and not event["documents"]:
+                print("Документы не найдены")
+            elif event["type"] == "token":
+                response += event["text"]
+                yield response
+            elif event["type"] == "done":
+                print(f"Ответ модели: {response}, этапы: {event['timings']}")
+    except Exception as e:
+        yield f"Произошла ошибка: {str(e)}"
+        return
+
+    # Добавляем запрос и ответ в историю
+    timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    chat_history.append({
+        "timestamp": timestamp,
+        "query": input_text,
+        "response": response
+    })
+    yield response
+
 with gr.Blocks() as demo:
     gr.Markdown("### Демонстрационное приложение")
     
     with gr.Row():
         input_text = gr.Textbox(label="Введите ваш запрос", 
                               placeholder="Например: Как работает GPT?")
-        pdf_input = gr.File(label="Загрузите PDF файл (НЕЛЬЗЯ, ВСЕ СЛОМАЕТСЯ🤡)", 
+        pdf_input = gr.File(label="Загрузите PDF файл", 
                           file_types=[".pdf"])
     
     with gr.Row():
@@ -124,8 +188,10 @@ with gr.Blocks() as demo:
             interactive=False
         )
     
-    def update_and_show_response(input_text, pdf_file, with_generate=False):
-        response, img1, img2, documents = generate_response(input_text, pdf_file, with_generate)
+    def update_and_show_response(input_text, pdf_file, request: gr.Request, with_generate=False):
+        response, img1, img2, documents = generate_response(
+            input_text, pdf_file, with_generate, tenant=session_tenant(request)
+        )
     
         # Получаем информацию о документах
         if documents and len(documents) > 0:
@@ -187,8 +253,11 @@ with gr.Blocks() as demo:
     )
 
     button = gr.Button("Сгенерировать ответ")
+    def generate_and_show_response(input_text, pdf_file, request: gr.Request):
+        yield from stream_response(input_text, tenant=session_tenant(request))
+
     button.click(
-        lambda text, pdf: update_and_show_response(text, pdf, with_generate=True),
+        generate_and_show_response,
         inputs=[input_text, pdf_input],
         outputs=[
             output_text, 
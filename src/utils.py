@@ -1 +1,220 @@
- 
+"""
+Вспомогательные функции, общие для модулей сервиса.
+"""
+
+import hashlib
+import math
+import os
+import queue
+import threading
+from multiprocessing import resource_tracker, shared_memory
+from typing import Callable, ContextManager, Iterable, Iterator
+
+import numpy as np
+from PIL import Image
+
+
+def image_hash(image: Image.Image) -> str:
+    """
+    Вычисление хэша содержимого изображения
+
+    Хэш зависит только от пикселей, размера и цветового режима,
+    поэтому одна и та же страница, открытая повторно, получает тот же ключ.
+
+    Args:
+        image (Image.Image): Изображение страницы
+
+    Returns:
+        str: Hex-строка SHA-256
+    """
+    hasher = hashlib.sha256()
+    hasher.update(f"{image.mode}:{image.width}x{image.height}:".encode("utf-8"))
+    hasher.update(image.tobytes())
+    return hasher.hexdigest()
+
+
+# Сторона патча Qwen2-VL после объединения 2x2 (14 * 2): размеры входа ColQwen2 кратны ей
+PATCH_SIZE = 28
+
+
+def token_grid(width: float, height: float, max_tokens: int, upscale: bool = False) -> tuple:
+    """
+    Сетка патчей страницы с сохранением пропорций и ограничением на число токенов
+
+    Args:
+        width (float): Ширина страницы (в пикселях или пунктах при той же шкале)
+        height (float): Высота страницы
+        max_tokens (int): Максимальное число визуальных токенов
+        upscale (bool): Увеличивать маленькие страницы до бюджета
+            (для векторного PDF: при большем DPI появляются детали)
+
+    Returns:
+        tuple: Количество патчей по ширине и высоте
+    """
+    grid_w = max(1, round(width / PATCH_SIZE))
+    grid_h = max(1, round(height / PATCH_SIZE))
+    if grid_w * grid_h > max_tokens or upscale:
+        scale = math.sqrt(max_tokens / ((width / PATCH_SIZE) * (height / PATCH_SIZE)))
+        grid_w = max(1, math.floor(width * scale / PATCH_SIZE))
+        grid_h = max(1, math.floor(height * scale / PATCH_SIZE))
+    return grid_w, grid_h
+
+
+def fit_to_token_budget(image: Image.Image, max_tokens: int, upscale: bool = False) -> Image.Image:
+    """
+    Приведение изображения к сетке патчей в пределах бюджета токенов
+
+    Args:
+        image (Image.Image): Изображение страницы
+        max_tokens (int): Максимальное число визуальных токенов
+        upscale (bool): Увеличивать маленькие изображения до бюджета
+
+    Returns:
+        Image.Image: Изображение с размерами, кратными PATCH_SIZE
+            (исходное, если они уже совпадают), с сохранением метаданных страницы
+    """
+    grid_w, grid_h = token_grid(image.width, image.height, max_tokens, upscale)
+    size = (grid_w * PATCH_SIZE, grid_h * PATCH_SIZE)
+    if image.size == size:
+        return image
+
+    resized = image.resize(size, Image.LANCZOS, reducing_gap=2.0)
+    for attribute in ("filename", "page_number", "text", "render_dpi"):
+        if hasattr(image, attribute):
+            setattr(resized, attribute, getattr(image, attribute))
+    return resized
+
+
+def perceptual_hash(image: Image.Image, hash_size: int = 16) -> int:
+    """
+    Перцептивный хэш страницы (dHash)
+
+    Страница уменьшается до (hash_size + 1) x hash_size в оттенках серого,
+    каждый бит - сравнение яркости соседних по горизонтали пикселей. Хэш
+    устойчив к повторному сжатию, смене DPI и мелкому шуму, поэтому
+    копии одной страницы отличаются на несколько бит.
+
+    Args:
+        image (Image.Image): Изображение страницы
+        hash_size (int): Сторона сетки; хэш содержит hash_size ** 2 бит
+
+    Returns:
+        int: Хэш как целое число
+    """
+    small = image.resize((hash_size + 1, hash_size), Image.BILINEAR, reducing_gap=2.0).convert("L")
+    pixels = list(small.getdata())
+    value = 0
+    for row in range(hash_size):
+        offset = row * (hash_size + 1)
+        for col in range(hash_size):
+            value = (value << 1) | (pixels[offset + col] > pixels[offset + col + 1])
+    return value
+
+
+# Признак конца потока в очереди stream_in_worker
+_STREAM_END = object()
+
+
+class _StreamError:
+    def __init__(self, error: BaseException):
+        self.error = error
+
+
+def stream_in_worker(produce: Callable[[], Iterable], hold: Callable[[], ContextManager]) -> Iterator:
+    """
+    Потоковая выдача фрагментов, которые производит отдельный поток
+
+    Поток-производитель сам входит в hold() (захват модели), перебирает
+    produce() и кладет фрагменты в неограниченную очередь, поэтому
+    ресурс освобождается, когда закончена генерация, а не когда потребитель
+    дочитал поток. Если потребитель ушел (генератор закрыт), производитель
+    дочитывает produce() без записи в очередь: модель занята ровно
+    на время генерации и не остается захваченной оборванным соединением.
+
+    Args:
+        produce (Callable): Возвращает итератор фрагментов; вызывается в потоке-производителе
+        hold (Callable): Возвращает контекстный менеджер, удерживаемый на время генерации
+
+    Yields:
+        Очередной фрагмент; исключение производителя поднимается у потребителя
+    """
+    chunks = queue.Queue()
+    abandoned = threading.Event()
+
+    def work():
+        try:
+            with hold():
+                for chunk in produce():
+                    if not abandoned.is_set():
+                        chunks.put(chunk)
+        except BaseException as e:
+            chunks.put(_StreamError(e))
+        finally:
+            chunks.put(_STREAM_END)
+
+    threading.Thread(target=work, name="stream-worker", daemon=True).start()
+    try:
+        while True:
+            item = chunks.get()
+            if item is _STREAM_END:
+                return
+            if isinstance(item, _StreamError):
+                raise item.error
+            yield item
+    finally:
+        abandoned.set()
+
+
+def _untrack(shm: shared_memory.SharedMemory):
+    """
+    Снятие сегмента с учета resource_tracker этого процесса
+
+    Трекер учитывает сегмент под POSIX-именем с ведущим "/", а публичное
+    shm.name (форма для SharedMemory(name=...)) - без него.
+    """
+    resource_tracker.unregister(f"/{shm.name}" if os.name == "posix" else shm.name, "shared_memory")
+
+
+def to_shared_memory(array: np.ndarray) -> dict:
+    """
+    Копирование массива в новый сегмент разделяемой памяти
+
+    Сегмент снимается с учета resource_tracker: его удаляет тот, кто
+    читает последним, иначе трекер попытается удалить его повторно.
+
+    Args:
+        array (np.ndarray): Массив для передачи
+
+    Returns:
+        dict: Имя сегмента, форма и тип данных
+    """
+    array = np.ascontiguousarray(array)
+    shm = shared_memory.SharedMemory(create=True, size=max(1, array.nbytes))
+    np.ndarray(array.shape, dtype=array.dtype, buffer=shm.buf)[...] = array
+    _untrack(shm)
+    shm.close()
+    return {"shm": shm.name, "shape": array.shape, "dtype": str(array.dtype)}
+
+
+def from_shared_memory(descriptor: dict, unlink: bool) -> np.ndarray:
+    """
+    Чтение массива из сегмента разделяемой памяти (с копированием)
+
+    Args:
+        descriptor (dict): Результат to_shared_memory
+        unlink (bool): Удалить сегмент после чтения
+
+    Returns:
+        np.ndarray: Копия массива
+    """
+    shm = shared_memory.SharedMemory(name=descriptor["shm"])
+    try:
+        array = np.ndarray(descriptor["shape"], dtype=descriptor["dtype"], buffer=shm.buf).copy()
+    finally:
+        shm.close()
+        if unlink:
+            shm.unlink()
+        else:
+            # Сегмент создан другим процессом, он же его и удалит
+            _untrack(shm)
+    return array
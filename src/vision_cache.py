@@ -0,0 +1,173 @@
+"""
+Модуль кэширования выходов визуального энкодера MiniCPM-V.
+Хранит нарезку страницы на слайсы и скрытые состояния энкодера,
+чтобы для популярных страниц оплачивалось только декодирование текста.
+"""
+
+import os
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Any, Dict, Optional
+
+import torch
+
+from src.metrics import CACHE_REQUESTS
+
+
+@dataclass
+class VisionCacheEntry:
+    """
+    Закэшированный результат обработки страницы.
+
+    Attributes:
+        image_inputs (Any): Выход image processor (слайсы, размеры, tgt_sizes)
+        vision_hidden_states (torch.Tensor): Выход ресемплера для всех слайсов страницы
+    """
+    image_inputs: Any
+    vision_hidden_states: torch.Tensor
+
+
+class VisionEncoderCache:
+    """
+    Двухуровневый кэш: LRU в памяти и опциональный уровень на диске.
+
+    Ключ записи - хэш страницы и ревизия модели, поэтому смена весов
+    автоматически инвалидирует старые записи.
+    """
+
+    def __init__(
+        self,
+        max_entries: int = 64,
+        disk_directory: Optional[str] = None
+    ):
+        """
+        Инициализация кэша
+
+        Args:
+            max_entries (int): Максимальное количество записей в памяти
+            disk_directory (str, optional): Директория для дискового уровня
+        """
+        self.max_entries = max_entries
+        self.disk_directory = disk_directory
+        self._entries: "OrderedDict[str, VisionCacheEntry]" = OrderedDict()
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+        if self.disk_directory:
+            os.makedirs(self.disk_directory, exist_ok=True)
+
+    @staticmethod
+    def make_key(page_hash: str, model_revision: str) -> str:
+        """
+        Формирование ключа записи
+
+        Args:
+            page_hash (str): Хэш содержимого страницы
+            model_revision (str): Идентификатор ревизии модели
+
+        Returns:
+            str: Ключ кэша
+        """
+        revision = model_revision.replace("/", "--")
+        return f"{revision}__{page_hash}"
+
+    def _disk_path(self, key: str) -> str:
+        return os.path.join(self.disk_directory, f"{key}.pt")
+
+    def get(self, key: str) -> Optional[VisionCacheEntry]:
+        """
+        Получение записи из кэша
+
+        Args:
+            key (str): Ключ кэша
+
+        Returns:
+            VisionCacheEntry или None: Запись, если она есть в памяти или на диске
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                CACHE_REQUESTS.labels(cache="vision", result="hit").inc()
+                return entry
+
+        if self.disk_directory and os.path.exists(self._disk_path(key)):
+            try:
+                data = torch.load(self._disk_path(key), map_location="cpu", weights_only=False)
+                entry = VisionCacheEntry(**data)
+            except Exception as e:
+                print(f"Ошибка чтения кэша {key}: {e}")
+            else:
+                self._put_memory(key, entry)
+                with self._lock:
+                    self.disk_hits += 1
+                CACHE_REQUESTS.labels(cache="vision", result="disk_hit").inc()
+                return entry
+
+        with self._lock:
+            self.misses += 1
+        CACHE_REQUESTS.labels(cache="vision", result="miss").inc()
+        return None
+
+    def put(self, key: str, entry: VisionCacheEntry):
+        """
+        Сохранение записи в кэш
+
+        Args:
+            key (str): Ключ кэша
+            entry (VisionCacheEntry): Запись для сохранения
+        """
+        entry = VisionCacheEntry(
+            image_inputs=entry.image_inputs,
+            vision_hidden_states=entry.vision_hidden_states.detach().cpu()
+        )
+        self._put_memory(key, entry)
+
+        if self.disk_directory:
+            # Запись через временный файл, чтобы параллельный читатель не увидел обрывок
+            tmp_path = self._disk_path(key) + ".tmp"
+            try:
+                torch.save(
+                    {
+                        "image_inputs": entry.image_inputs,
+                        "vision_hidden_states": entry.vision_hidden_states,
+                    },
+                    tmp_path
+                )
+                os.replace(tmp_path, self._disk_path(key))
+            except Exception as e:
+                print(f"Ошибка записи кэша {key}: {e}")
+
+    def _put_memory(self, key: str, entry: VisionCacheEntry):
+        with self._lock:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        """
+        Очистка уровня кэша в памяти
+        """
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> Dict[str, int]:
+        """
+        Статистика использования кэша
+
+        Returns:
+            dict: Количество попаданий, промахов и записей в памяти
+        """
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "entries": len(self._entries),
+            }